@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        if settings.STARTUP.get('WARM_UP', False):
+            from .services.startup_services import preload_shared_data
+            preload_shared_data()
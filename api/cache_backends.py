@@ -0,0 +1,63 @@
+import os
+import threading
+import time
+from django.core.cache.backends import filebased
+
+
+class FileBasedCache(filebased.FileBasedCache):
+    """Django's FileBasedCache, with culling that does not list the directory on every write.
+
+    Django counts the entries before each set by globbing the whole cache
+    directory, then deletes a random sample once over MAX_ENTRIES. Here the
+    count happens at most every CULL_INTERVAL seconds per process, so the cache
+    can overshoot MAX_ENTRIES by what is written in between; culling removes
+    expired entries first, then the least recently written. With MAX_ENTRIES
+    None nothing is ever culled, for entries that must stay (see the history
+    alias in settings.CACHES).
+    """
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        options = params.get("OPTIONS", {})
+        self._unbounded = options.get("MAX_ENTRIES", 300) is None
+        self._cull_interval = options.get("CULL_INTERVAL", 60)
+        self._cull_lock = threading.Lock()
+        self._next_cull = 0
+
+    def _cull(self):
+        if self._unbounded:
+            return
+        now = time.monotonic()
+        # one writer per interval counts the entries; the others go straight on
+        if now < self._next_cull or not self._cull_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_cull = now + self._cull_interval
+            filelist = self._list_cache_files()
+            if len(filelist) < self._max_entries:
+                return
+            if self._cull_frequency == 0:
+                return self.clear()
+            remaining = []
+            for fname in filelist:
+                try:
+                    with open(fname, "rb") as f:
+                        if not self._is_expired(f):
+                            remaining.append(fname)
+                except FileNotFoundError:
+                    pass
+            excess = len(remaining) - self._max_entries + int(self._max_entries / self._cull_frequency)
+            if excess <= 0:
+                return
+            remaining.sort(key=self._written_at)
+            for fname in remaining[:excess]:
+                self._delete(fname)
+        finally:
+            self._cull_lock.release()
+
+    @staticmethod
+    def _written_at(fname):
+        try:
+            return os.stat(fname).st_mtime
+        except FileNotFoundError:
+            return 0
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.services.airport_services import build_airport_store
+
+
+class Command(BaseCommand):
+    help = "Build the compact airport table used for airport lookups"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path", default=str(settings.AIRPORT_INDEX_PATH),
+            help="Where to write the table (defaults to settings.AIRPORT_INDEX_PATH)")
+
+    def handle(self, *args, **options):
+        count = build_airport_store(options["path"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {count} airports to {options['path']}"))
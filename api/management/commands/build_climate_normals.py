@@ -0,0 +1,83 @@
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.services.airport_services import get_airport_store
+from api.services.climate_services import (ClimateStore, cell_center, cell_key, fetch_cell_normals, grid_degrees,
+                                           write_climate_store)
+from api.services.rate_services import background_priority
+
+
+class Command(BaseCommand):
+    help = ("Build or refresh the climate normals used for trips beyond the forecast range. "
+            "Running workers pick up the new file within a few minutes.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path", default=str(settings.CLIMATE_NORMALS_PATH),
+            help="Where to write the store (defaults to settings.CLIMATE_NORMALS_PATH)")
+        parser.add_argument(
+            "--airports",
+            help="Comma-separated IATA codes to cover (defaults to every international airport)")
+        parser.add_argument(
+            "--years", type=int, default=settings.CLIMATE_NORMALS.get('YEARS', 10),
+            help="Number of past full years averaged into the normals")
+        parser.add_argument(
+            "--refresh", action="store_true",
+            help="Fetch every cell again instead of keeping the ones already in the store")
+        parser.add_argument("--workers", type=int, default=4, help="Concurrent archive requests")
+
+    def target_cells(self, codes, grid):
+        store = get_airport_store()
+        if codes:
+            airports = [store.get(code.strip().upper()) for code in codes.split(",")]
+            missing = [code for code, airport in zip(codes.split(","), airports) if airport is None]
+            if missing:
+                raise CommandError(f"Unknown airports: {', '.join(missing)}")
+        else:
+            airports = [airport for airport in store if "International" in airport["name"]]
+        return {cell_key(airport["lat"], airport["lon"], grid) for airport in airports}
+
+    def handle(self, *args, **options):
+        grid = grid_degrees()
+        last_year = date.today().year - 1
+        first_year = last_year - options["years"] + 1
+        keys = self.target_cells(options["airports"], grid)
+
+        cells = {}
+        if not options["refresh"]:
+            try:
+                existing = ClimateStore(options["path"])
+            except (OSError, ValueError):
+                existing = None
+            if existing is not None and existing.grid == grid and \
+                    (existing.first_year, existing.last_year) == (first_year, last_year):
+                for key in existing.keys():
+                    tmax, tmin, codes = existing.cell(key)
+                    cells[key] = (array("h", tmax), array("h", tmin), codes.tobytes())
+
+        def fetch(key):
+            lat, lon = cell_center(key, grid)
+            # interactive planner requests go first at the shared Open-Meteo governor
+            with background_priority():
+                return fetch_cell_normals(lat, lon, first_year, last_year)
+
+        pending = sorted(keys - set(cells))
+        failed = 0
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            futures = {pool.submit(fetch, key): key for key in pending}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    cells[futures[future]] = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"Cell {cell_center(futures[future], grid)}: {e}")
+                if done % 50 == 0:
+                    self.stdout.write(f"{done}/{len(pending)} cells fetched")
+
+        write_climate_store(options["path"], cells, first_year, last_year, grid)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(cells)} cells ({first_year}-{last_year}) to {options['path']}: "
+            f"{len(pending) - failed} fetched, {failed} failed"))
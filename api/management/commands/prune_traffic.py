@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.services.traffic_services import prune_traffic
+
+
+class Command(BaseCommand):
+    help = ("Delete planner traffic older than TRAFFIC_RETENTION_DAYS, which warm_caches ranks destinations by, "
+            "e.g. from cron: 30 3 * * * manage.py prune_traffic")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, help="Days of traffic to keep (defaults to TRAFFIC_RETENTION_DAYS)")
+
+    def handle(self, *args, **options):
+        deleted = prune_traffic(options["days"])
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} traffic rows"))
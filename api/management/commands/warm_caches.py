@@ -0,0 +1,32 @@
+import json
+from django.core.management.base import BaseCommand
+
+from api.services.warm_services import warm_caches
+
+
+class Command(BaseCommand):
+    help = ("Prefetch city guides, weather and popular flight searches for the top destinations, "
+            "e.g. from cron: */30 * * * * manage.py warm_caches --report /var/log/warm_caches.json")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--destinations",
+            help="Comma-separated IATA codes to warm (defaults to the top destinations of recent traffic)")
+        parser.add_argument("--days", type=int, help="Days of traffic to rank destinations and routes by")
+        parser.add_argument("--limit", type=int, help="Number of top destinations to warm")
+        parser.add_argument("--routes", type=int, help="Number of top flight searches to warm")
+        parser.add_argument("--workers", type=int, help="Concurrent warm-ups")
+        parser.add_argument("--report", help="Write the JSON report to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        destinations = [code.strip() for code in options["destinations"].split(",") if code.strip()] \
+            if options["destinations"] else None
+        report = warm_caches(destinations, options["days"], options["limit"], options["routes"], options["workers"])
+
+        if options["report"]:
+            with open(options["report"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f"Warmed in {report['seconds']}s: {report['summary']}; report written to {options['report']}"))
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
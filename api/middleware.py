@@ -0,0 +1,201 @@
+import cProfile
+import random
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.middleware import gzip
+from rest_framework.exceptions import APIException
+
+from auth.authentication import ClaimsJWTAuthentication, JWTCookieAuthentication
+from .services.metrics_services import request_timings
+from .services.profiling_services import (enable_profile, request_profiles, start_allocation_tracing,
+                                          stop_allocation_tracing, write_profile)
+
+
+class GZipMiddleware(gzip.GZipMiddleware):
+    """Django's GZipMiddleware, minus the planner event streams.
+
+    gzip holds back what it is given until it has a block worth emitting, so a
+    compressed stream would reach the client in one piece at the end instead of
+    section by section.
+    """
+
+    uncompressed_types = ('text/event-stream', 'application/x-ndjson')
+
+    def process_response(self, request, response):
+        if response.streaming and response.get("Content-Type", "").startswith(self.uncompressed_types):
+            return response
+        return super().process_response(request, response)
+
+
+class ServerTimingMiddleware:
+    """Reports the upstream calls and serialization timed during a request in a Server-Timing header.
+
+    Calls made more than once (e.g. one Amadeus search per flexible date) are
+    summed into one entry, with the number of calls in its description.
+    Streaming responses are left alone, since their headers go out first.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = []
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self.add_header(response, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        timings = []
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self.add_header(response, timings, time.perf_counter() - started)
+
+    def add_header(self, response, timings, total):
+        if response.streaming:
+            return response
+        durations, calls = {}, {}
+        for name, seconds in timings:
+            durations[name] = durations.get(name, 0) + seconds
+            calls[name] = calls.get(name, 0) + 1
+        entries = []
+        for name, seconds in durations.items():
+            entry = f"{name};dur={seconds * 1000:.1f}"
+            if calls[name] > 1:
+                entry += f';desc="{calls[name]} calls"'
+            entries.append(entry)
+        entries.append(f"total;dur={total * 1000:.1f}")
+        if response.has_header("Server-Timing"):
+            entries.insert(0, response["Server-Timing"])
+        response["Server-Timing"] = ", ".join(entries)
+        return response
+
+
+def is_staff_request(request):
+    """Whether the request carries a valid token of a staff user (from its claims, see TOKEN_CLAIMS_USER)."""
+    for authentication in (JWTCookieAuthentication(), ClaimsJWTAuthentication()):
+        try:
+            result = authentication.authenticate(request)
+        except APIException:
+            return False
+        if result is not None:
+            return bool(getattr(result[0], "is_staff", False))
+    return False
+
+
+class ProfilingMiddleware:
+    """Profiles a sample of requests, and those of staff users sending the PROFILING HEADER.
+
+    A profiled request gets a cProfile profile (merged with the planner
+    sections it ran on the pool) and, with TRACE_ALLOCATIONS, the allocation
+    sites that grew while it ran; both are written to OUTPUT_DIR and named in
+    the X-Profile-Id response header. Unless PROFILING["ENABLED"] is set the
+    middleware removes itself at startup, so it costs nothing when off.
+
+    Under ASGI the event loop thread is profiled, which includes whatever
+    other requests ran on the loop meanwhile. On Python 3.12+ only one
+    profiler can run per process, so a request picked while another is being
+    profiled is served unprofiled.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        options = settings.PROFILING
+        if not options.get('ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = options.get('SAMPLE_RATE', 0)
+        self.header = "HTTP_" + options.get('HEADER', 'X-Profile').upper().replace("-", "_")
+        self.trace_allocations = options.get('TRACE_ALLOCATIONS', True)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def trigger(self, request):
+        if self.header in request.META and is_staff_request(request):
+            return "header"
+        return "sampling" if self.sampled() else None
+
+    def start(self):
+        """Start profiling the request; None when another profiler is active, and it runs unprofiled."""
+        profiles = []
+        token = request_profiles.set(profiles)
+        before = start_allocation_tracing() if self.trace_allocations else None
+        profile = cProfile.Profile()
+        profiles.append(profile)
+        if not enable_profile(profile):
+            request_profiles.reset(token)
+            if before is not None:
+                stop_allocation_tracing(before)
+            return None
+        return profile, profiles, token, before
+
+    def stop(self, profile, token, before):
+        profile.disable()
+        request_profiles.reset(token)
+        return stop_allocation_tracing(before) if before is not None else None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trigger = self.trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+
+        profiling = self.start()
+        if profiling is None:
+            return self.get_response(request)
+        profile, profiles, token, before = profiling
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            allocations = self.stop(profile, token, before)
+        name = write_profile(request, response.status_code, time.perf_counter() - started, profiles, allocations,
+                             trigger)
+        if name is not None:
+            response["X-Profile-Id"] = name
+        return response
+
+    async def __acall__(self, request):
+        if self.header in request.META:
+            trigger = await sync_to_async(self.trigger)(request)
+        else:
+            trigger = "sampling" if self.sampled() else None
+        if trigger is None:
+            return await self.get_response(request)
+
+        profiling = self.start()
+        if profiling is None:
+            return await self.get_response(request)
+        profile, profiles, token, before = profiling
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            allocations = self.stop(profile, token, before)
+        name = await sync_to_async(write_profile)(
+            request, response.status_code, time.perf_counter() - started, profiles, allocations, trigger)
+        if name is not None:
+            response["X-Profile-Id"] = name
+        return response
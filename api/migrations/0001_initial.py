@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-17 23:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripTraffic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('origin', models.CharField(max_length=3)),
+                ('destination', models.CharField(max_length=3)),
+                ('departure_date', models.DateField()),
+                ('trip_days', models.PositiveIntegerField()),
+                ('requests', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day'], name='api_triptra_day_2c8410_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'origin', 'destination', 'departure_date', 'trip_days'), name='unique_trip_traffic')],
+            },
+        ),
+    ]
@@ -1,3 +1,23 @@
 from django.db import models
 
-# Create your models here.
+
+class TripTraffic(models.Model):
+    """Planner requests per day and trip; warm_caches prefetches the most requested ones."""
+
+    day = models.DateField()
+    origin = models.CharField(max_length=3)
+    destination = models.CharField(max_length=3)
+    departure_date = models.DateField()
+    trip_days = models.PositiveIntegerField()
+    requests = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "origin", "destination", "departure_date", "trip_days"],
+                name="unique_trip_traffic"),
+        ]
+        indexes = [models.Index(fields=["day"])]
+
+    def __str__(self):
+        return f"{self.day} {self.origin}-{self.destination} {self.departure_date} ({self.requests})"
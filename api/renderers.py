@@ -0,0 +1,32 @@
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.renderers import BaseRenderer
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Server-sent events, one event per planner section; see travel_planner_stream."""
+
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def event(self, name, data):
+        return f"event: {name}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n".encode()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # only reached for responses DRF builds itself, such as authentication errors
+        return self.event("error", data)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Newline-delimited JSON, one `{"event": ..., "data": ...}` object per line."""
+
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def event(self, name, data):
+        return json.dumps({"event": name, "data": data}, cls=DjangoJSONEncoder).encode() + b"\n"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return self.event("error", data)
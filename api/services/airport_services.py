@@ -0,0 +1,320 @@
+import heapq
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+import airportsdata
+from django.conf import settings
+
+# file layout: header, a 26^3 slot table indexed by IATA code, fixed-size records, then a utf-8 string blob
+MAGIC = b"APT1"
+HEADER = struct.Struct("<4sI16s")  # magic, record count, airportsdata version
+SLOT = struct.Struct("<i")  # record number, -1 when the code is unused
+SLOT_COUNT = 26 ** 3
+# iata, country, name offset/length, city offset/length, lat, lon
+RECORD = struct.Struct("<3s2sIHIHdd")
+
+_store = None
+_store_lock = threading.Lock()
+_prefix_index = None
+_spatial_index = None
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def _slot(code):
+    if not isinstance(code, str) or len(code) != 3:
+        return None
+    slot = 0
+    for char in code:
+        if not "A" <= char <= "Z":
+            return None
+        slot = slot * 26 + ord(char) - 65
+    return slot
+
+
+def build_airport_store(path):
+    """Write the compact airport table for the installed airportsdata release."""
+    airports = airportsdata.load('IATA')
+    codes = sorted(code for code in airports if _slot(code) is not None)
+
+    slots = [-1] * SLOT_COUNT
+    records = bytearray()
+    strings = bytearray()
+
+    def add_string(value):
+        offset = len(strings)
+        strings.extend(value.encode())
+        return offset, len(strings) - offset
+
+    for number, code in enumerate(codes):
+        airport = airports[code]
+        slots[_slot(code)] = number
+        name_offset, name_length = add_string(airport['name'])
+        city_offset, city_length = add_string(airport['city'])
+        records += RECORD.pack(
+            code.encode(), airport['country'].encode(),
+            name_offset, name_length, city_offset, city_length,
+            airport['lat'], airport['lon'])
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write next to the target and swap it in, so running workers keep their mapping
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(codes), airportsdata.__version__.encode()))
+        f.write(struct.pack(f"<{SLOT_COUNT}i", *slots))
+        f.write(records)
+        f.write(strings)
+    os.replace(tmp_path, path)
+    return len(codes)
+
+
+class AirportStore:
+    """Read-only, memory-mapped airport table with O(1) IATA lookups.
+
+    The file is mapped rather than read, so forked workers share its pages
+    through the OS page cache instead of each holding its own copy.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, version = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an airport store")
+        self.version = version.rstrip(b"\0").decode()
+        self._records_offset = HEADER.size + SLOT.size * SLOT_COUNT
+        self._strings_offset = self._records_offset + RECORD.size * self.count
+
+    def __len__(self):
+        return self.count
+
+    def _string(self, offset, length):
+        start = self._strings_offset + offset
+        return self._map[start:start + length].decode()
+
+    def record(self, number):
+        iata, country, name_offset, name_length, city_offset, city_length, lat, lon = RECORD.unpack_from(
+            self._map, self._records_offset + RECORD.size * number)
+        return {
+            "iata": iata.decode(),
+            "name": self._string(name_offset, name_length),
+            "city": self._string(city_offset, city_length),
+            "country": country.decode(),
+            "lat": lat,
+            "lon": lon,
+        }
+
+    def get(self, code):
+        slot = _slot(code)
+        if slot is None:
+            return None
+        number, = SLOT.unpack_from(self._map, HEADER.size + SLOT.size * slot)
+        if number < 0:
+            return None
+        return self.record(number)
+
+    def __iter__(self):
+        for number in range(self.count):
+            yield self.record(number)
+
+
+def _is_current(path):
+    try:
+        with open(path, "rb") as f:
+            magic, _, version = HEADER.unpack(f.read(HEADER.size))
+    except (OSError, struct.error):
+        return False
+    return magic == MAGIC and version.rstrip(b"\0").decode() == airportsdata.__version__
+
+
+def get_airport_store():
+    """Open the airport store on first use, building it if it is missing or outdated."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                path = str(settings.AIRPORT_INDEX_PATH)
+                if not _is_current(path):
+                    build_airport_store(path)
+                _store = AirportStore(path)
+    return _store
+
+
+def normalize_search_text(value):
+    """Casefold and strip accents, so "zurich" finds "Zürich"."""
+    decomposed = unicodedata.normalize("NFKD", value)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).casefold().strip()
+
+
+def is_minor_airport(airport):
+    """Airfields without "International" in their name; often closer, but rarely what a traveller flies into."""
+    return "international" not in normalize_search_text(airport["name"])
+
+
+def rank_destinations(airports):
+    """Nearest airports in the order a trip would pick them: international airports first, then by distance."""
+    return sorted(airports, key=lambda airport: (is_minor_airport(airport), airport["distance_km"]))
+
+
+class AirportPrefixIndex:
+    """Prefix search over airport codes, cities and names.
+
+    Terms are kept in sorted lists, one per match kind, so a lookup is a
+    bisect followed by a bounded forward scan. Matches rank by kind (code,
+    city, airport name, then any other word of the city or name), then exact
+    over partial matches, international airports first, and shorter terms
+    first.
+    """
+
+    KINDS = ("code", "city", "name", "word")
+    # matches looked at per kind for every result requested
+    SCAN_FACTOR = 20
+
+    def __init__(self, store):
+        self.store = store
+        entries = {kind: [] for kind in self.KINDS}
+        self._minor = array("b")
+        for number, airport in enumerate(store):
+            city = normalize_search_text(airport["city"])
+            name = normalize_search_text(airport["name"])
+            self._minor.append(is_minor_airport(airport))
+            entries["code"].append((airport["iata"].casefold(), number))
+            if city:
+                entries["city"].append((city, number))
+            entries["name"].append((name, number))
+            words = set(re.findall(r"\w{3,}", f"{city} {name}")) - {city, name}
+            entries["word"].extend((word, number) for word in words)
+
+        self._terms = {}
+        self._numbers = {}
+        for kind, kind_entries in entries.items():
+            kind_entries.sort()
+            self._terms[kind] = [term for term, _ in kind_entries]
+            self._numbers[kind] = array("i", (number for _, number in kind_entries))
+
+    def search(self, query, limit=10):
+        prefix = normalize_search_text(query)
+        if not prefix:
+            return []
+
+        candidates = {}
+        for rank, kind in enumerate(self.KINDS):
+            # a match of a later kind can never outrank one already found
+            if len(candidates) >= limit:
+                break
+            terms, numbers = self._terms[kind], self._numbers[kind]
+            position = bisect_left(terms, prefix)
+            end = min(position + limit * self.SCAN_FACTOR, len(terms))
+            while position < end and terms[position].startswith(prefix):
+                term, number = terms[position], numbers[position]
+                position += 1
+                key = (rank, term != prefix, self._minor[number], len(term), term)
+                if number not in candidates or key < candidates[number]:
+                    candidates[number] = key
+
+        ranked = sorted(candidates, key=candidates.get)[:limit]
+        return [self.store.record(number) for number in ranked]
+
+
+def get_airport_prefix_index():
+    """Build the prefix index from the airport store on first use."""
+    global _prefix_index
+    if _prefix_index is None:
+        store = get_airport_store()
+        with _store_lock:
+            if _prefix_index is None:
+                _prefix_index = AirportPrefixIndex(store)
+    return _prefix_index
+
+
+def unit_vector(lat, lon):
+    lat, lon = math.radians(lat), math.radians(lon)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+
+def km_to_chord(km):
+    return 2 * math.sin(min(km / (2 * EARTH_RADIUS_KM), math.pi / 2))
+
+
+class AirportSpatialIndex:
+    """Nearest-airport search with a k-d tree over points on the unit sphere.
+
+    Airports are mapped to 3D unit vectors, so straight-line (chord) distance
+    orders them exactly like great-circle distance and there is no seam at the
+    antimeridian. The tree is implicit: `_order` holds record numbers laid out
+    so that the middle of every range is the splitting node of that range.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._coords = [unit_vector(airport["lat"], airport["lon"]) for airport in store]
+        self._order = array("i", range(len(self._coords)))
+        self._build(0, len(self._order), 0)
+
+    def _build(self, lo, hi, axis):
+        if hi - lo <= 1:
+            return
+        coords = self._coords
+        self._order[lo:hi] = array("i", sorted(self._order[lo:hi], key=lambda number: coords[number][axis]))
+        mid = (lo + hi) // 2
+        self._build(lo, mid, (axis + 1) % 3)
+        self._build(mid + 1, hi, (axis + 1) % 3)
+
+    def nearest(self, lat, lon, radius_km=100, limit=5):
+        """Airports within `radius_km` of a point, closest first, with their distance."""
+        target = unit_vector(lat, lon)
+        max_distance = km_to_chord(radius_km) ** 2
+        # max-heap of the best matches so far, as (-squared chord distance, record number)
+        best = []
+        coords = self._coords
+
+        def bound():
+            return -best[0][0] if len(best) >= limit else max_distance
+
+        def visit(lo, hi, axis):
+            if lo >= hi:
+                return
+            mid = (lo + hi) // 2
+            number = self._order[mid]
+            point = coords[number]
+            distance = sum((point[i] - target[i]) ** 2 for i in range(3))
+            if distance <= bound():
+                heapq.heappush(best, (-distance, number))
+                if len(best) > limit:
+                    heapq.heappop(best)
+
+            delta = target[axis] - point[axis]
+            near, far = ((lo, mid), (mid + 1, hi)) if delta < 0 else ((mid + 1, hi), (lo, mid))
+            visit(*near, (axis + 1) % 3)
+            if delta * delta <= bound():
+                visit(*far, (axis + 1) % 3)
+
+        visit(0, len(self._order), 0)
+
+        results = []
+        for negative_distance, number in sorted(best, reverse=True):
+            airport = self.store.record(number)
+            airport["distance_km"] = round(chord_to_km(math.sqrt(-negative_distance)), 1)
+            results.append(airport)
+        return results
+
+
+def get_airport_spatial_index():
+    """Build the spatial index from the airport store on first use."""
+    global _spatial_index
+    if _spatial_index is None:
+        store = get_airport_store()
+        with _store_lock:
+            if _spatial_index is None:
+                _spatial_index = AirportSpatialIndex(store)
+    return _spatial_index
@@ -0,0 +1,178 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+from .rate_services import QuotaExceeded, background_priority
+
+# refreshes of stale cache entries, run once their provider recovers
+refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='breaker-refresh')
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitOpen(Exception):
+    """The provider's breaker is open; the call was not attempted."""
+
+    def __init__(self, provider, retry_after):
+        super().__init__(f"{provider} is unavailable, retry in {retry_after}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+def is_upstream_failure(error):
+    """Whether an exception says something about the provider's health.
+
+    Client errors (4xx other than 429) are the caller's fault, our own quota
+    and breaker rejections never reached the provider, and a cancelled call
+    was given up on by us.
+    """
+    if not isinstance(error, Exception) or isinstance(error, (QuotaExceeded, CircuitOpen)):
+        return False
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int) and 400 <= status < 500 and status != 429:
+        return False
+    return True
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one upstream provider.
+
+    After `failure_threshold` consecutive failures the breaker opens and calls
+    fail fast with CircuitOpen. Once `reset_timeout` seconds have passed it lets
+    a single probe through (half-open): success closes it again and runs the
+    refreshes queued while it was open, failure reopens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold, reset_timeout, max_pending_refreshes=1000):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_pending_refreshes = max_pending_refreshes
+
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._probing = False
+        self._pending_refreshes = {}
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        """Whether a call may go to the provider right now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_after(self):
+        return max(1, round(self._opened_at + self.reset_timeout - time.monotonic()))
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpen(self.name, self.retry_after())
+
+    def record_success(self):
+        with self._lock:
+            recovered = self.state != self.CLOSED
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+            refreshes, self._pending_refreshes = self._pending_refreshes, {}
+        if recovered:
+            for refresh in refreshes.values():
+                refresh_executor.submit(run_in_background, refresh)
+
+    def record_failure(self, error):
+        if not is_upstream_failure(error):
+            with self._lock:
+                # not the provider's fault; a half-open breaker lets the next call probe
+                self._probing = False
+            return
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def call(self, fn):
+        self.check()
+        try:
+            result = fn()
+        except BaseException as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+    async def acall(self, coroutine_fn):
+        self.check()
+        try:
+            result = await coroutine_fn()
+        except BaseException as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+    def refresh_on_recovery(self, key, refresh):
+        """Queue `refresh` to run once the breaker closes again; ignored while it is closed."""
+        with self._lock:
+            if self.state == self.CLOSED or len(self._pending_refreshes) >= self.max_pending_refreshes:
+                return
+            self._pending_refreshes[key] = refresh
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self._failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+                "pending_refreshes": len(self._pending_refreshes),
+            }
+
+
+def run_in_background(refresh):
+    with background_priority():
+        try:
+            refresh()
+        except Exception as e:
+            print(f"Background refresh error: {e}")
+
+
+def get_breaker(provider):
+    """The breaker for `provider`, configured from settings.CIRCUIT_BREAKERS."""
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(provider)
+            if breaker is None:
+                options = settings.CIRCUIT_BREAKERS.get(provider, {})
+                breaker = _breakers[provider] = CircuitBreaker(
+                    provider,
+                    failure_threshold=options.get('FAILURE_THRESHOLD', 5),
+                    reset_timeout=options.get('RESET_TIMEOUT', 30),
+                )
+    return breaker
+
+
+def breaker_stats():
+    """State and counters of every breaker in this process, by provider."""
+    return {provider: breaker.stats() for provider, breaker in list(_breakers.items())}
@@ -0,0 +1,270 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from contextvars import ContextVar
+from cachetools import LRUCache
+from django.conf import settings
+from django.core.cache import caches
+
+from .breaker_services import CircuitOpen, is_upstream_failure
+from .rate_services import QuotaExceeded
+
+# returned by TwoTierCache.get on a miss, since None can be a legitimate cached value
+MISSING = object()
+
+# list collecting the keys served from a stale copy, set per planner section by run_sections
+stale_keys = ContextVar("stale_keys", default=None)
+
+_registry = {}
+
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into a single call.
+
+    The first caller runs the function; callers arriving while it is in flight
+    wait for and share its result (or exception). Threads and event loops are
+    coalesced separately, since an asyncio future belongs to one loop.
+
+    Followers wait at most `wait_timeout` seconds (TRAVEL_CACHE COALESCE_WAIT
+    by default) and then raise TimeoutError, so a hung leader does not hold
+    every caller of its key.
+    """
+
+    def __init__(self, wait_timeout=None):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self.wait_timeout = wait_timeout or settings.TRAVEL_CACHE.get('COALESCE_WAIT', 30)
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            try:
+                return call.result(timeout=self.wait_timeout)
+            except TimeoutError:
+                raise TimeoutError(f"gave up waiting for coalesced call {key!r}") from None
+
+        try:
+            result = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def ado(self, key, coroutine_fn):
+        loop = asyncio.get_running_loop()
+        call_key = (id(loop), key)
+        call = self._async_calls.get(call_key)
+        if call is not None:
+            try:
+                return await asyncio.wait_for(asyncio.shield(call), self.wait_timeout)
+            except TimeoutError:
+                raise TimeoutError(f"gave up waiting for coalesced call {key!r}") from None
+
+        call = self._async_calls[call_key] = loop.create_future()
+        try:
+            result = await coroutine_fn()
+        except BaseException as e:
+            # a cancelled leader (e.g. a section deadline) must not cancel its followers
+            if isinstance(e, asyncio.CancelledError):
+                e = RuntimeError(f"coalesced call for {key!r} was cancelled")
+            call.set_exception(e)
+            # retrieve it so a leader without followers does not log "never retrieved"
+            call.exception()
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            del self._async_calls[call_key]
+
+
+class TwoTierCache:
+    """An in-process LRU in front of a shared Django cache.
+
+    Values are stored in both tiers together with their absolute expiry, so a
+    value promoted from the shared tier keeps its original deadline. A timeout
+    of None keeps the value forever.
+
+    Unless `keep_stale` is false, values that expire also leave a last known
+    good copy in the shared tier, kept for STALE_TTL, which get_or_fetch falls
+    back to while the provider behind its breaker is failing.
+
+    The async methods run the shared tier on the loop's default executor:
+    Django's own aget/aset go through one thread-sensitive thread, which every
+    async cache lookup of the process would queue for.
+    """
+
+    def __init__(self, namespace, maxsize=None, alias='default', keep_stale=True):
+        self.namespace = namespace
+        self.alias = alias
+        self.keep_stale = keep_stale
+        self._local = LRUCache(
+            maxsize=maxsize or settings.TRAVEL_CACHE.get('LOCAL_MAXSIZE', 1024))
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._flight = SingleFlight()
+        _registry[namespace] = self
+
+    def _shared_key(self, key):
+        return f"{self.namespace}:{key}"
+
+    def _stale_key(self, key):
+        return f"stale:{self.namespace}:{key}"
+
+    def _stale_timeout(self):
+        return settings.TRAVEL_CACHE.get('STALE_TTL', 60 * 60 * 24 * 7)
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.time()):
+                self.local_hits += 1
+                return entry[1]
+        return MISSING
+
+    def _promote(self, key, entry):
+        with self._lock:
+            if entry is None or (entry[0] is not None and entry[0] <= time.time()):
+                self.misses += 1
+                return MISSING
+            self.shared_hits += 1
+            self._local[key] = entry
+        return entry[1]
+
+    def _entry(self, key, value, timeout):
+        entry = (None if timeout is None else time.time() + timeout, value)
+        with self._lock:
+            self._local[key] = entry
+        return entry
+
+    def _get_shared(self, key):
+        return self._promote(key, caches[self.alias].get(self._shared_key(key)))
+
+    def _set_shared(self, key, entry, timeout):
+        cache = caches[self.alias]
+        cache.set(self._shared_key(key), entry, timeout)
+        if self.keep_stale and timeout is not None:
+            cache.set(self._stale_key(key), entry[1], self._stale_timeout())
+
+    def get(self, key):
+        value = self._get_local(key)
+        if value is MISSING:
+            value = self._get_shared(key)
+        return value
+
+    def set(self, key, value, timeout):
+        self._set_shared(key, self._entry(key, value, timeout), timeout)
+
+    def get_stale(self, key):
+        """The last value stored under `key`, expired or not; MISSING if there is none."""
+        with self._lock:
+            entry = self._local.get(key)
+        if entry is not None:
+            return entry[1]
+        entry = caches[self.alias].get(self._shared_key(key))
+        if entry is not None:
+            return entry[1]
+        return caches[self.alias].get(self._stale_key(key), MISSING)
+
+    async def aget(self, key):
+        value = self._get_local(key)
+        if value is MISSING:
+            value = await asyncio.to_thread(self._get_shared, key)
+        return value
+
+    async def aset(self, key, value, timeout):
+        await asyncio.to_thread(self._set_shared, key, self._entry(key, value, timeout), timeout)
+
+    def _serve_stale(self, key, error, breaker, refresh):
+        """Fall back to the stale copy when `error` means the provider is unavailable."""
+        if not isinstance(error, (CircuitOpen, QuotaExceeded)) and not is_upstream_failure(error):
+            return MISSING
+        value = self.get_stale(key)
+        if value is not MISSING:
+            keys = stale_keys.get()
+            if keys is not None:
+                keys.append(key)
+            breaker.refresh_on_recovery(self._shared_key(key), refresh)
+        return value
+
+    def get_or_fetch(self, key, fetch, timeout, cacheable=bool, breaker=None):
+        """Return the cached value or fetch it once, however many callers miss together.
+
+        Values for which `cacheable` is false (and fetches that raise) are
+        handed to the waiting callers but never stored. With a `breaker`, the
+        fetch goes through it, and a failing or rejected fetch is answered from
+        the stale copy when there is one (see `stale_keys`); the entry is
+        then refreshed in the background once the breaker closes again.
+        """
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+
+        def load():
+            value = fetch() if breaker is None else breaker.call(fetch)
+            if cacheable(value):
+                self.set(key, value, timeout)
+            return value
+        try:
+            return self._flight.do(key, load)
+        except Exception as e:
+            if breaker is None:
+                raise
+            value = self._serve_stale(
+                key, e, breaker, lambda: self.get_or_fetch(key, fetch, timeout, cacheable, breaker))
+            if value is MISSING:
+                raise
+            return value
+
+    async def aget_or_fetch(self, key, fetch, timeout, cacheable=bool, breaker=None):
+        """Async counterpart of get_or_fetch; `fetch` returns a coroutine."""
+        value = await self.aget(key)
+        if value is not MISSING:
+            return value
+
+        async def load():
+            value = await fetch() if breaker is None else await breaker.acall(fetch)
+            if cacheable(value):
+                await self.aset(key, value, timeout)
+            return value
+        try:
+            return await self._flight.ado(key, load)
+        except Exception as e:
+            if breaker is None:
+                raise
+            # the background refresh runs on a pool thread, outside of any event loop
+            value = await asyncio.to_thread(
+                self._serve_stale,
+                key, e, breaker, lambda: asyncio.run(self.aget_or_fetch(key, fetch, timeout, cacheable, breaker)))
+            if value is MISSING:
+                raise
+            return value
+
+    def stats(self):
+        with self._lock:
+            hits = self.local_hits + self.shared_hits
+            total = hits + self.misses
+            return {
+                "local_hits": self.local_hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_ratio": round(hits / total, 4) if total else None,
+            }
+
+
+def cache_stats():
+    """Hit/miss counters of every cache created in this process, by namespace."""
+    return {namespace: cache.stats() for namespace, cache in _registry.items()}
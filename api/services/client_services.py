@@ -0,0 +1,36 @@
+import os
+import threading
+
+# SDK clients by name, built by their factory on first use instead of at import
+_factories = {}
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def register_client(name, factory):
+    """Register how to build the client `name`; it is only called the first time get_client(name) is."""
+    _factories[name] = factory
+
+
+def get_client(name):
+    """Return the shared client `name`, building it on first use."""
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _factories[name]()
+                _clients[name] = client
+    return client
+
+
+def _forget_clients_after_fork():
+    """Have a forked worker build its own clients: the connection pools of the parent's are not its to use."""
+    global _clients_lock
+    # the parent's lock may have been held by another thread at fork time
+    _clients_lock = threading.Lock()
+    _clients.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_clients_after_fork)
@@ -0,0 +1,232 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from datetime import date, timedelta
+from django.conf import settings
+
+from .http_services import http_request
+from .metrics_services import timed
+from .rate_services import get_governor
+
+# file layout: header, sorted int64 cell keys, then one block per cell in the same order:
+# 366 int16 mean daily max (tenths of a degree), 366 int16 mean daily min, 366 uint8 dominant weather code
+MAGIC = b"CLM1"
+HEADER = struct.Struct("<4sIHHd4x")  # magic, cell count, first year, last year, grid degrees; 8-byte aligned
+DAYS = 366
+BLOCK_SIZE = DAYS * 2 * 2 + DAYS
+NO_TEMPERATURE = -32768
+NO_CODE = 255
+
+# how often a worker looks for a new or rebuilt store on disk, in seconds
+RELOAD_INTERVAL = 300
+
+_store = None
+_store_lock = threading.Lock()
+# "at" is a time.monotonic() reading; it counts from boot, so the first call must always look
+_store_checked = {"at": float("-inf"), "mtime": None}
+
+
+def grid_degrees():
+    return settings.CLIMATE_NORMALS.get('GRID_DEGREES', 0.25)
+
+
+def cell_key(lat, lon, grid):
+    lon_cells = round(360 / grid)
+    return round((lat + 90) / grid) * lon_cells + round((lon + 180) / grid) % lon_cells
+
+
+def cell_center(key, grid):
+    lon_cells = round(360 / grid)
+    return round(key // lon_cells * grid - 90, 4), round(key % lon_cells * grid - 180, 4)
+
+
+def day_of_year(day):
+    """Index of a date's month and day in a leap year, so February 29 has a slot of its own."""
+    return date(2000, day.month, day.day).timetuple().tm_yday - 1
+
+
+def day_runs(start, end):
+    """Contiguous day-of-year ranges covering start..end inclusive, split where the year wraps."""
+    runs = []
+    day = start
+    while day <= end:
+        first = day_of_year(day)
+        last = first
+        while day < end and day_of_year(day + timedelta(days=1)) == last + 1:
+            day += timedelta(days=1)
+            last += 1
+        runs.append((first, last + 1))
+        day += timedelta(days=1)
+    return runs
+
+
+def fetch_cell_normals(lat, lon, first_year, last_year):
+    """Daily normals of one cell from the Open-Meteo archive, as (tmax, tmin, codes) per day of year."""
+    url = settings.UPSTREAMS.get('OPEN_METEO_ARCHIVE_URL', "https://archive-api.open-meteo.com/v1/archive")
+    with get_governor("open_meteo").limit(), timed("open_meteo_archive"):
+        response = http_request("GET", url, params={
+            "latitude": lat,
+            "longitude": lon,
+            "start_date": f"{first_year}-01-01",
+            "end_date": f"{last_year}-12-31",
+            "daily": "weather_code,temperature_2m_max,temperature_2m_min",
+            "timezone": "auto",
+        }, timeout=(5, 60))
+        response.raise_for_status()
+    daily = response.json()["daily"]
+
+    max_sums, min_sums = [0.0] * DAYS, [0.0] * DAYS
+    max_counts, min_counts = [0] * DAYS, [0] * DAYS
+    codes = [Counter() for _ in range(DAYS)]
+    for day, high, low, code in zip(daily["time"], daily["temperature_2m_max"],
+                                    daily["temperature_2m_min"], daily["weather_code"]):
+        index = day_of_year(date.fromisoformat(day))
+        if high is not None:
+            max_sums[index] += high
+            max_counts[index] += 1
+        if low is not None:
+            min_sums[index] += low
+            min_counts[index] += 1
+        if code is not None:
+            codes[index][code] += 1
+
+    tmax = array("h", (round(max_sums[i] / max_counts[i] * 10) if max_counts[i] else NO_TEMPERATURE
+                       for i in range(DAYS)))
+    tmin = array("h", (round(min_sums[i] / min_counts[i] * 10) if min_counts[i] else NO_TEMPERATURE
+                       for i in range(DAYS)))
+    dominant = bytes(codes[i].most_common(1)[0][0] if codes[i] else NO_CODE for i in range(DAYS))
+    return tmax, tmin, dominant
+
+
+def write_climate_store(path, cells, first_year, last_year, grid):
+    """Write `cells` ({cell key: (tmax, tmin, codes)}) atomically, like build_airport_store."""
+    keys = sorted(cells)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(keys), first_year, last_year, grid))
+        f.write(array("q", keys).tobytes())
+        for key in keys:
+            tmax, tmin, codes = cells[key]
+            f.write(tmax.tobytes())
+            f.write(tmin.tobytes())
+            f.write(codes)
+    os.replace(tmp_path, path)
+
+
+class ClimateStore:
+    """Read-only, memory-mapped daily climate normals per grid cell.
+
+    Each cell holds one value per day of the year, so a trip window is one
+    or two contiguous slices of the mapping, aggregated in place without a
+    network round-trip or any parsing.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.first_year, self.last_year, self.grid = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a climate store")
+        view = memoryview(self._map)
+        self._keys = view[HEADER.size:HEADER.size + 8 * self.count].cast("q")
+        self._blocks_offset = HEADER.size + 8 * self.count
+        self._view = view
+
+    def __len__(self):
+        return self.count
+
+    def keys(self):
+        return list(self._keys)
+
+    def cell(self, key):
+        """(tmax, tmin, codes) views of a cell, or None if the store does not cover it."""
+        position = bisect_left(self._keys, key)
+        if position == self.count or self._keys[position] != key:
+            return None
+        start = self._blocks_offset + BLOCK_SIZE * position
+        return (
+            self._view[start:start + DAYS * 2].cast("h"),
+            self._view[start + DAYS * 2:start + DAYS * 4].cast("h"),
+            self._view[start + DAYS * 4:start + BLOCK_SIZE],
+        )
+
+    def lookup(self, lat, lon):
+        return self.cell(cell_key(lat, lon, self.grid))
+
+    def daily(self, lat, lon, start, end):
+        """Normals for every date of start..end, as (date, max, min, weather code); None outside the store."""
+        cell = self.lookup(lat, lon)
+        if cell is None:
+            return None
+        tmax, tmin, codes = cell
+        days = []
+        day = start
+        while day <= end:
+            index = day_of_year(day)
+            days.append((
+                day,
+                tmax[index] / 10 if tmax[index] != NO_TEMPERATURE else None,
+                tmin[index] / 10 if tmin[index] != NO_TEMPERATURE else None,
+                codes[index] if codes[index] != NO_CODE else None,
+            ))
+            day += timedelta(days=1)
+        return days
+
+    def summary(self, lat, lon, start, end):
+        """Mean, lowest and highest normal temperature and the dominant weather code over start..end."""
+        cell = self.lookup(lat, lon)
+        if cell is None:
+            return None
+        tmax, tmin, codes = cell
+        highs, lows, window_codes = [], [], Counter()
+        for first, last in day_runs(start, end):
+            highs += tmax[first:last].tolist()
+            lows += tmin[first:last].tolist()
+            window_codes.update(codes[first:last].tobytes())
+        if NO_TEMPERATURE in highs or NO_TEMPERATURE in lows:
+            highs = [value for value in highs if value != NO_TEMPERATURE]
+            lows = [value for value in lows if value != NO_TEMPERATURE]
+        window_codes.pop(NO_CODE, None)
+        if not highs or not lows:
+            return None
+        return {
+            "temp_mean": round((sum(highs) + sum(lows)) / (len(highs) + len(lows)) / 10, 1),
+            "temp_max_mean": round(sum(highs) / len(highs) / 10, 1),
+            "temp_min_mean": round(sum(lows) / len(lows) / 10, 1),
+            "temp_max": max(highs) / 10,
+            "temp_min": min(lows) / 10,
+            "weather_code": window_codes.most_common(1)[0][0] if window_codes else None,
+        }
+
+
+def get_climate_store():
+    """The climate store, or None until `manage.py build_climate_normals` has written one.
+
+    Workers look for a new or rebuilt file every RELOAD_INTERVAL seconds.
+    """
+    global _store
+    now = time.monotonic()
+    if now - _store_checked["at"] < RELOAD_INTERVAL:
+        return _store
+    with _store_lock:
+        if now - _store_checked["at"] >= RELOAD_INTERVAL:
+            path = str(settings.CLIMATE_NORMALS_PATH)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime != _store_checked["mtime"]:
+                try:
+                    _store = ClimateStore(path) if mtime is not None else None
+                except (OSError, ValueError, struct.error) as e:
+                    print(f"Climate store error: {e}")
+                    _store = None
+                _store_checked["mtime"] = mtime
+            _store_checked["at"] = now
+    return _store
@@ -1,50 +1,397 @@
+import asyncio
+import base64
 import os
-from amadeus import Client, ResponseError
+import re
+import sys
+import time
+import weakref
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+from amadeus import Client
 from dotenv import load_dotenv
-import airportsdata
+from django.conf import settings
+
+from .airport_services import get_airport_store
+from .breaker_services import get_breaker
+from .cache_services import MISSING, SingleFlight, TwoTierCache
+from .client_services import get_client, register_client
+from .http_services import ahttp_request, amadeus_http
+from .metrics_services import timed
+from .rate_services import get_governor
+from .planner_services import capture_errors, get_section_timeout, run_sections, search_executor
 
 load_dotenv()
 
 CLIENT_ID = os.getenv("AMADEUS_CLIENT_ID")
 CLIENT_SECRET = os.getenv("AMADEUS_CLIENT_SECRET")
 
-amadeus = Client(client_id=CLIENT_ID, client_secret=CLIENT_SECRET)
-airports = airportsdata.load('IATA')
+
+def amadeus_host_options():
+    """host/ssl/port for amadeus.Client when settings.UPSTREAMS points Amadeus elsewhere."""
+    url = settings.UPSTREAMS.get('AMADEUS_URL')
+    if not url:
+        return {}
+    parts = urlsplit(url)
+    ssl = parts.scheme == "https"
+    return {"host": parts.hostname, "ssl": ssl, "port": parts.port or (443 if ssl else 80)}
+
+
+def build_amadeus_client():
+    return Client(client_id=CLIENT_ID, client_secret=CLIENT_SECRET, http=amadeus_http, **amadeus_host_options())
+
+
+register_client("amadeus", build_amadeus_client)
+
+# access token used by the async path, which talks to the Amadeus REST API directly
+_async_token = {"value": None, "expires_at": 0}
+_async_token_locks = weakref.WeakKeyDictionary()
+
+# holds FlightOffer records, not the raw Amadeus payload
+flight_offers_cache = TwoTierCache("compact_flight_offers", keep_stale=False)
+flight_searches = SingleFlight()
+
+ISO_DURATION = re.compile(r"P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?)?")
+
+
+def duration_minutes(duration):
+    """Minutes in an ISO 8601 duration such as "PT7H35M" or "P1DT2H"."""
+    match = ISO_DURATION.fullmatch(duration or "")
+    if not match:
+        return 0
+    days, hours, minutes = (int(value or 0) for value in match.groups())
+    return days * 24 * 60 + hours * 60 + minutes
+
+
+class _Slotted:
+    """Pickles as a plain tuple of slot values, which keeps cached offers small."""
+
+    __slots__ = ()
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+def _code(value):
+    # airport, carrier and currency codes repeat across every offer, so they share one string each
+    return sys.intern(value) if value else value
+
+
+class FlightSegment(_Slotted):
+    __slots__ = ("departure_airport", "departure_terminal", "departure_at",
+                 "arrival_airport", "arrival_terminal", "arrival_at",
+                 "carrier", "number", "duration")
+
+    def __init__(self, segment):
+        departure, arrival = segment["departure"], segment["arrival"]
+        self.departure_airport = _code(departure["iataCode"])
+        self.departure_terminal = departure.get("terminal")
+        self.departure_at = departure["at"]
+        self.arrival_airport = _code(arrival["iataCode"])
+        self.arrival_terminal = arrival.get("terminal")
+        self.arrival_at = arrival["at"]
+        self.carrier = _code(segment["carrierCode"])
+        self.number = segment["number"]
+        self.duration = segment.get("duration")
+
+    @staticmethod
+    def _endpoint(airport, terminal, at):
+        endpoint = {"iataCode": airport}
+        if terminal is not None:
+            endpoint["terminal"] = terminal
+        endpoint["at"] = at
+        return endpoint
+
+    def as_dict(self):
+        return {
+            "departure": self._endpoint(self.departure_airport, self.departure_terminal, self.departure_at),
+            "arrival": self._endpoint(self.arrival_airport, self.arrival_terminal, self.arrival_at),
+            "carrierCode": self.carrier,
+            "flightNumber": self.number,
+            "duration": self.duration
+        }
+
+
+class FlightOffer(_Slotted):
+    """Compact flight offer: the fields the planner returns or filters on, nothing else.
+
+    `stops` counts the connections of the longest itinerary, `duration` is the
+    total minutes in the air and in between, and `departure_at` is the first
+    departure in local time.
+    """
+
+    __slots__ = ("id", "price", "total", "currency", "airlines", "itineraries",
+                 "stops", "duration", "departure_at")
+
+    def __init__(self, offer):
+        self.id = offer["id"]
+        self.total = offer["price"]["total"]
+        self.price = float(self.total)
+        self.currency = _code(offer["price"]["currency"])
+        self.airlines = tuple(_code(code) for code in offer.get("validatingAirlineCodes", []))
+        self.itineraries = tuple(
+            (itinerary["duration"], tuple(FlightSegment(segment) for segment in itinerary["segments"]))
+            for itinerary in offer["itineraries"])
+        self.stops = max((len(segments) - 1 for _, segments in self.itineraries), default=0)
+        self.duration = sum(duration_minutes(duration) for duration, _ in self.itineraries)
+        self.departure_at = self.itineraries[0][1][0].departure_at if self.itineraries else ""
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "price": self.total,
+            "currency": self.currency,
+            "airlines": ", ".join(self.airlines),
+            "itineraries": [{
+                "duration": duration,
+                "segments": [segment.as_dict() for segment in segments]
+            } for duration, segments in self.itineraries]
+        }
+
+
+def compact_offers(flight_data):
+    return [FlightOffer(offer) for offer in flight_data]
+
+
+def flight_search_key(origin, destination, departure_date, adults, currency, travel_class):
+    # max is left out on purpose: a larger cached search answers a smaller one
+    return ":".join(str(value).upper() for value in
+                    (origin, destination, departure_date, adults, currency, travel_class))
+
+
+def covered_results(cached):
+    """The largest `max` a cached search can answer."""
+    # a search that returned fewer offers than it asked for has nothing more to give
+    if len(cached["data"]) < cached["max"]:
+        return float("inf")
+    return cached["max"]
+
+
+def cached_flight_offers(cached, max_results):
+    """Offers from a cached search if it covers `max_results`, otherwise None."""
+    if cached is MISSING or covered_results(cached) < max_results:
+        return None
+    return cached["data"][:max_results]
+
+
+def should_store_flight_offers(current, entry):
+    # searches for different maxes share a key, so a smaller one finishing last must not evict a larger one
+    return current is MISSING or covered_results(entry) >= covered_results(current)
+
+
+def flight_offers_timeout():
+    return settings.TRAVEL_CACHE.get('FLIGHT_OFFERS_TTL_MINUTES', 10) * 60
 
 
 def get_flight_offers(origin, destination, departure_date, adults, currency, max_results, travel_class):
+    key = flight_search_key(origin, destination, departure_date, adults, currency, travel_class)
+    offers = cached_flight_offers(flight_offers_cache.get(key), max_results)
+    if offers is not None:
+        return offers
+
+    def request():
+        with get_governor("amadeus").limit(), timed("amadeus"):
+            return compact_offers(get_client("amadeus").shopping.flight_offers_search.get(
+                originLocationCode=origin,
+                destinationLocationCode=destination,
+                departureDate=departure_date,
+                adults=adults,
+                currencyCode=currency,
+                max=max_results,
+                travelClass=travel_class,
+            ).data)
+
+    def search():
+        # offers go stale within minutes, so an open breaker fails fast instead of serving old prices
+        data = get_breaker("amadeus").call(request)
+        entry = {"max": max_results, "data": data}
+        if should_store_flight_offers(flight_offers_cache.get(key), entry):
+            flight_offers_cache.set(key, entry, flight_offers_timeout())
+        return data
+    return flight_searches.do((key, max_results), search)
+
+
+def amadeus_base_url():
+    amadeus = get_client("amadeus")
+    return f"{'https' if amadeus.ssl else 'http'}://{amadeus.host}:{amadeus.port}"
+
+
+async def _amadeus_access_token():
+    loop = asyncio.get_running_loop()
+    lock = _async_token_locks.setdefault(loop, asyncio.Lock())
+    async with lock:
+        # refresh a little before expiry, like the sync client does
+        if _async_token["value"] is None or time.time() + 10 >= _async_token["expires_at"]:
+            amadeus = get_client("amadeus")
+            with timed("amadeus_auth"):
+                response = await ahttp_request(
+                    "POST", f"{amadeus_base_url()}/v1/security/oauth2/token",
+                    data={
+                        "grant_type": "client_credentials",
+                        "client_id": amadeus.client_id,
+                        "client_secret": amadeus.client_secret,
+                    })
+                response.raise_for_status()
+            data = response.json()
+            _async_token["value"] = data["access_token"]
+            _async_token["expires_at"] = time.time() + data.get("expires_in", 0)
+        return _async_token["value"]
+
+
+async def aget_flight_offers(origin, destination, departure_date, adults, currency, max_results, travel_class):
+    """Async counterpart of get_flight_offers; raises httpx.HTTPStatusError on API errors."""
+    key = flight_search_key(origin, destination, departure_date, adults, currency, travel_class)
+    offers = cached_flight_offers(await flight_offers_cache.aget(key), max_results)
+    if offers is not None:
+        return offers
+
+    async def request():
+        token = await _amadeus_access_token()
+        async with get_governor("amadeus").alimit():
+            with timed("amadeus"):
+                response = await ahttp_request(
+                    "GET", f"{amadeus_base_url()}/v2/shopping/flight-offers",
+                    params={
+                        "originLocationCode": origin,
+                        "destinationLocationCode": destination,
+                        "departureDate": departure_date,
+                        "adults": adults,
+                        "currencyCode": currency,
+                        "max": max_results,
+                        "travelClass": travel_class,
+                    },
+                    headers={"Authorization": f"Bearer {token}"})
+                response.raise_for_status()
+        return compact_offers(response.json().get("data", []))
+
+    async def search():
+        data = await get_breaker("amadeus").acall(request)
+        entry = {"max": max_results, "data": data}
+        if should_store_flight_offers(await flight_offers_cache.aget(key), entry):
+            await flight_offers_cache.aset(key, entry, flight_offers_timeout())
+        return data
+    return await flight_searches.ado((key, max_results), search)
+
+
+def flexible_departure_dates(departure_date, flexible_days):
+    """Departure dates within `flexible_days` of the requested one, skipping the past."""
+    requested = datetime.strptime(departure_date, "%Y-%m-%d").date()
+    today = datetime.now().date()
+    dates = (requested + timedelta(days=offset) for offset in range(-flexible_days, flexible_days + 1))
+    return [date.isoformat() for date in dates if date >= today]
+
+
+def summarize_date_grid(searches):
+    """Cheapest price per date and the offers of the cheapest date.
+
+    `searches` maps a departure date to its offers, or to None/an exception when
+    that search failed. If every search failed, the first error is raised.
+    """
+    errors = [offers for offers in searches.values() if isinstance(offers, Exception)]
+    if errors and len(errors) == len(searches):
+        raise errors[0]
+
+    prices, cheapest_date = {}, None
+    for date, offers in searches.items():
+        if not offers or isinstance(offers, Exception):
+            prices[date] = None
+            continue
+        cheapest = min(offers, key=lambda offer: offer.price)
+        prices[date] = {"price": cheapest.total, "currency": cheapest.currency}
+        if cheapest_date is None or cheapest.price < float(prices[cheapest_date]["price"]):
+            cheapest_date = date
+
+    return {
+        "prices": prices,
+        "cheapest_date": cheapest_date,
+        "offers": searches[cheapest_date] if cheapest_date else [],
+    }
+
+
+def search_flexible_dates(origin, destination, departure_date, adults, currency, max_results, travel_class,
+                          flexible_days):
+    """Search every departure date within `flexible_days` in parallel; see summarize_date_grid."""
+    tasks = {
+        date: capture_errors(lambda date=date: get_flight_offers(
+            origin, destination, date, adults, currency, max_results, travel_class))
+        for date in flexible_departure_dates(departure_date, flexible_days)
+    }
+    searches, _, _ = run_sections(
+        tasks, executor=search_executor, timeout_for=lambda date: get_section_timeout("flights"))
+    return summarize_date_grid({date: searches.get(date) for date in tasks})
+
+
+async def asearch_flexible_dates(origin, destination, departure_date, adults, currency, max_results,
+                                 travel_class, flexible_days):
+    """Async counterpart of search_flexible_dates."""
+    semaphore = asyncio.Semaphore(settings.TRAVEL_PLANNER.get('FLEXIBLE_MAX_WORKERS', 4))
+
+    async def search(date):
+        async with semaphore:
+            try:
+                return date, await aget_flight_offers(
+                    origin, destination, date, adults, currency, max_results, travel_class)
+            except Exception as e:
+                return date, e
+
+    dates = flexible_departure_dates(departure_date, flexible_days)
+    return summarize_date_grid(dict(await asyncio.gather(*(search(date) for date in dates))))
+
+
+SORT_KEYS = {
+    "price": lambda offer: (offer.price, offer.duration),
+    "duration": lambda offer: (offer.duration, offer.price),
+    "stops": lambda offer: (offer.stops, offer.price),
+}
+
+
+def select_flight_offers(offers, sort=None, max_stops=None, airlines=None, departure_after=None,
+                         departure_before=None):
+    """Filter and sort compact offers.
+
+    `airlines` is a set of validating carrier codes, and the departure window
+    bounds ("HH:MM", inclusive) apply to the local time of the first departure.
+    """
+    selected = [
+        offer for offer in offers
+        if (max_stops is None or offer.stops <= max_stops)
+        and (not airlines or not airlines.isdisjoint(offer.airlines))
+        and (departure_after is None or offer.departure_at[11:16] >= departure_after)
+        and (departure_before is None or offer.departure_at[11:16] <= departure_before)
+    ]
+    if sort:
+        selected.sort(key=SORT_KEYS[sort])
+    return selected
+
+
+def encode_cursor(offset):
+    return base64.urlsafe_b64encode(f"offset:{offset}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Offset encoded in a cursor from encode_cursor; ValueError if it is not one."""
     try:
-        return amadeus.shopping.flight_offers_search.get(
-            originLocationCode=origin,
-            destinationLocationCode=destination,
-            departureDate=departure_date,
-            adults=adults,
-            currencyCode=currency,
-            max=max_results,
-            travelClass=travel_class,
-        ).data
-    except ResponseError as e:
-        raise e
+        decoded = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    prefix, _, offset = decoded.partition(":")
+    if prefix != "offset" or not offset.isdigit():
+        raise ValueError("Invalid cursor")
+    return int(offset)
+
+
+def page_flight_offers(offers, offset, page_size):
+    """One page of offers and the cursor of the next page, None on the last one."""
+    end = offset + page_size
+    return offers[offset:end], encode_cursor(end) if end < len(offers) else None
 
 
 def process_flight_offers(flight_data):
-    return [{
-        "id": offer["id"],
-        "price": offer["price"]["total"],
-        "currency": offer["price"]["currency"],
-        "airlines": ", ".join(offer.get("validatingAirlineCodes", [])),
-        "itineraries": [{
-            "duration": itinerary["duration"],
-            "segments": [{
-                "departure": segment["departure"],
-                "arrival": segment["arrival"],
-                "carrierCode": segment["carrierCode"],
-                "flightNumber": segment["number"],
-                "duration": segment["duration"]
-            } for segment in itinerary["segments"]]
-        } for itinerary in offer["itineraries"]]
-    } for offer in flight_data]
+    return [offer.as_dict() for offer in flight_data]
 
 
 def get_airport_info(airport_code):
-    return airports.get(airport_code, None)
+    return get_airport_store().get(airport_code)
@@ -0,0 +1,234 @@
+import asyncio
+import random
+import threading
+import time
+from urllib.error import URLError
+from urllib.parse import urlsplit
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# responses worth retrying: rate limited or a transient server-side failure
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# the one Amadeus POST made through the session; asking for a new token again is harmless
+AMADEUS_TOKEN_PATH = "/v1/security/oauth2/token"
+
+_session = None
+_session_lock = threading.Lock()
+
+# one pooled client per event loop, closed when the loop shuts down; an httpx.AsyncClient must not be shared
+# across loops. Under WSGI each async request runs in a loop of its own, and so gets a client of its own
+_async_clients = {}
+_client_closers = set()
+
+
+async def _close_with_loop(loop, client):
+    """Wait for `loop` to shut down, then close its client.
+
+    asyncio.run and async_to_sync cancel the tasks still pending when their
+    coroutine returns, which is what ends this one.
+    """
+    try:
+        await loop.create_future()
+    finally:
+        _async_clients.pop(loop, None)
+        await client.aclose()
+
+
+def get_async_client():
+    """Return the shared, pooled httpx client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        options = settings.OUTBOUND_HTTP
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=options.get('MAX_CONNECTIONS', 200),
+                max_keepalive_connections=options.get('MAX_KEEPALIVE_CONNECTIONS', 50),
+            ),
+            timeout=httpx.Timeout(
+                options.get('READ_TIMEOUT', 20),
+                connect=options.get('CONNECT_TIMEOUT', 5),
+            ),
+        )
+        _async_clients[loop] = client
+        # the loop only keeps a weak reference to its tasks
+        closer = loop.create_task(_close_with_loop(loop, client))
+        _client_closers.add(closer)
+        closer.add_done_callback(_client_closers.discard)
+    return client
+
+
+def _build_session():
+    options = settings.OUTBOUND_HTTP
+    retry = Retry(
+        total=options.get('RETRIES', 2),
+        status_forcelist=RETRY_STATUSES,
+        backoff_factor=options.get('BACKOFF_FACTOR', 0.3),
+        backoff_jitter=options.get('BACKOFF_JITTER', 0.3),
+        backoff_max=options.get('BACKOFF_MAX', 5),
+        respect_retry_after_header=True,
+        # hand the last response back to the caller instead of raising MaxRetryError
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=options.get('POOL_HOSTS', 10),
+        pool_maxsize=options.get('POOL_MAXSIZE', 20),
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """Return the process-wide requests session; connections are kept alive per host."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def default_timeout():
+    options = settings.OUTBOUND_HTTP
+    return (options.get('CONNECT_TIMEOUT', 5), options.get('READ_TIMEOUT', 20))
+
+
+def http_request(method, url, **kwargs):
+    """Send a request through the pooled session with the default connect/read timeouts."""
+    kwargs.setdefault('timeout', default_timeout())
+    return get_session().request(method, url, **kwargs)
+
+
+def http_request_with_retries(method, url, **kwargs):
+    """http_request that also retries 429/5xx for methods urllib3 will not retry (POST).
+
+    Only for requests that are safe to repeat; connection failures are already
+    retried by the session, whatever the method.
+    """
+    retries = settings.OUTBOUND_HTTP.get('RETRIES', 2)
+    for attempt in range(retries + 1):
+        response = http_request(method, url, **kwargs)
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            return response
+        time.sleep(retry_delay(attempt, response.headers.get('Retry-After')))
+
+
+def is_retryable_error(error):
+    """Whether an SDK call that raised `error` is worth another attempt: 429/5xx or no connection."""
+    if isinstance(error, (requests.ConnectionError, httpx.ConnectError, httpx.ConnectTimeout)):
+        return True
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "code", None)
+    return status in RETRY_STATUSES
+
+
+def _retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    return headers.get('Retry-After') if headers is not None else None
+
+
+def call_with_retries(fn):
+    """Call `fn`, an SDK call that does not go through the session (Gemini), with the session's retry policy."""
+    retries = settings.OUTBOUND_HTTP.get('RETRIES', 2)
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == retries or not is_retryable_error(e):
+                raise
+            time.sleep(retry_delay(attempt, _retry_after(e)))
+
+
+async def acall_with_retries(coroutine_fn):
+    """Async counterpart of call_with_retries; `coroutine_fn` returns a coroutine."""
+    retries = settings.OUTBOUND_HTTP.get('RETRIES', 2)
+    for attempt in range(retries + 1):
+        try:
+            return await coroutine_fn()
+        except Exception as e:
+            if attempt == retries or not is_retryable_error(e):
+                raise
+            await asyncio.sleep(retry_delay(attempt, _retry_after(e)))
+
+
+def retry_delay(attempt, retry_after=None):
+    """Exponential backoff with jitter, honouring a numeric Retry-After header."""
+    options = settings.OUTBOUND_HTTP
+    if retry_after is not None and retry_after.isdigit():
+        return min(int(retry_after), options.get('BACKOFF_MAX', 5))
+    delay = options.get('BACKOFF_FACTOR', 0.3) * (2 ** attempt)
+    delay += random.uniform(0, options.get('BACKOFF_JITTER', 0.3))
+    return min(delay, options.get('BACKOFF_MAX', 5))
+
+
+async def ahttp_request(method, url, **kwargs):
+    """Async counterpart of http_request, retrying 429/5xx and connection failures."""
+    retries = settings.OUTBOUND_HTTP.get('RETRIES', 2)
+    for attempt in range(retries + 1):
+        try:
+            response = await get_async_client().request(method, url, **kwargs)
+        except httpx.TransportError:
+            if attempt == retries:
+                raise
+            await asyncio.sleep(retry_delay(attempt))
+            continue
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            return response
+        await asyncio.sleep(retry_delay(attempt, response.headers.get('Retry-After')))
+
+
+class _AmadeusResponse:
+    """Exposes a requests response the way the Amadeus SDK reads a urlopen result."""
+
+    def __init__(self, response):
+        self.status = response.status_code
+        self._response = response
+
+    def info(self):
+        return self._response.headers
+
+    def read(self):
+        return self._response.content
+
+
+def amadeus_http(request):
+    """`http` hook for amadeus.Client that sends its urllib requests through the pooled session."""
+    # urllib3 does not retry a POST, which leaves the token request without retries
+    send = http_request_with_retries if urlsplit(request.full_url).path == AMADEUS_TOKEN_PATH else http_request
+    try:
+        response = send(
+            request.get_method(),
+            request.full_url,
+            headers=dict(request.header_items()),
+            data=request.data,
+        )
+    except requests.RequestException as e:
+        # the SDK turns URLError into an amadeus NetworkError
+        raise URLError(e)
+    return _AmadeusResponse(response)
+
+
+def pool_stats():
+    """Connection usage of the pooled session, per upstream host."""
+    stats = {}
+    adapter = get_session().get_adapter('https://')
+    pools = adapter.poolmanager.pools
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is None or pool.pool is None:
+            continue
+        idle = sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+            "maxsize": pool.pool.maxsize,
+            "idle": idle,
+            "connections_opened": pool.num_connections,
+            "requests": pool.num_requests,
+        }
+    return stats
@@ -0,0 +1,239 @@
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+
+from .breaker_services import breaker_stats
+from .cache_services import cache_stats
+from .http_services import pool_stats
+from .rate_services import governor_stats
+
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# list of (name, seconds) collecting what was timed for the current request, set by ServerTimingMiddleware
+request_timings = ContextVar("request_timings", default=None)
+
+# snapshots are written from here, never from the request (which may be running in an event loop)
+snapshot_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='metrics-snapshot')
+
+_lock = threading.Lock()
+_latency = {}
+_errors = Counter()
+_last_snapshot = {"at": time.monotonic()}
+
+
+def metrics_settings():
+    return settings.METRICS
+
+
+def record(name, seconds, error=None):
+    """Add one timed call to the histogram of `name`, and to the request's Server-Timing entries."""
+    interval = metrics_settings().get('SNAPSHOT_INTERVAL', 10)
+    with _lock:
+        histogram = _latency.get(name)
+        if histogram is None:
+            histogram = _latency[name] = {"buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0}
+        histogram["buckets"][bisect_left(BUCKETS, seconds)] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+        if error is not None:
+            _errors[(name, error)] += 1
+        due = time.monotonic() - _last_snapshot["at"] >= interval
+        if due:
+            _last_snapshot["at"] = time.monotonic()
+    timings = request_timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+    if due:
+        snapshot_executor.submit(write_snapshot)
+
+
+@contextmanager
+def timed(name):
+    """Time the block as `name`, e.g. an upstream provider; exceptions are counted by type and re-raised."""
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        record(name, time.perf_counter() - started, error)
+
+
+def process_snapshot():
+    """Everything this process measures, as plain data."""
+    with _lock:
+        latency = {name: {"buckets": list(histogram["buckets"]), "sum": histogram["sum"],
+                          "count": histogram["count"]} for name, histogram in _latency.items()}
+        errors = [[name, error, count] for (name, error), count in _errors.items()]
+    return {
+        "pid": os.getpid(),
+        "latency": latency,
+        "errors": errors,
+        "caches": cache_stats(),
+        "governors": governor_stats(),
+        "breakers": breaker_stats(),
+        "pools": pool_stats(),
+    }
+
+
+def snapshot_path(pid):
+    return os.path.join(str(metrics_settings().get('SNAPSHOT_DIR')), f"{pid}.json")
+
+
+def write_snapshot():
+    """Write this process' snapshot atomically, for whichever worker answers the next scrape."""
+    path = snapshot_path(os.getpid())
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(process_snapshot(), f)
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Metrics snapshot error: {e}")
+
+
+def pid_alive(pid):
+    """Whether process `pid` still runs; SNAPSHOT_DIR is local to the host, so its workers are ours to check."""
+    if os.name != "posix" or pid == os.getpid():
+        # signal 0 is not a no-op outside POSIX; SNAPSHOT_RETENTION alone drops those workers
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_snapshots():
+    """Snapshots of the live workers, this one freshly written.
+
+    The snapshot of a worker that exited, or that has not written one in
+    SNAPSHOT_RETENTION seconds, is deleted, along with left-over temporary
+    files; an idle worker that is still alive writes a new one when it next
+    times a call.
+    """
+    write_snapshot()
+    directory = str(metrics_settings().get('SNAPSHOT_DIR'))
+    retention = metrics_settings().get('SNAPSHOT_RETENTION', 60 * 60)
+    snapshots = []
+    for path in glob.glob(os.path.join(directory, "*.json")) + glob.glob(os.path.join(directory, "*.tmp")):
+        try:
+            name = os.path.basename(path)
+            expired = time.time() - os.stat(path).st_mtime > retention
+            if name.endswith(".tmp"):
+                if expired:
+                    os.remove(path)
+                continue
+            pid = name[:-len(".json")]
+            if expired or not pid.isdigit() or not pid_alive(int(pid)):
+                os.remove(path)
+                continue
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except FileNotFoundError:
+            # another worker's scrape removed it first
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Metrics snapshot error: {e}")
+    return snapshots
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(snapshots):
+    """Render per-process snapshots in the Prometheus text format.
+
+    Every series carries the pid of the worker it comes from, so a worker
+    exiting ends its series instead of making a summed counter go down (which
+    Prometheus would read as a reset); aggregate in the query, e.g.
+    `sum without (pid) (rate(travel_errors_total[5m]))`. Cache hit ratios are
+    computed over all live workers.
+    """
+    families = {}
+
+    def sample(name, kind, help_text, labels, value, suffix=""):
+        family = families.setdefault(name, (kind, help_text, {}))
+        family[2][(suffix, _labels(pid=pid, **labels))] = value
+
+    duration_help = "Duration of timed upstream calls, governor queue waits and serialization"
+    for snapshot in snapshots:
+        pid = snapshot["pid"]
+        for name, histogram in snapshot["latency"].items():
+            cumulative = 0
+            for bound, count in zip((*BUCKETS, "+Inf"), histogram["buckets"]):
+                cumulative += count
+                sample("travel_duration_seconds", "histogram", duration_help, {"name": name, "le": bound},
+                       cumulative, "_bucket")
+            sample("travel_duration_seconds", "histogram", duration_help, {"name": name}, histogram["sum"], "_sum")
+            sample("travel_duration_seconds", "histogram", duration_help, {"name": name}, histogram["count"],
+                   "_count")
+        for name, error, count in snapshot["errors"]:
+            sample("travel_errors_total", "counter", "Timed calls that raised, by exception type",
+                   {"name": name, "error": error}, count)
+        for namespace, stats in snapshot["caches"].items():
+            for result in ("local_hits", "shared_hits", "misses"):
+                sample("travel_cache_requests_total", "counter", "Cache lookups by tier that answered them",
+                       {"namespace": namespace, "result": result}, stats[result])
+        for provider, stats in snapshot["governors"].items():
+            sample("travel_governor_queue_depth", "gauge", "Callers waiting for an outbound slot",
+                   {"provider": provider}, stats["queue_depth"])
+            sample("travel_governor_active", "gauge", "Outbound calls in flight", {"provider": provider},
+                   stats["active"])
+            sample("travel_governor_admitted_total", "counter", "Outbound calls let through",
+                   {"provider": provider}, stats["admitted"])
+            sample("travel_governor_rejected_total", "counter", "Outbound calls rejected by the quota",
+                   {"provider": provider}, stats["rejected"])
+            sample("travel_governor_max_wait_ms", "gauge", "Longest wait for an outbound slot",
+                   {"provider": provider}, stats["max_wait_ms"])
+        for provider, stats in snapshot["breakers"].items():
+            sample("travel_breaker_open", "gauge", "Whether the breaker is open or half-open",
+                   {"provider": provider}, int(stats["state"] != "closed"))
+            sample("travel_breaker_opened_total", "counter", "Times the breaker opened",
+                   {"provider": provider}, stats["times_opened"])
+            sample("travel_breaker_rejected_total", "counter", "Calls failed fast by an open breaker",
+                   {"provider": provider}, stats["rejected"])
+        for host, stats in snapshot["pools"].items():
+            sample("travel_http_pool_idle", "gauge", "Idle keep-alive connections", {"host": host}, stats["idle"])
+            sample("travel_http_pool_connections_opened_total", "counter", "Connections opened",
+                   {"host": host}, stats["connections_opened"])
+            sample("travel_http_pool_requests_total", "counter", "Requests sent", {"host": host}, stats["requests"])
+
+    lines = []
+    for name, (kind, help_text, samples) in families.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        lines += [f"{name}{suffix}{labels} {_number(value)}" for (suffix, labels), value in samples.items()]
+
+    hits, totals = Counter(), Counter()
+    for snapshot in snapshots:
+        for namespace, stats in snapshot["caches"].items():
+            hits[namespace] += stats["local_hits"] + stats["shared_hits"]
+            totals[namespace] += stats["local_hits"] + stats["shared_hits"] + stats["misses"]
+    lines += ["# HELP travel_cache_hit_ratio Share of cache lookups answered from either tier",
+              "# TYPE travel_cache_hit_ratio gauge"]
+    lines += [f"travel_cache_hit_ratio{_labels(namespace=namespace)} {round(hits[namespace] / total, 4)}"
+              for namespace, total in totals.items() if total]
+    lines += ["# HELP travel_processes Live worker processes with a snapshot", "# TYPE travel_processes gauge",
+              f"travel_processes {len(snapshots)}"]
+    return "\n".join(lines) + "\n"
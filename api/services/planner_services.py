@@ -0,0 +1,168 @@
+import asyncio
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.conf import settings
+
+from .breaker_services import CircuitOpen
+from .cache_services import stale_keys
+from .profiling_services import run_profiled
+from .rate_services import QuotaExceeded
+
+DEFAULT_SECTION_TIMEOUT = 10
+
+# yielded by iter_sections in place of the result of a section that missed its deadline
+UNAVAILABLE = object()
+
+# a section turned away by a provider's rate governor or open breaker, before the call was made
+REJECTIONS = (QuotaExceeded, CircuitOpen)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.TRAVEL_PLANNER.get('MAX_WORKERS', 16),
+    thread_name_prefix='planner'
+)
+# searches fanned out by a single section (flexible dates), kept apart so they cannot starve it
+search_executor = ThreadPoolExecutor(
+    max_workers=settings.TRAVEL_PLANNER.get('FLEXIBLE_MAX_WORKERS', 4),
+    thread_name_prefix='planner-search'
+)
+# separate pool for batch plans, so its size caps batch upstream calls process-wide
+batch_executor = ThreadPoolExecutor(
+    max_workers=settings.TRAVEL_PLANNER.get('BATCH_MAX_WORKERS', 8),
+    thread_name_prefix='planner-batch'
+)
+
+
+def get_section_timeout(section):
+    timeouts = settings.TRAVEL_PLANNER.get('SECTION_TIMEOUTS', {})
+    return timeouts.get(section, DEFAULT_SECTION_TIMEOUT)
+
+
+def capture_errors(task):
+    """Turn a task's exception into its result, so one failing call does not sink the others."""
+    def run():
+        try:
+            return task()
+        except Exception as e:
+            return e
+    return run
+
+
+def capture_rejections(task):
+    """Turn a task's QuotaExceeded or CircuitOpen into its result, see set_aside_rejections."""
+    def run():
+        try:
+            return task()
+        except REJECTIONS as e:
+            return e
+    return run
+
+
+async def acapture_rejections(coroutine):
+    """Async counterpart of capture_rejections, for one section's coroutine."""
+    try:
+        return await coroutine
+    except REJECTIONS as e:
+        return e
+
+
+def set_aside_rejections(results, unavailable):
+    """Move the sections whose provider turned them away from `results` to `unavailable`.
+
+    The plan is served from the other sections; returns the rejections, so a
+    caller left with no section at all can answer 503 with their Retry-After.
+    """
+    rejections = []
+    for name, result in list(results.items()):
+        if isinstance(result, REJECTIONS):
+            del results[name]
+            unavailable.append(name)
+            rejections.append(result)
+    return rejections
+
+
+def _run_tracked(task, keys):
+    stale_keys.set(keys)
+    return run_profiled(task)
+
+
+def iter_sections(tasks, executor=executor, timeout_for=get_section_timeout):
+    """Run independent planner sections concurrently, yielding them as they complete.
+
+    `tasks` maps a section name to a zero-argument callable. Every section gets
+    its own deadline from `timeout_for`, measured from the moment the fan-out
+    starts. Yields `(name, result, stale)` in completion order; a section that
+    missed its deadline yields UNAVAILABLE as its result, and `stale` tells
+    whether the section was answered from a stale cache copy. An exception
+    raised by a section propagates when that section is reached.
+
+    Each task runs in a copy of the caller's context, so context variables such
+    as the request priority follow the work into the pool.
+    """
+    started = time.monotonic()
+    keys = {name: [] for name in tasks}
+    names = {
+        executor.submit(contextvars.copy_context().run, _run_tracked, task, keys[name]): name
+        for name, task in tasks.items()
+    }
+    deadlines = {future: started + timeout_for(name) for future, name in names.items()}
+    pending = set(names)
+    try:
+        while pending:
+            now = time.monotonic()
+            for future in [future for future in pending if deadlines[future] <= now and not future.done()]:
+                # a queued task is dropped; a running one finishes, but nobody waits for it
+                future.cancel()
+                pending.discard(future)
+                yield names[future], UNAVAILABLE, False
+            if not pending:
+                break
+            timeout = max(min(deadlines[future] for future in pending) - now, 0)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                yield names[future], future.result(), bool(keys[names[future]])
+    finally:
+        # the consumer stopped early, e.g. a streaming client went away
+        for future in pending:
+            future.cancel()
+
+
+def run_sections(tasks, executor=executor, timeout_for=get_section_timeout):
+    """Run independent planner sections concurrently and wait for all of them.
+
+    Returns `(results, unavailable, stale)`; sections that missed their deadline
+    are absent from `results` and listed in `unavailable`, and sections answered
+    from a stale cache copy are listed in `stale`. See iter_sections.
+    """
+    results, unavailable, stale = {}, [], []
+    for name, result, is_stale in iter_sections(tasks, executor, timeout_for):
+        if result is UNAVAILABLE:
+            unavailable.append(name)
+            continue
+        results[name] = result
+        if is_stale:
+            stale.append(name)
+    return results, unavailable, stale
+
+
+async def arun_sections(tasks):
+    """Async counterpart of run_sections; `tasks` maps a section name to a coroutine."""
+    unavailable_marker = object()
+    keys = {name: [] for name in tasks}
+
+    async def run(name, coroutine):
+        # gather runs every section in its own task, so this does not leak into the others
+        stale_keys.set(keys[name])
+        try:
+            return name, await asyncio.wait_for(coroutine, get_section_timeout(name))
+        except asyncio.TimeoutError:
+            return name, unavailable_marker
+
+    results, unavailable = {}, []
+    for name, value in await asyncio.gather(*(run(name, coroutine) for name, coroutine in tasks.items())):
+        if value is unavailable_marker:
+            unavailable.append(name)
+        else:
+            results[name] = value
+    return results, unavailable, [name for name in results if keys[name]]
@@ -0,0 +1,136 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextvars import ContextVar
+from django.conf import settings
+
+# cProfile profilers of the request being profiled, one per thread it ran on; set by ProfilingMiddleware
+request_profiles = ContextVar("request_profiles", default=None)
+
+_tracing_lock = threading.Lock()
+_tracing = {"requests": 0, "started_here": False}
+
+
+def profiling_settings():
+    return settings.PROFILING
+
+
+def enable_profile(profile):
+    """Turn `profile` on; False when another profiler already is.
+
+    From Python 3.12 cProfile runs on sys.monitoring, which allows one profiler
+    per process: enabling a second one (for a concurrent profiled request, or
+    on a pool thread while the request's own profiler runs) raises ValueError.
+    """
+    try:
+        profile.enable()
+    except ValueError:
+        return False
+    return True
+
+
+def run_profiled(fn, *args):
+    """Call fn, profiling it on this thread when the request that scheduled it is being profiled.
+
+    cProfile only sees the thread it was enabled on, so work handed to a pool
+    (the planner sections) is profiled where it runs and merged afterwards.
+    When another profiler is active the section runs unprofiled instead (see
+    enable_profile).
+    """
+    profiles = request_profiles.get()
+    if profiles is None:
+        return fn(*args)
+    profile = cProfile.Profile()
+    if not enable_profile(profile):
+        return fn(*args)
+    try:
+        return fn(*args)
+    finally:
+        profile.disable()
+        # added once finished; a section still running when the response is written is left out
+        profiles.append(profile)
+
+
+def start_allocation_tracing():
+    """Start tracemalloc for a profiled request (if not already on) and return a snapshot to diff against."""
+    with _tracing_lock:
+        if _tracing["requests"] == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(profiling_settings().get('TRACEMALLOC_FRAMES', 1))
+            _tracing["started_here"] = True
+        _tracing["requests"] += 1
+    return tracemalloc.take_snapshot()
+
+
+def stop_allocation_tracing(before):
+    """Allocation sites that grew since `before`, then stop tracemalloc once no profiled request needs it."""
+    after = tracemalloc.take_snapshot()
+    with _tracing_lock:
+        _tracing["requests"] -= 1
+        if _tracing["requests"] == 0 and _tracing["started_here"]:
+            tracemalloc.stop()
+            _tracing["started_here"] = False
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    return after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+
+
+def profile_name(request):
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", request.path).strip("-") or "root"
+    now = time.time()
+    stamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now * 1000) % 1000:03d}"
+    return f"{stamp}-{os.getpid()}-{request.method.lower()}-{slug[:60]}"
+
+
+def summarize(request, status, seconds, stats, allocations, trigger):
+    """Plain-text report: the request, the top functions by cumulative and own time, and the top allocations."""
+    top = profiling_settings().get('TOP_FUNCTIONS', 30)
+    out = io.StringIO()
+    out.write(f"{request.method} {request.get_full_path()} -> {status} in {seconds * 1000:.1f} ms"
+              f" (profiled by {trigger})\n\n")
+    stats.stream = out
+    for order in ("cumulative", "tottime"):
+        out.write(f"Top {top} functions by {order} time\n")
+        stats.sort_stats(order).print_stats(top)
+    if allocations is not None:
+        growth = [stat for stat in allocations if stat.size_diff > 0 or stat.count_diff > 0]
+        out.write(f"Top {top} allocation sites by memory allocated during the request"
+                  " (includes other threads' allocations)\n")
+        for stat in sorted(growth, key=lambda stat: stat.size_diff, reverse=True)[:top]:
+            frame = stat.traceback[0]
+            out.write(f"  {stat.size_diff / 1024:10.1f} KiB  {stat.count_diff:+8d} blocks  "
+                      f"{frame.filename}:{frame.lineno}\n")
+    return out.getvalue()
+
+
+def write_profile(request, status, seconds, profiles, allocations, trigger):
+    """Write `<name>.prof` (loadable with pstats or snakeviz) and `<name>.txt`, keeping the newest MAX_PROFILES."""
+    directory = str(profiling_settings().get('OUTPUT_DIR'))
+    name = profile_name(request)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(os.path.join(directory, f"{name}.prof"))
+        with open(os.path.join(directory, f"{name}.txt"), "w") as f:
+            f.write(summarize(request, status, seconds, stats, allocations, trigger))
+        rotate_profiles(directory, profiling_settings().get('MAX_PROFILES', 200))
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Profile write error: {e}")
+        return None
+    return name
+
+
+def rotate_profiles(directory, keep):
+    reports = sorted((entry for entry in os.scandir(directory) if entry.name.endswith(".prof")),
+                     key=lambda entry: entry.stat().st_mtime)
+    for entry in reports[:max(0, len(reports) - keep)]:
+        for path in (entry.path, entry.path[:-len(".prof")] + ".txt"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
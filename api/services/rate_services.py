@@ -0,0 +1,214 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# priority of outbound calls made on behalf of the current request or job
+request_priority = ContextVar("request_priority", default=INTERACTIVE)
+
+# async waiters are not woken by the condition, so they re-check at least this often
+ASYNC_POLL_INTERVAL = 0.05
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+class QuotaExceeded(Exception):
+    """A provider's wait queue is full, or the call could not start within its max wait."""
+
+    def __init__(self, provider, retry_after):
+        super().__init__(f"{provider} is over its request quota, retry in {retry_after}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+@contextmanager
+def background_priority():
+    """Run the enclosed calls behind any interactive request waiting for the same provider."""
+    token = request_priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+
+class RateGovernor:
+    """Token bucket plus concurrency limit in front of one upstream provider.
+
+    Callers queue in priority order (interactive before background, then
+    first come first served) and only the head of the queue may take a token.
+    The queue is bounded, and a caller gives up with QuotaExceeded once it has
+    waited `max_wait` seconds, so a spike degrades into fast errors instead of
+    a pile-up of blocked workers.
+    """
+
+    def __init__(self, name, rate, burst, max_concurrency, max_queue, max_wait):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._condition = threading.Condition()
+        self._tokens = burst
+        self._refilled_at = time.monotonic()
+        self._active = 0
+        self._queue = []
+        self._sequence = itertools.count()
+
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.longest_wait = 0.0
+        self.peak_queue_depth = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _enqueue(self, priority):
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                self.rejected += 1
+                raise QuotaExceeded(self.name, self._retry_after())
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._queue, ticket)
+            self.peak_queue_depth = max(self.peak_queue_depth, len(self._queue))
+            return ticket
+
+    def _try_admit(self, ticket, enqueued_at):
+        """Admit `ticket` if it can start now; otherwise return how long to wait before retrying.
+
+        Must be called with the condition held.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        if self._queue[0] == ticket and self._active < self.max_concurrency and self._tokens >= 1:
+            heapq.heappop(self._queue)
+            self._tokens -= 1
+            self._active += 1
+            waited = now - enqueued_at
+            self.admitted += 1
+            self.total_wait += waited
+            self.longest_wait = max(self.longest_wait, waited)
+            # the next caller in line may be able to start as well
+            self._condition.notify_all()
+            return None
+
+        remaining = enqueued_at + self.max_wait - now
+        if remaining <= 0:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            self.rejected += 1
+            self._condition.notify_all()
+            raise QuotaExceeded(self.name, self._retry_after())
+        if self._tokens < 1:
+            return min(remaining, (1 - self._tokens) / self.rate)
+        return remaining
+
+    def _retry_after(self):
+        return max(1, round(len(self._queue) / self.rate)) if self.rate else 1
+
+    def _abandon(self, ticket):
+        with self._condition:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._condition.notify_all()
+
+    def _release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def _record_wait(self, enqueued_at, error=None):
+        """Time the wait for a slot as `<provider>_queue`, next to the call itself in Server-Timing."""
+        # imported here: metrics_services reads governor_stats from this module
+        from .metrics_services import record
+        record(f"{self.name}_queue", time.monotonic() - enqueued_at, error)
+
+    @contextmanager
+    def limit(self, priority=None):
+        enqueued_at = time.monotonic()
+        ticket = self._enqueue(request_priority.get() if priority is None else priority)
+        try:
+            with self._condition:
+                wait = self._try_admit(ticket, enqueued_at)
+                while wait is not None:
+                    self._condition.wait(wait)
+                    wait = self._try_admit(ticket, enqueued_at)
+        except BaseException as e:
+            self._abandon(ticket)
+            self._record_wait(enqueued_at, type(e).__name__)
+            raise
+        self._record_wait(enqueued_at)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def alimit(self, priority=None):
+        enqueued_at = time.monotonic()
+        ticket = self._enqueue(request_priority.get() if priority is None else priority)
+        try:
+            while True:
+                with self._condition:
+                    wait = self._try_admit(ticket, enqueued_at)
+                if wait is None:
+                    break
+                await asyncio.sleep(min(wait, ASYNC_POLL_INTERVAL))
+        except BaseException as e:
+            # e.g. a section deadline cancelled us; a stale ticket would block the queue head
+            self._abandon(ticket)
+            self._record_wait(enqueued_at, type(e).__name__)
+            raise
+        self._record_wait(enqueued_at)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "queue_depth": len(self._queue),
+                "peak_queue_depth": self.peak_queue_depth,
+                "active": self._active,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait / self.admitted * 1000, 1) if self.admitted else 0,
+                "max_wait_ms": round(self.longest_wait * 1000, 1),
+            }
+
+
+def get_governor(provider):
+    """The governor for `provider`, configured from settings.RATE_LIMITS."""
+    governor = _governors.get(provider)
+    if governor is None:
+        with _governors_lock:
+            governor = _governors.get(provider)
+            if governor is None:
+                options = settings.RATE_LIMITS.get(provider, {})
+                governor = _governors[provider] = RateGovernor(
+                    provider,
+                    rate=options.get('RATE', 10),
+                    burst=options.get('BURST', 10),
+                    max_concurrency=options.get('MAX_CONCURRENCY', 10),
+                    max_queue=options.get('MAX_QUEUE', 100),
+                    max_wait=options.get('MAX_WAIT', 5),
+                )
+    return governor
+
+
+def governor_stats():
+    """Queue depth, admissions and wait times of every governor in this process, by provider."""
+    return {provider: governor.stats() for provider, governor in list(_governors.items())}
@@ -0,0 +1,35 @@
+import gc
+import time
+from importlib import import_module
+from django.conf import settings
+
+from .airport_services import get_airport_prefix_index, get_airport_spatial_index, get_airport_store
+from .climate_services import get_climate_store
+
+
+def startup_settings():
+    return settings.STARTUP
+
+
+def preload_shared_data():
+    """Load the read-only airport and climate data, the URLconf and the modules a first request would import.
+
+    Called from ApiConfig.ready() with STARTUP["WARM_UP"] under a pre-fork server that loads the
+    app in its master (gunicorn --preload), so workers inherit it instead of each building it.
+    gc.freeze() then keeps the collector from writing to those objects, which would copy their
+    pages into every worker.
+    """
+    options = startup_settings()
+    started = time.perf_counter()
+    get_airport_store()
+    get_airport_prefix_index()
+    get_airport_spatial_index()
+    get_climate_store()
+    # the views and services are otherwise imported by the first request each worker serves
+    import_module(settings.ROOT_URLCONF)
+    for module in options.get('PRELOAD_MODULES', ()):
+        import_module(module)
+    if options.get('FREEZE_GC', True):
+        gc.collect()
+        gc.freeze()
+    return time.perf_counter() - started
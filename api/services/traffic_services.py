@@ -0,0 +1,92 @@
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Sum
+
+from ..models import TripTraffic
+
+IATA_CODE = re.compile(r"[A-Z]{3}")
+
+# counts are written from here, never from the request (which may be running in an event loop)
+flush_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='traffic-flush')
+
+_pending = Counter()
+_pending_lock = threading.Lock()
+_last_flush = {"at": time.monotonic()}
+
+
+def warming_settings():
+    return settings.CACHE_WARMING
+
+
+def record_trip(origin, destination, departure_date, trip_days):
+    """Count a planned trip; counts are buffered in memory and written every TRAFFIC_FLUSH_INTERVAL seconds.
+
+    Counts still buffered when a worker exits are lost, which is fine for picking top destinations.
+    """
+    origin, destination = str(origin).upper(), str(destination).upper()
+    if not IATA_CODE.fullmatch(origin) or not IATA_CODE.fullmatch(destination):
+        return
+    try:
+        departure_date = date.fromisoformat(str(departure_date))
+    except ValueError:
+        return
+    key = (date.today(), origin, destination, departure_date, trip_days)
+    interval = warming_settings().get('TRAFFIC_FLUSH_INTERVAL', 60)
+    with _pending_lock:
+        _pending[key] += 1
+        due = time.monotonic() - _last_flush["at"] >= interval
+        if due:
+            _last_flush["at"] = time.monotonic()
+    if due:
+        flush_executor.submit(flush_traffic)
+
+
+def flush_traffic():
+    with _pending_lock:
+        counts = dict(_pending)
+        _pending.clear()
+    try:
+        for (day, origin, destination, departure_date, trip_days), requests in counts.items():
+            lookup = {"day": day, "origin": origin, "destination": destination,
+                      "departure_date": departure_date, "trip_days": trip_days}
+            if TripTraffic.objects.filter(**lookup).update(requests=F("requests") + requests):
+                continue
+            try:
+                with transaction.atomic():
+                    TripTraffic.objects.create(requests=requests, **lookup)
+            except IntegrityError:
+                # another worker created the row in the meantime
+                TripTraffic.objects.filter(**lookup).update(requests=F("requests") + requests)
+    except Exception as e:
+        print(f"Traffic flush error: {e}")
+    finally:
+        close_old_connections()
+
+
+def top_destinations(days, limit):
+    """Most requested (destination, trip length) pairs over the last `days` days."""
+    rows = (TripTraffic.objects.filter(day__gte=date.today() - timedelta(days=days))
+            .values("destination", "trip_days").annotate(total=Sum("requests")).order_by("-total")[:limit])
+    return [(row["destination"], row["trip_days"]) for row in rows]
+
+
+def top_routes(days, limit):
+    """Most requested (origin, destination, departure date) searches that have not departed yet."""
+    rows = (TripTraffic.objects.filter(day__gte=date.today() - timedelta(days=days),
+                                       departure_date__gte=date.today())
+            .values("origin", "destination", "departure_date").annotate(total=Sum("requests"))
+            .order_by("-total")[:limit])
+    return [(row["origin"], row["destination"], row["departure_date"].isoformat()) for row in rows]
+
+
+def prune_traffic(retention_days=None):
+    """Delete planner traffic older than `retention_days` (TRAFFIC_RETENTION_DAYS); returns the rows deleted."""
+    if retention_days is None:
+        retention_days = warming_settings().get('TRAFFIC_RETENTION_DAYS', 30)
+    return TripTraffic.objects.filter(day__lt=date.today() - timedelta(days=retention_days)).delete()[0]
@@ -1,30 +1,148 @@
 from datetime import datetime, timedelta
 import os
-from google import genai
-import requests
+from pydantic import BaseModel
+
+from django.conf import settings
+
+from .breaker_services import CircuitOpen, get_breaker
+from .cache_services import TwoTierCache
+from .client_services import get_client, register_client
+from .climate_services import get_climate_store
+from .http_services import acall_with_retries, ahttp_request, call_with_retries, http_request
+from .metrics_services import timed
+from .rate_services import QuotaExceeded, get_governor
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-ai_client = genai.Client(api_key=GEMINI_API_KEY)
+
+def build_gemini_client():
+    # imported here: google.genai takes most of a second to import, which every worker and command would pay
+    from google import genai
+    # a hung call would otherwise hold its governor slot, its planner thread and the callers coalesced on it
+    http_options = {"timeout": int(settings.UPSTREAMS.get('GEMINI_TIMEOUT', 30) * 1000)}
+    if settings.UPSTREAMS.get('GEMINI_URL'):
+        http_options["base_url"] = settings.UPSTREAMS['GEMINI_URL']
+    return genai.Client(api_key=GEMINI_API_KEY, http_options=http_options)
+
+
+register_client("gemini", build_gemini_client)
+
+weather_cache = TwoTierCache("weather")
+# historical weather never changes, so it is kept apart from what culling may evict
+weather_history_cache = TwoTierCache("weather_history", alias='history', keep_stale=False)
+city_content_cache = TwoTierCache("city_content")
+
+
+def city_content_key(kind, *inputs):
+    """Case and whitespace insensitive key for generated city content."""
+    normalized = (" ".join(str(value).split()).casefold() for value in inputs)
+    return ":".join((kind, "gemini-2.0-flash", *normalized))
+
+
+def city_content_timeout():
+    return settings.TRAVEL_CACHE.get('CITY_CONTENT_TTL', 60 * 60 * 24 * 30)
+
+
+class PointOfInterest(BaseModel):
+    name: str
+    category: str
+    address: str
+    description: str
+
+
+class DayTip(BaseModel):
+    day: int
+    tip: str
+
+
+class CityGuide(BaseModel):
+    """Landmarks and day-by-day tips of one stay, generated together in a single call."""
+
+    points_of_interest: list[PointOfInterest]
+    travel_tips: list[DayTip]
+
+
+def json_config(schema):
+    from google.genai import types
+    return types.GenerateContentConfig(response_mime_type="application/json", response_schema=schema)
+
+
+def generate_json(contents, schema):
+    config = json_config(schema)
+    with get_governor("gemini").limit(), timed("gemini"):
+        # genai has its own HTTP client, so the retries of the shared session are added here
+        return call_with_retries(lambda: get_client("gemini").models.generate_content(
+            model="gemini-2.0-flash", contents=contents, config=config)).text
+
+
+async def agenerate_json(contents, schema):
+    config = json_config(schema)
+    async with get_governor("gemini").alimit():
+        with timed("gemini"):
+            response = await acall_with_retries(lambda: get_client("gemini").aio.models.generate_content(
+                model="gemini-2.0-flash", contents=contents, config=config))
+    return response.text
+
+
+def city_guide_prompt(city, country, days):
+    return f"""Plan a {days} day visit to {city}, {country}.
+              List 3-5 points of interest, each with its name, category, physical address and a short ~2 sentence description.
+              Give 5 concise tips for the trip, each with the day of the trip it applies to.
+              """
 
 
-def get_landmarks(city, country):
+def parse_city_guide(text):
+    """Validate the model output against CityGuide and return it as plain data."""
+    return CityGuide.model_validate_json(text).model_dump()
+
+
+def city_guide_key(city, country, days):
+    return city_content_key("guide", city, country, days)
+
+
+def has_city_content(guide):
+    """Whether a guide is worth caching; one missing its landmarks or tips is retried by the next request instead."""
+    return bool(guide["points_of_interest"] and guide["travel_tips"])
+
+
+def get_city_guide(city, country, days):
+    """Landmarks and travel tips of a stay; concurrent callers for the same stay share one model call."""
+    return city_content_cache.get_or_fetch(
+        city_guide_key(city, country, days),
+        lambda: parse_city_guide(generate_json(city_guide_prompt(city, country, days), CityGuide)),
+        city_content_timeout(),
+        cacheable=has_city_content,
+        breaker=get_breaker("gemini"))
+
+
+async def aget_city_guide(city, country, days):
+    async def fetch():
+        return parse_city_guide(await agenerate_json(city_guide_prompt(city, country, days), CityGuide))
+
+    return await city_content_cache.aget_or_fetch(
+        city_guide_key(city, country, days),
+        fetch,
+        city_content_timeout(),
+        cacheable=has_city_content,
+        breaker=get_breaker("gemini"))
+
+
+def get_landmarks(city, country, days=1):
     try:
-        response = ai_client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=f"""What are some points of interest to visit in {city}s, {country}?\n
-              Respond in a JSON-like object only with the following data about 3-5 points of interest:
-              name, category, address and a short ~-2 sentece description. \n
-              Respond in a JSON format, without specifying that its a JSON. Do not add any other characters besides the JSON object.
-              Use the following format:\n\n
-              "points_of_interest": [
-                "name": name_of_landmark,\n
-                "category": category,\n
-                "address": physical address,\n
-                "description": short ~2 sentence description\n\n
-              ]
-              """)
-        return response.text
+        return get_city_guide(city, country, days)["points_of_interest"]
+    except (QuotaExceeded, CircuitOpen):
+        # not an empty section: the planner lists it as unavailable, to be retried later
+        raise
+    except Exception as e:
+        print(f"Landmarks error: {e}")
+        return []
+
+
+async def aget_landmarks(city, country, days=1):
+    try:
+        return (await aget_city_guide(city, country, days))["points_of_interest"]
+    except (QuotaExceeded, CircuitOpen):
+        raise
     except Exception as e:
         print(f"Landmarks error: {e}")
         return []
@@ -65,74 +183,207 @@ def get_weather_icon(code):
     return icon_map.get(code, "02d")
 
 
+def in_forecast_range(check_in):
+    days_until_checkin = (check_in - datetime.now().date()).days
+    return days_until_checkin <= 14 and days_until_checkin >= 0
+
+
+def weather_window(check_in, check_out):
+    """The 14 days around a stay covered when it is beyond the forecast range."""
+    trip_duration = (check_out - check_in).days + 1
+    total_days_needed = 14
+
+    if trip_duration >= total_days_needed:
+
+        mid_point = check_in + timedelta(days=trip_duration // 2)
+        start_date = mid_point - timedelta(days=total_days_needed//2)
+        end_date = start_date + timedelta(days=total_days_needed-1)
+    else:
+        days_before = (total_days_needed - trip_duration) // 2
+        days_after = total_days_needed - trip_duration - days_before
+        start_date = check_in - timedelta(days=days_before)
+        end_date = check_out + timedelta(days=days_after)
+    return start_date, end_date
+
+
+def weather_request(lat, lon, checkin_date, checkout_date):
+    """Build the Open-Meteo url and params for a stay; returns (url, params, old_dates)"""
+    check_in = datetime.strptime(checkin_date, "%Y-%m-%d").date()
+    check_out = datetime.strptime(checkout_date, "%Y-%m-%d").date()
+
+    # if the trip is less than 15 days in the future, provide current weather information, otherwise return same dates last year
+    if in_forecast_range(check_in):
+
+        url = settings.UPSTREAMS.get('OPEN_METEO_FORECAST_URL', "https://api.open-meteo.com/v1/forecast")
+        params = {
+            "latitude": lat,
+            "longitude": lon,
+            "daily": "weather_code,temperature_2m_max,temperature_2m_min",
+            "forecast_days": 14,
+            "timezone": "auto"
+        }
+        return url, params, False
+
+    start_date, end_date = weather_window(check_in, check_out)
+    historical_year = check_in.year - 1
+    start_date = start_date.replace(year=historical_year)
+    end_date = end_date.replace(year=historical_year)
+
+    url = settings.UPSTREAMS.get(
+        'OPEN_METEO_HISTORICAL_URL', "https://historical-forecast-api.open-meteo.com/v1/forecast")
+    params = {
+        "latitude": lat,
+        "longitude": lon,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "daily": "weather_code,temperature_2m_max,temperature_2m_min",
+        "timezone": "auto"
+    }
+    return url, params, True
+
+
+def parse_weather(data, old_dates):
+    daily = data['daily']
+    weather_data = []
+    for i in range(len(daily['time'])):
+        weather_entry = {
+            "date": daily['time'][i],
+            "temp": daily['temperature_2m_max'][i],
+            "temp_min": daily['temperature_2m_min'][i],
+            "temp_max": daily['temperature_2m_max'][i],
+            "weather_code": daily['weather_code'][i],
+            "icon": f"http://openweathermap.org/img/wn/{get_weather_icon(daily['weather_code'][i])}.png"
+        }
+        weather_data.append(weather_entry)
+
+    return {"old_dates": old_dates, "daily_data": weather_data[:14]}
+
+
+def snap_to_grid(coordinate):
+    grid = settings.TRAVEL_CACHE.get('WEATHER_GRID_DEGREES', 0.1)
+    return round(round(coordinate / grid) * grid, 4)
+
+
+def weather_cache_key(params):
+    """Grid cell plus date window; a forecast window starts today."""
+    if "start_date" in params:
+        window = f"{params['start_date']}:{params['end_date']}"
+    else:
+        window = f"{datetime.now().date().isoformat()}+{params['forecast_days']}"
+    return f"{params['latitude']}:{params['longitude']}:{window}"
+
+
+def weather_cell_key(lat, lon, checkin_date, checkout_date):
+    """Cache key of the forecast get_weather_forecast would fetch for a stay."""
+    _, params, _ = weather_request(snap_to_grid(lat), snap_to_grid(lon), checkin_date, checkout_date)
+    return weather_cache_key(params)
+
+
+def weather_cache_for(old_dates):
+    return weather_history_cache if old_dates else weather_cache
+
+
+def weather_cache_timeout(old_dates):
+    # historical forecasts never change, so they are kept for good
+    if old_dates:
+        return None
+    return settings.TRAVEL_CACHE.get('WEATHER_FORECAST_TTL', 60 * 60)
+
+
+def fetch_weather(url, params, old_dates):
+    with get_governor("open_meteo").limit(), timed("open_meteo"):
+        response = http_request("GET", url, params=params)
+        response.raise_for_status()
+    return parse_weather(response.json(), old_dates)
+
+
+async def afetch_weather(url, params, old_dates):
+    async with get_governor("open_meteo").alimit():
+        with timed("open_meteo"):
+            response = await ahttp_request("GET", url, params=params)
+            response.raise_for_status()
+    return parse_weather(response.json(), old_dates)
+
+
+def climate_weather(lat, lon, checkin_date, checkout_date):
+    """Weather of a stay beyond the forecast range from the local climate normals.
+
+    Returns None when there is no climate store or it does not cover the
+    destination, in which case the historical API is asked instead.
+    """
+    check_in = datetime.strptime(checkin_date, "%Y-%m-%d").date()
+    check_out = datetime.strptime(checkout_date, "%Y-%m-%d").date()
+    store = get_climate_store()
+    if in_forecast_range(check_in) or store is None:
+        return None
+
+    start_date, end_date = weather_window(check_in, check_out)
+    days = store.daily(lat, lon, start_date, end_date)
+    summary = store.summary(lat, lon, check_in, check_out)
+    if days is None or summary is None:
+        return None
+
+    return {
+        "old_dates": True,
+        # averages over the trip itself, from the normals of these years
+        "normals": {
+            "years": f"{store.first_year}-{store.last_year}",
+            **summary,
+            "icon": f"http://openweathermap.org/img/wn/{get_weather_icon(summary['weather_code'])}.png"
+        },
+        "daily_data": [{
+            "date": day.isoformat(),
+            "temp": high,
+            "temp_min": low,
+            "temp_max": high,
+            "weather_code": code,
+            "icon": f"http://openweathermap.org/img/wn/{get_weather_icon(code)}.png"
+        } for day, high, low, code in days],
+    }
+
+
+def weather_forecast(lat, lon, checkin_date, checkout_date):
+    """Weather of a stay from the climate normals or the (cached) Open-Meteo API; raises on errors."""
+    normals = climate_weather(lat, lon, checkin_date, checkout_date)
+    if normals is not None:
+        return normals
+
+    url, params, old_dates = weather_request(
+        snap_to_grid(lat), snap_to_grid(lon), checkin_date, checkout_date)
+    return weather_cache_for(old_dates).get_or_fetch(
+        weather_cache_key(params),
+        lambda: fetch_weather(url, params, old_dates),
+        weather_cache_timeout(old_dates),
+        breaker=get_breaker("open_meteo"))
+
+
 def get_weather_forecast(lat, lon, checkin_date, checkout_date):
     try:
-        today = datetime.now().date()
-        check_in = datetime.strptime(checkin_date, "%Y-%m-%d").date()
-        check_out = datetime.strptime(checkout_date, "%Y-%m-%d").date()
-
-        days_until_checkin = (check_in - today).days
-
-        # if the trip is less than 15 days in the future, provide current weather information, otherwise return same dates last year
-        if days_until_checkin <= 14 and days_until_checkin >= 0:
-
-            url = "https://api.open-meteo.com/v1/forecast"
-            params = {
-                "latitude": lat,
-                "longitude": lon,
-                "daily": "weather_code,temperature_2m_max,temperature_2m_min",
-                "forecast_days": 14,
-                "timezone": "auto"
-            }
-            old_dates = False
-        else:
-            trip_duration = (check_out - check_in).days + 1
-            total_days_needed = 14
-
-            if trip_duration >= total_days_needed:
-
-                mid_point = check_in + timedelta(days=trip_duration // 2)
-                start_date = mid_point - timedelta(days=total_days_needed//2)
-                end_date = start_date + timedelta(days=total_days_needed-1)
-            else:
-                days_before = (total_days_needed - trip_duration) // 2
-                days_after = total_days_needed - trip_duration - days_before
-                start_date = check_in - timedelta(days=days_before)
-                end_date = check_out + timedelta(days=days_after)
-
-            historical_year = check_in.year - 1
-            start_date = start_date.replace(year=historical_year)
-            end_date = end_date.replace(year=historical_year)
-
-            url = "https://historical-forecast-api.open-meteo.com/v1/forecast"
-            params = {
-                "latitude": lat,
-                "longitude": lon,
-                "start_date": start_date.isoformat(),
-                "end_date": end_date.isoformat(),
-                "daily": "weather_code,temperature_2m_max,temperature_2m_min",
-                "timezone": "auto"
-            }
-            old_dates = True
-
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
-        daily = data['daily']
-        weather_data = []
-        for i in range(len(daily['time'])):
-            weather_entry = {
-                "date": daily['time'][i],
-                "temp": daily['temperature_2m_max'][i],
-                "temp_min": daily['temperature_2m_min'][i],
-                "temp_max": daily['temperature_2m_max'][i],
-                "weather_code": daily['weather_code'][i],
-                "icon": f"http://openweathermap.org/img/wn/{get_weather_icon(daily['weather_code'][i])}.png"
-            }
-            weather_data.append(weather_entry)
-
-        return {"old_dates": old_dates, "daily_data": weather_data[:14]}
+        return weather_forecast(lat, lon, checkin_date, checkout_date)
 
+    except (QuotaExceeded, CircuitOpen):
+        raise
+    except Exception as e:
+        print(f"Weather API error: {str(e)}")
+        return []
+
+
+async def aget_weather_forecast(lat, lon, checkin_date, checkout_date):
+    try:
+        normals = climate_weather(lat, lon, checkin_date, checkout_date)
+        if normals is not None:
+            return normals
+
+        url, params, old_dates = weather_request(
+            snap_to_grid(lat), snap_to_grid(lon), checkin_date, checkout_date)
+        return await weather_cache_for(old_dates).aget_or_fetch(
+            weather_cache_key(params),
+            lambda: afetch_weather(url, params, old_dates),
+            weather_cache_timeout(old_dates),
+            breaker=get_breaker("open_meteo"))
+
+    except (QuotaExceeded, CircuitOpen):
+        raise
     except Exception as e:
         print(f"Weather API error: {str(e)}")
         return []
@@ -140,16 +391,19 @@ def get_weather_forecast(lat, lon, checkin_date, checkout_date):
 
 def generate_travel_tips(city, country, days):
     try:
-        response = ai_client.models.generate_content(
-            model="gemini-2.0-flash", contents=f"""Give 5 concise tips for visiting {city}, {country} for {days} days.
-              Respond in a JSON format, without specifying that its a JSON. Do not add any other characters besides the JSON object.\n              
-              Use the following format:\n\n
-              [
-              "day": day of the trip,\n
-              "tip": the tip,\n
-              ]
-              """)
-        return response.text
+        return get_city_guide(city, country, days)["travel_tips"]
+    except (QuotaExceeded, CircuitOpen):
+        raise
+    except Exception as e:
+        print(f"Generative AI error: {e}")
+        return None
+
+
+async def agenerate_travel_tips(city, country, days):
+    try:
+        return (await aget_city_guide(city, country, days))["travel_tips"]
+    except (QuotaExceeded, CircuitOpen):
+        raise
     except Exception as e:
         print(f"Generative AI error: {e}")
         return None
@@ -0,0 +1,131 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from django.conf import settings
+
+from .cache_services import MISSING, stale_keys
+from .flight_services import (cached_flight_offers, flight_offers_cache, flight_search_key, get_airport_info,
+                              get_flight_offers)
+from .rate_services import QuotaExceeded, background_priority
+from .traffic_services import top_destinations, top_routes, warming_settings
+from .travel_services import (city_content_cache, city_guide_key, get_city_guide, weather_cache, weather_cell_key,
+                              weather_forecast)
+
+# the planner's defaults, so warmed flight searches are the ones a plain request makes
+FLIGHT_DEFAULTS = {"adults": 1, "currency": "EUR", "travel_class": "BUSINESS"}
+
+
+def warm_city_guide(airport, days):
+    if city_content_cache.get(city_guide_key(airport["city"], airport["country"], days)) is not MISSING:
+        return "cached"
+    get_city_guide(airport["city"], airport["country"], days)
+    return "warmed"
+
+
+def warm_weather(airport):
+    # any stay starting tomorrow shares the forecast of its grid cell
+    checkin = date.today() + timedelta(days=1)
+    checkin_date, checkout_date = checkin.isoformat(), (checkin + timedelta(days=3)).isoformat()
+    if weather_cache.get(weather_cell_key(airport["lat"], airport["lon"], checkin_date, checkout_date)) is not MISSING:
+        return "cached"
+    weather_forecast(airport["lat"], airport["lon"], checkin_date, checkout_date)
+    return "warmed"
+
+
+def warm_flights(origin, destination, departure_date):
+    max_results = settings.TRAVEL_PLANNER.get('FLIGHT_OFFERS_POOL', 50)
+    key = flight_search_key(origin, destination, departure_date, FLIGHT_DEFAULTS["adults"],
+                            FLIGHT_DEFAULTS["currency"], FLIGHT_DEFAULTS["travel_class"])
+    if cached_flight_offers(flight_offers_cache.get(key), max_results) is not None:
+        return "cached"
+    get_flight_offers(origin, destination, departure_date, FLIGHT_DEFAULTS["adults"],
+                      FLIGHT_DEFAULTS["currency"], max_results, FLIGHT_DEFAULTS["travel_class"])
+    return "warmed"
+
+
+def run_warm_task(kind, target, warm, quota_retries):
+    """Run one warm-up at background priority, waiting out quota rejections; returns its report entry."""
+    started = time.monotonic()
+    entry = {"kind": kind, "target": target}
+    keys = []
+    token = stale_keys.set(keys)
+    try:
+        _run_with_retries(entry, warm, keys, quota_retries)
+    finally:
+        stale_keys.reset(token)
+    entry["seconds"] = round(time.monotonic() - started, 3)
+    return entry
+
+
+def _run_with_retries(entry, warm, keys, quota_retries):
+    with background_priority():
+        for attempt in range(quota_retries + 1):
+            try:
+                entry["status"] = warm()
+                if keys:
+                    # the provider is down and the stale copy answered; it is refreshed once it recovers
+                    entry["status"] = "stale"
+                break
+            except QuotaExceeded as e:
+                if attempt == quota_retries:
+                    entry.update(status="failed", error=str(e))
+                    break
+                time.sleep(e.retry_after)
+            except Exception as e:
+                entry.update(status="failed", error=str(e))
+                break
+
+
+def warm_caches(destinations=None, traffic_days=None, limit=None, routes=None, workers=None):
+    """Prefetch city guides, weather and popular flight searches into the caches.
+
+    `destinations` is a list of IATA codes; without it the top destinations and
+    routes of the last `traffic_days` days of planner traffic are warmed. This
+    is the hook to call from a scheduler; `manage.py warm_caches` wraps it for
+    cron. Returns a JSON-serializable report.
+    """
+    options = warming_settings()
+    traffic_days = traffic_days or options.get('TRAFFIC_DAYS', 7)
+    limit = limit or options.get('TOP_DESTINATIONS', 20)
+    routes = options.get('TOP_ROUTES', 20) if routes is None else routes
+    workers = workers or options.get('MAX_WORKERS', 4)
+    started_at = datetime.now(timezone.utc)
+    started = time.monotonic()
+
+    if destinations:
+        guides = [(code.upper(), days) for code in destinations for days in options.get('TRIP_DAYS', (3, 7))]
+        flight_searches = []
+    else:
+        guides = top_destinations(traffic_days, limit)
+        flight_searches = top_routes(traffic_days, routes)
+
+    tasks, unknown, airports = [], [], {}
+    for code, days in guides:
+        airport = airports.get(code) or get_airport_info(code)
+        if airport is None:
+            if code not in unknown:
+                unknown.append(code)
+            continue
+        if code not in airports:
+            airports[code] = airport
+            tasks.append(("weather", code, lambda airport=airport: warm_weather(airport)))
+        tasks.append(("city_guide", f"{code}:{days}", lambda airport=airport, days=days: warm_city_guide(airport, days)))
+    for origin, destination, departure_date in flight_searches:
+        tasks.append(("flights", f"{origin}-{destination}:{departure_date}",
+                      lambda o=origin, d=destination, date=departure_date: warm_flights(o, d, date)))
+
+    quota_retries = options.get('QUOTA_RETRIES', 3)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cache-warm') as pool:
+        entries = list(pool.map(lambda task: run_warm_task(*task, quota_retries), tasks))
+
+    statuses = {}
+    for entry in entries:
+        statuses[entry["status"]] = statuses.get(entry["status"], 0) + 1
+    return {
+        "started_at": started_at.isoformat(),
+        "seconds": round(time.monotonic() - started, 3),
+        "source": "explicit" if destinations else f"traffic of the last {traffic_days} days",
+        "summary": statuses,
+        "unknown_destinations": unknown,
+        "tasks": entries,
+    }
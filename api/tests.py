@@ -1,3 +1,1310 @@
-from django.test import TestCase
+import asyncio
+import cProfile
+import importlib.util
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import addModuleCleanup, mock, skipUnless
+from urllib.request import Request
 
-# Create your tests here.
+import requests
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from google.genai import errors as genai_errors
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .cache_backends import FileBasedCache
+from .middleware import ProfilingMiddleware
+from .models import TripTraffic
+from .services import climate_services, flight_services, http_services, profiling_services, travel_services
+from .services.airport_services import (AirportPrefixIndex, AirportSpatialIndex, AirportStore, build_airport_store,
+                                       chord_to_km, is_minor_airport, rank_destinations, unit_vector)
+from .services.breaker_services import CircuitBreaker, CircuitOpen
+from .services.cache_services import MISSING, SingleFlight, TwoTierCache, stale_keys
+from .services.client_services import get_client, register_client
+from .services.flight_services import (cached_flight_offers, compact_offers, decode_cursor, encode_cursor,
+                                       flexible_departure_dates, get_flight_offers, page_flight_offers,
+                                       select_flight_offers, should_store_flight_offers, summarize_date_grid)
+from .services.metrics_services import (process_snapshot, read_snapshots, render_prometheus, request_timings,
+                                        snapshot_executor)
+from .services.planner_services import UNAVAILABLE, iter_sections, run_sections
+from .services.rate_services import BACKGROUND, INTERACTIVE, QuotaExceeded, RateGovernor
+from .services.traffic_services import prune_traffic
+from .services.warm_services import warm_caches
+from .views import AUTOCOMPLETE_MAX_LIMIT, InvalidTrip, requested_sections
+
+# a per-test shared tier instead of the file cache under BASE_DIR
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'history': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'history'},
+}
+
+
+
+def setUpModule():
+    # metrics snapshots, written by the metrics view and every SNAPSHOT_INTERVAL by any timed call, stay out of BASE_DIR
+    directory = tempfile.TemporaryDirectory()
+    addModuleCleanup(directory.cleanup)
+    override = override_settings(METRICS={**settings.METRICS, "SNAPSHOT_DIR": directory.name})
+    override.enable()
+    addModuleCleanup(override.disable)
+    # a snapshot still queued would otherwise be written after the override is gone
+    addModuleCleanup(lambda: snapshot_executor.submit(lambda: None).result())
+
+
+STREAM_TRIP = {
+    "params": {},
+    "sections": {"weather", "landmarks"},
+    "dest_airport": {"city": "Paris", "country": "FR"},
+    "trip_days": 3,
+}
+
+
+class PlannerStreamTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("traveller", password="secret"))
+        self.slow_done = threading.Event()
+
+    def tasks(self, trip):
+        def weather():
+            return {"daily": []}
+
+        def landmarks():
+            time.sleep(0.5)
+            self.slow_done.set()
+            return []
+        return {"weather": weather, "landmarks": landmarks}
+
+    def stream(self, accept, encoding):
+        with mock.patch("api.views.parse_trip", return_value=STREAM_TRIP), \
+                mock.patch("api.views.record_planned_trip"), \
+                mock.patch("api.views.planner_tasks", side_effect=self.tasks):
+            response = self.client.get("/api/travel-planner/stream/", HTTP_ACCEPT=accept,
+                                       HTTP_ACCEPT_ENCODING=encoding)
+            chunks = []
+            for chunk in response.streaming_content:
+                chunks.append((chunk, self.slow_done.is_set()))
+        return response, chunks
+
+    def test_sections_arrive_before_the_slowest_finishes_with_gzip_accepted(self):
+        for accept in ("text/event-stream", "application/x-ndjson"):
+            with self.subTest(accept=accept):
+                self.slow_done.clear()
+                response, chunks = self.stream(accept, "gzip, deflate")
+                self.assertFalse(response.has_header("Content-Encoding"))
+                weather = [slow_done for chunk, slow_done in chunks if b"weather" in chunk]
+                self.assertEqual(weather, [False])
+                self.assertTrue(chunks[-1][1])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CityGuideCacheTests(SimpleTestCase):
+    EMPTY = json.dumps({"points_of_interest": [], "travel_tips": []})
+    HALF = json.dumps({"points_of_interest": [], "travel_tips": [{"day": 1, "tip": "Book the Louvre ahead"}]})
+    GUIDE = json.dumps({
+        "points_of_interest": [{"name": "Louvre", "category": "Museum", "address": "Rue de Rivoli",
+                                "description": "The largest art museum."}],
+        "travel_tips": [{"day": 1, "tip": "Book the Louvre ahead"}],
+    })
+
+    def cached(self, city):
+        return travel_services.city_content_cache.get(travel_services.city_guide_key(city, "FR", 3))
+
+    def test_empty_guide_is_not_cached(self):
+        with mock.patch.object(travel_services, "generate_json", return_value=self.EMPTY):
+            guide = travel_services.get_city_guide("Emptyville", "FR", 3)
+        self.assertEqual(guide["points_of_interest"], [])
+        self.assertIs(self.cached("Emptyville"), MISSING)
+
+    def test_empty_guide_is_not_cached_async(self):
+        with mock.patch.object(travel_services, "agenerate_json", mock.AsyncMock(return_value=self.EMPTY)):
+            asyncio.run(travel_services.aget_city_guide("Emptyburg", "FR", 3))
+        self.assertIs(self.cached("Emptyburg"), MISSING)
+
+    def test_half_empty_guide_is_not_cached(self):
+        with mock.patch.object(travel_services, "generate_json", return_value=self.HALF):
+            guide = travel_services.get_city_guide("Halfway", "FR", 3)
+        self.assertEqual(len(guide["travel_tips"]), 1)
+        self.assertIs(self.cached("Halfway"), MISSING)
+
+    def test_guide_with_content_is_cached(self):
+        with mock.patch.object(travel_services, "generate_json", return_value=self.GUIDE):
+            guide = travel_services.get_city_guide("Tipton", "FR", 3)
+        self.assertEqual(self.cached("Tipton"), guide)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_followers_share_the_leader_call(self):
+        flight, calls, release = SingleFlight(wait_timeout=5), [], threading.Event()
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return "offers"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do("key", fetch))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["offers"] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_follower_gives_up_on_a_hung_leader(self):
+        flight, release = SingleFlight(wait_timeout=0.1), threading.Event()
+        leader = threading.Thread(target=flight.do, args=("key", lambda: release.wait(5)))
+        leader.start()
+        time.sleep(0.05)
+        started = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            flight.do("key", lambda: "never called")
+        self.assertLess(time.monotonic() - started, 1)
+        release.set()
+        leader.join()
+
+    def test_async_follower_gives_up_without_cancelling_the_leader(self):
+        flight = SingleFlight(wait_timeout=0.1)
+
+        async def slow():
+            await asyncio.sleep(0.3)
+            return "guide"
+
+        async def main():
+            leader = asyncio.ensure_future(flight.ado("key", slow))
+            await asyncio.sleep(0)
+            with self.assertRaises(TimeoutError):
+                await flight.ado("key", slow)
+            return await leader
+
+        self.assertEqual(asyncio.run(main()), "guide")
+
+
+class FileBasedCacheTests(SimpleTestCase):
+    def cache(self, **options):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return FileBasedCache(directory.name, {"OPTIONS": options})
+
+    def test_culls_expired_then_least_recently_written(self):
+        cache = self.cache(MAX_ENTRIES=10, CULL_FREQUENCY=5, CULL_INTERVAL=0)
+        for i in range(10):
+            cache.set(f"key{i}", i, None)
+            os.utime(cache._key_to_file(f"key{i}"), (i, i))
+        expired = cache._key_to_file("key9")
+        with open(expired, "r+b") as f:
+            cache._write_content(f, -1, 9)
+        cache.set("new", "value", None)
+        # the expired entry and the oldest one make room for MAX_ENTRIES / CULL_FREQUENCY
+        self.assertEqual(len(cache._list_cache_files()), 9)
+        self.assertIsNone(cache.get("key0"))
+        self.assertIsNone(cache.get("key9"))
+        self.assertEqual(cache.get("key1"), 1)
+        self.assertEqual(cache.get("new"), "value")
+
+    def test_counts_entries_once_per_interval(self):
+        cache = self.cache(MAX_ENTRIES=10, CULL_INTERVAL=60)
+        with mock.patch.object(cache, "_list_cache_files", wraps=cache._list_cache_files) as listing:
+            for i in range(20):
+                cache.set(f"key{i}", i)
+        self.assertEqual(listing.call_count, 1)
+
+    def test_unbounded_cache_never_culls(self):
+        cache = self.cache(MAX_ENTRIES=None, CULL_INTERVAL=0)
+        for i in range(400):
+            cache.set(f"key{i}", i, None)
+        self.assertEqual(len(cache._list_cache_files()), 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class WeatherCacheTests(SimpleTestCase):
+    def test_historical_weather_goes_to_the_history_alias(self):
+        self.assertIs(travel_services.weather_cache_for(True), travel_services.weather_history_cache)
+        self.assertEqual(travel_services.weather_history_cache.alias, "history")
+        self.assertIsNone(travel_services.weather_cache_timeout(True))
+        self.assertIs(travel_services.weather_cache_for(False), travel_services.weather_cache)
+
+
+class PlannerValidationTests(TestCase):
+    TRIP = {"originLocationCode": "LHR", "destinationLocationCode": "CDG", "departureDate": "2030-05-01",
+            "checkInDate": "2030-05-01", "checkOutDate": "2030-05-04"}
+
+    def setUp(self):
+        # a real token, since the async view authenticates outside DRF
+        user = User.objects.create_user("traveller", password="secret")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}")
+
+    def test_non_integer_flexible_days_is_a_bad_request(self):
+        for path in ("/api/travel-planner/", "/api/travel-planner/async/", "/api/travel-planner/stream/"):
+            with self.subTest(path=path):
+                response = self.client.get(path, {**self.TRIP, "flexibleDays": "abc"})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("flexibleDays", response.json()["error"])
+
+    def test_empty_field_names_are_ignored(self):
+        self.assertEqual(requested_sections({"fields": "weather,,hotels,"}), {"weather", "hotels"})
+        self.assertEqual(requested_sections({"fields": ["weather", " "]}), {"weather"})
+        for fields in (",", " , ", [""]):
+            with self.subTest(fields=fields), self.assertRaisesMessage(InvalidTrip, "fields must name at least one"):
+                requested_sections({"fields": fields})
+
+    def test_trip_is_recorded_only_once_it_is_valid(self):
+        with mock.patch("api.views.record_trip") as record_trip:
+            for path in ("/api/travel-planner/", "/api/travel-planner/async/", "/api/travel-planner/stream/"):
+                with self.subTest(path=path):
+                    response = self.client.get(path, {**self.TRIP, "fields": "weather,itinerary"})
+                    self.assertEqual(response.status_code, 400)
+            response = self.client.post("/api/travel-planner/batch/",
+                                        {"trips": [{**self.TRIP, "fields": ["itinerary"]}]}, format="json")
+            self.assertEqual(response.json()["plans"], [{"error": "Unknown fields: itinerary"}])
+        record_trip.assert_not_called()
+
+
+class PlannerResponseTests(TestCase):
+    WEATHER = {"old_dates": True, "daily_data": []}
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("traveller", password="secret"))
+        self.upstream = {}
+        for name in ("record_trip", "get_flight_offers", "get_weather_forecast", "get_landmarks",
+                     "generate_travel_tips"):
+            patcher = mock.patch(f"api.views.{name}")
+            self.upstream[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+        self.upstream["get_weather_forecast"].return_value = self.WEATHER
+
+    def plan(self, **params):
+        return self.client.get("/api/travel-planner/", {**PlannerValidationTests.TRIP, **params})
+
+    def test_fields_skip_the_sections_left_out(self):
+        response = self.plan(fields="weather,hotels")
+        self.assertEqual(response.status_code, 200)
+        plan = response.json()
+        self.assertNotIn("flights", plan)
+        self.assertIn("hotels", plan)
+        self.assertEqual(set(plan["destination_info"]), {"city", "country", "weather"})
+        self.assertEqual([name for name, call in self.upstream.items() if call.called],
+                         ["record_trip", "get_weather_forecast"])
+
+    def test_unchanged_plan_is_a_304(self):
+        response = self.plan(fields="weather")
+        self.assertTrue(response.has_header("ETag"))
+        revalidated = self.client.get("/api/travel-planner/", {**PlannerValidationTests.TRIP, "fields": "weather"},
+                                      HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.content, b"")
+
+    def test_plan_is_compact_unless_pretty(self):
+        compact = self.plan(fields="weather").content
+        pretty = self.plan(fields="weather", pretty="1").content
+        self.assertNotIn(b"\n", compact)
+        self.assertNotIn(b": ", compact)
+        self.assertIn(b"\n  ", pretty)
+        self.assertEqual(json.loads(compact), json.loads(pretty))
+
+
+class PlannerRejectionTests(TestCase):
+    TRIP = {
+        **STREAM_TRIP,
+        "sections": {"weather", "landmarks", "travel_tips"},
+        "dest_airport": {"city": "Paris", "country": "FR", "lat": 48.86, "lon": 2.35},
+        "checkin_date": "2030-05-01",
+        "checkout_date": "2030-05-04",
+        "flexible_days": 0,
+    }
+    WEATHER = {"old_dates": True, "daily_data": []}
+
+    def setUp(self):
+        user = User.objects.create_user("traveller", password="secret")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}")
+
+    def plan(self, path, weather):
+        gemini = QuotaExceeded("gemini", 7)
+        with mock.patch("api.views.parse_trip", return_value=self.TRIP), \
+                mock.patch("api.views.record_planned_trip"), \
+                mock.patch.object(travel_services, "get_city_guide", side_effect=gemini), \
+                mock.patch.object(travel_services, "aget_city_guide", mock.AsyncMock(side_effect=gemini)), \
+                mock.patch("api.views.get_weather_forecast", side_effect=weather), \
+                mock.patch("api.views.aget_weather_forecast", mock.AsyncMock(side_effect=weather)):
+            return self.client.get(path)
+
+    def test_rejected_sections_are_unavailable_and_the_rest_is_served(self):
+        for path in ("/api/travel-planner/", "/api/travel-planner/async/"):
+            with self.subTest(path=path):
+                response = self.plan(path, lambda *args, **kwargs: self.WEATHER)
+                self.assertEqual(response.status_code, 200)
+                plan = response.json()
+                self.assertEqual(plan["destination_info"]["weather"], self.WEATHER)
+                self.assertEqual(sorted(plan["unavailable_sections"]), ["landmarks", "travel_tips"])
+
+    def test_plan_is_a_503_when_every_section_is_rejected(self):
+        for path in ("/api/travel-planner/", "/api/travel-planner/async/"):
+            with self.subTest(path=path):
+                response = self.plan(path, CircuitOpen("open_meteo", 3))
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response["Retry-After"], "7")
+
+    def test_gemini_wrappers_let_rejections_through(self):
+        with mock.patch.object(travel_services, "get_city_guide", side_effect=CircuitOpen("gemini", 30)):
+            with self.assertRaises(CircuitOpen):
+                travel_services.get_landmarks("Paris", "FR", 3)
+            with self.assertRaises(CircuitOpen):
+                travel_services.generate_travel_tips("Paris", "FR", 3)
+        with mock.patch.object(travel_services, "get_city_guide", side_effect=ValueError("bad model output")):
+            self.assertEqual(travel_services.get_landmarks("Paris", "FR", 3), [])
+
+
+class PlannerBatchTests(TestCase):
+    TRIP = {**PlannerValidationTests.TRIP, "fields": ["flights", "weather"]}
+    WEATHER = {"old_dates": True, "daily_data": []}
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("traveller", password="secret"))
+        for name in ("record_trip", "get_flight_offers", "get_weather_forecast"):
+            patcher = mock.patch(f"api.views.{name}")
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.get_flight_offers.return_value = []
+        self.get_weather_forecast.return_value = self.WEATHER
+
+    def batch(self, trips):
+        return self.client.post("/api/travel-planner/batch/", {"trips": trips}, format="json")
+
+    def test_trips_sharing_an_upstream_call_make_it_once(self):
+        other_origin = {**self.TRIP, "originLocationCode": "AMS"}
+        response = self.batch([self.TRIP, self.TRIP, other_origin])
+        self.assertEqual(response.status_code, 200)
+        plans = response.json()["plans"]
+        self.assertEqual(len(plans), 3)
+        self.assertTrue(all(plan["destination_info"]["weather"] == self.WEATHER for plan in plans))
+        self.assertEqual(self.get_flight_offers.call_count, 2)
+        self.assertEqual(self.get_weather_forecast.call_count, 1)
+
+    def test_a_failing_trip_does_not_fail_the_batch(self):
+        def flight_offers(origin, *args):
+            if origin == "AMS":
+                raise ValueError("no flights from AMS")
+            return []
+        self.get_flight_offers.side_effect = flight_offers
+
+        response = self.batch([self.TRIP, {"originLocationCode": "LHR"}, "LHR-CDG",
+                               {**self.TRIP, "originLocationCode": "AMS"}])
+        self.assertEqual(response.status_code, 200)
+        plans = response.json()["plans"]
+        self.assertEqual(plans[0]["flights"], [])
+        self.assertEqual(plans[1:], [{"error": "Missing required parameters"}, {"error": "Invalid trip"},
+                                     {"error": "no flights from AMS"}])
+
+
+class MetricsSnapshotTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = settings.METRICS["SNAPSHOT_DIR"]
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+
+    def write(self, name, snapshot, age=0):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            json.dump(snapshot, f)
+        os.utime(path, (time.time() - age, time.time() - age))
+        return path
+
+    def test_only_live_workers_are_read_and_the_rest_deleted(self):
+        exited = subprocess.Popen([sys.executable, "-c", "pass"])
+        exited.wait()
+        dead = self.write(f"{exited.pid}.json", {**process_snapshot(), "pid": exited.pid})
+        # the parent process is alive, but has not written a snapshot in SNAPSHOT_RETENTION seconds
+        expired = self.write(f"{os.getppid()}.json", {**process_snapshot(), "pid": os.getppid()}, age=2 * 60 * 60)
+        leftover = self.write("1234.json.tmp", {}, age=2 * 60 * 60)
+        self.assertEqual([snapshot["pid"] for snapshot in read_snapshots()], [os.getpid()])
+        for path in (dead, expired, leftover):
+            self.assertFalse(os.path.exists(path))
+
+    def test_series_are_per_worker(self):
+        snapshot = {**process_snapshot(), "errors": [["gemini", "TimeoutError", 3]],
+                    "breakers": {"gemini": {"state": "open", "times_opened": 1, "rejected": 4}}}
+        lines = render_prometheus([{**snapshot, "pid": 11}, {**snapshot, "pid": 12}]).splitlines()
+        for pid in (11, 12):
+            self.assertIn(f'travel_errors_total{{pid="{pid}",name="gemini",error="TimeoutError"}} 3', lines)
+            self.assertIn(f'travel_breaker_open{{pid="{pid}",provider="gemini"}} 1', lines)
+        self.assertIn("travel_processes 2", lines)
+
+
+class MetricsAccessTests(SimpleTestCase):
+    def metrics_settings(self, **options):
+        return override_settings(METRICS={**settings.METRICS, **options})
+
+    def test_closed_without_a_token(self):
+        with self.metrics_settings(TOKEN=None):
+            self.assertEqual(self.client.get("/api/metrics/", REMOTE_ADDR="127.0.0.1").status_code, 403)
+
+    def test_requires_the_bearer_token_even_from_localhost(self):
+        with self.metrics_settings(TOKEN="scrape-secret"):
+            self.assertEqual(self.client.get("/api/metrics/", REMOTE_ADDR="127.0.0.1").status_code, 403)
+            self.assertEqual(self.client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+            response = self.client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer scrape-secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"travel_processes", response.content)
+
+    def test_allowed_ips_still_apply(self):
+        with self.metrics_settings(TOKEN="scrape-secret", ALLOWED_IPS=["10.0.0.5"]):
+            response = self.client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer scrape-secret",
+                                       REMOTE_ADDR="127.0.0.1")
+        self.assertEqual(response.status_code, 403)
+
+
+class AirportIndexTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(cls.directory.name, "airports.bin")
+        build_airport_store(path)
+        cls.store = AirportStore(path)
+        cls.spatial = AirportSpatialIndex(cls.store)
+        cls.prefix = AirportPrefixIndex(cls.store)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.store._map.close()
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def brute_force(self, lat, lon, radius_km, limit):
+        target = unit_vector(lat, lon)
+        distances = []
+        for airport in self.store:
+            chord = math.dist(target, unit_vector(airport["lat"], airport["lon"]))
+            if chord_to_km(chord) <= radius_km:
+                distances.append((chord, airport["iata"]))
+        return [iata for _, iata in sorted(distances)[:limit]]
+
+    def test_store_lookups(self):
+        self.assertEqual(self.store.get("CDG")["city"], "Paris")
+        self.assertIsNone(self.store.get("QQQ"))
+
+    def test_nearest_matches_a_full_scan(self):
+        for lat, lon in ((48.85, 2.35), (40.7, -74.0), (-33.9, 151.2), (64.1, -21.9), (0.0, 0.0)):
+            with self.subTest(lat=lat, lon=lon):
+                found = self.spatial.nearest(lat, lon, radius_km=300, limit=8)
+                self.assertEqual([airport["iata"] for airport in found], self.brute_force(lat, lon, 300, 8))
+                self.assertTrue(all(airport["distance_km"] <= 300 for airport in found))
+                self.assertEqual([a["distance_km"] for a in found], sorted(a["distance_km"] for a in found))
+
+    def test_nearest_across_the_antimeridian(self):
+        # Fiji straddles 180°: airports on both sides are neighbours
+        east = self.spatial.nearest(-16.5, 180.0, radius_km=400, limit=20)
+        west = self.spatial.nearest(-16.5, -180.0, radius_km=400, limit=20)
+        self.assertEqual([a["iata"] for a in east], [a["iata"] for a in west])
+        self.assertEqual([a["iata"] for a in east], self.brute_force(-16.5, 180.0, 400, 20))
+        self.assertTrue(any(a["lon"] > 0 for a in east) and any(a["lon"] < 0 for a in east))
+
+    def test_nearest_respects_the_radius(self):
+        self.assertEqual(self.spatial.nearest(-50.0, -140.0, radius_km=100), [])
+
+    def test_prefix_search_ranks_codes_then_cities(self):
+        self.assertEqual(self.prefix.search("cdg", 1)[0]["iata"], "CDG")
+        self.assertEqual(self.prefix.search("Zürich", 1)[0]["iata"], "ZRH")
+        self.assertEqual(self.prefix.search("zurich", 1)[0]["iata"], "ZRH")
+        paris = self.prefix.search("paris", 5)
+        self.assertTrue(all(airport["city"] == "Paris" for airport in paris[:2]))
+        self.assertFalse(is_minor_airport(paris[0]))
+        self.assertEqual(self.prefix.search("   ", 5), [])
+
+    def test_rank_destinations_prefers_international_airports(self):
+        airports = [
+            {"iata": "AAA", "name": "Village Airfield", "distance_km": 5.0},
+            {"iata": "BBB", "name": "Capital International Airport", "distance_km": 40.0},
+            {"iata": "CCC", "name": "Aéroport International", "distance_km": 30.0},
+        ]
+        self.assertEqual([a["iata"] for a in rank_destinations(airports)], ["CCC", "BBB", "AAA"])
+        self.assertEqual(rank_destinations(airports[:1])[0]["iata"], "AAA")
+
+
+class AirportEndpointTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("traveller", password="secret"))
+
+    def autocomplete(self, **params):
+        return self.client.get("/api/airports/autocomplete/", params)
+
+    def test_autocomplete_is_revalidated_through_its_etag(self):
+        response = self.autocomplete(q="par")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("max-age=86400", response["Cache-Control"])
+        revalidated = self.client.get("/api/airports/autocomplete/", {"q": "Par "},
+                                      HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertNotEqual(self.autocomplete(q="par", limit=3)["ETag"], response["ETag"])
+
+    def test_autocomplete_limit_is_capped(self):
+        response = self.autocomplete(q="a", limit=500)
+        self.assertEqual(len(response.json()["results"]), AUTOCOMPLETE_MAX_LIMIT)
+        self.assertEqual(response["ETag"], self.autocomplete(q="a", limit=AUTOCOMPLETE_MAX_LIMIT)["ETag"])
+        self.assertEqual(self.autocomplete(q="a", limit="abc")["ETag"], self.autocomplete(q="a")["ETag"])
+
+    def test_nearest_radius_must_be_positive(self):
+        for radius in ("-50", "0", "nan"):
+            with self.subTest(radius=radius):
+                response = self.client.get("/api/airports/nearest/", {"lat": 48.86, "lon": 2.35, "radius": radius})
+                self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/airports/nearest/", {"lat": 48.86, "lon": 2.35, "radius": 50})
+        self.assertIn("CDG", [airport["iata"] for airport in response.json()["results"]])
+
+
+class RateGovernorTests(SimpleTestCase):
+    def governor(self, **options):
+        return RateGovernor("test", **{"rate": 1000, "burst": 1000, "max_concurrency": 1, "max_queue": 10,
+                                       "max_wait": 2, **options})
+
+    def hold(self, governor):
+        """Take the governor's only slot on another thread; set the returned event to give it back."""
+        entered, release = threading.Event(), threading.Event()
+
+        def run():
+            with governor.limit():
+                entered.set()
+                release.wait(5)
+        thread = threading.Thread(target=run)
+        thread.start()
+        entered.wait(5)
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        return release
+
+    def admit(self, governor, priority, order):
+        with governor.limit(priority):
+            order.append(priority)
+
+    def test_interactive_callers_go_before_background_ones(self):
+        governor, order = self.governor(), []
+        release = self.hold(governor)
+        threads = []
+        for priority in (BACKGROUND, BACKGROUND, INTERACTIVE):
+            threads.append(threading.Thread(target=lambda priority=priority: self.admit(governor, priority, order)))
+            threads[-1].start()
+            wait_for(lambda n=len(threads): governor.stats()["queue_depth"] == n)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [INTERACTIVE, BACKGROUND, BACKGROUND])
+
+    def test_full_queue_rejects_at_once(self):
+        governor = self.governor(max_queue=1, max_wait=0.3)
+        self.hold(governor)
+        waiter = threading.Thread(target=lambda: self.assertRaises(QuotaExceeded, self.admit, governor, 0, []))
+        waiter.start()
+        wait_for(lambda: governor.stats()["queue_depth"] == 1)
+        started = time.monotonic()
+        with self.assertRaises(QuotaExceeded):
+            self.admit(governor, INTERACTIVE, [])
+        self.assertLess(time.monotonic() - started, 0.5)
+        waiter.join()
+
+    def test_gives_up_after_max_wait_and_leaves_the_queue(self):
+        governor = self.governor(rate=0.01, burst=1, max_concurrency=5, max_wait=0.2)
+        self.admit(governor, INTERACTIVE, [])
+        with self.assertRaises(QuotaExceeded):
+            self.admit(governor, INTERACTIVE, [])
+        stats = governor.stats()
+        self.assertEqual((stats["queue_depth"], stats["admitted"], stats["rejected"]), (0, 1, 1))
+
+    def test_queue_wait_is_timed_for_server_timing(self):
+        governor = self.governor()
+        threading.Timer(0.2, self.hold(governor).set).start()
+        timings = []
+        token = request_timings.set(timings)
+        try:
+            self.admit(governor, INTERACTIVE, [])
+        finally:
+            request_timings.reset(token)
+        [(name, seconds)] = timings
+        self.assertEqual(name, "test_queue")
+        self.assertGreaterEqual(seconds, 0.15)
+
+    def test_cancelled_async_caller_does_not_block_the_queue(self):
+        governor = self.governor(rate=0.01, burst=1, max_concurrency=5, max_wait=5)
+        self.admit(governor, INTERACTIVE, [])
+
+        async def waiter():
+            async with governor.alimit():
+                pass
+
+        async def main():
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(waiter(), 0.1)
+
+        asyncio.run(main())
+        self.assertEqual(governor.stats()["queue_depth"], 0)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.005)
+
+
+class IterSectionsTests(SimpleTestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.executor.shutdown, wait=True)
+
+    def test_yields_sections_in_completion_order(self):
+        executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(executor.shutdown)
+        tasks = {"slow": lambda: time.sleep(0.2) or "slow", "fast": lambda: "fast"}
+        names = [name for name, _, _ in iter_sections(tasks, executor, lambda name: 5)]
+        self.assertEqual(names, ["fast", "slow"])
+
+    def test_missed_deadline_is_unavailable_without_waiting(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        started = time.monotonic()
+        results, unavailable, _ = run_sections(
+            {"hung": lambda: release.wait(5)}, self.executor, lambda name: 0.1)
+        self.assertEqual((results, unavailable), ({}, ["hung"]))
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_queued_section_past_its_deadline_never_runs(self):
+        release, ran = threading.Event(), threading.Event()
+        self.addCleanup(release.set)
+        tasks = {"busy": lambda: release.wait(5), "queued": ran.set}
+        sections = dict((name, result) for name, result, _ in iter_sections(
+            tasks, self.executor, lambda name: 0.1))
+        release.set()
+        self.executor.shutdown(wait=True)
+        self.assertIs(sections["queued"], UNAVAILABLE)
+        self.assertFalse(ran.is_set())
+
+    def test_stopping_early_cancels_queued_sections(self):
+        release, ran = threading.Event(), threading.Event()
+        tasks = {"first": lambda: "done", "busy": lambda: release.wait(5), "queued": ran.set}
+        sections = iter_sections(tasks, self.executor, lambda name: 5)
+        self.assertEqual(next(sections)[0], "first")
+        sections.close()
+        release.set()
+        self.executor.shutdown(wait=True)
+        self.assertFalse(ran.is_set())
+
+    def test_section_errors_propagate(self):
+        def fail():
+            raise ValueError("bad section")
+        with self.assertRaises(ValueError):
+            run_sections({"broken": fail}, self.executor, lambda name: 5)
+
+    def test_stale_sections_are_reported(self):
+        def stale():
+            stale_keys.get().append("weather:key")
+            return "old forecast"
+        results, _, stale_sections = run_sections({"weather": stale, "fresh": lambda: 1}, self.executor,
+                                                  lambda name: 5)
+        self.assertEqual((results["weather"], stale_sections), ("old forecast", ["weather"]))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@override_settings(CACHES=LOCMEM_CACHES)
+class TwoTierCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = TwoTierCache(f"test-{self.id()}")
+
+    def test_local_then_shared_tier(self):
+        self.cache.set("key", {"value": 1}, 60)
+        self.assertEqual(self.cache.get("key"), {"value": 1})
+        self.cache._local.clear()
+        self.assertEqual(self.cache.get("key"), {"value": 1})
+        self.assertEqual((self.cache.local_hits, self.cache.shared_hits, self.cache.misses), (1, 1, 0))
+
+    def test_promoted_value_keeps_its_deadline(self):
+        with mock.patch("api.services.cache_services.time.time", return_value=1000):
+            self.cache.set("key", "value", 60)
+        self.cache._local.clear()
+        with mock.patch("api.services.cache_services.time.time", return_value=1061):
+            self.assertIs(self.cache.get("key"), MISSING)
+
+    def test_none_timeout_keeps_the_value(self):
+        self.cache.set("key", "forever", None)
+        with mock.patch("api.services.cache_services.time.time", return_value=time.time() + 10 ** 9):
+            self.assertEqual(self.cache.get("key"), "forever")
+
+    def test_get_or_fetch_skips_uncacheable_values(self):
+        calls = []
+        for _ in range(2):
+            self.cache.get_or_fetch("key", lambda: calls.append(1) or [], 60)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.cache.get_or_fetch("other", lambda: ["value"], 60), ["value"])
+        self.assertEqual(self.cache.get("other"), ["value"])
+
+    def test_async_lookups_reach_the_shared_tier_in_parallel_off_the_loop(self):
+        self.cache.set("key", "value", 60)
+        self.cache._local.clear()
+        threads, locmem_get = set(), LocMemCache.get
+
+        def slow_get(cache, *args, **kwargs):
+            threads.add(threading.get_ident())
+            time.sleep(0.2)
+            return locmem_get(cache, *args, **kwargs)
+
+        async def main():
+            started = time.monotonic()
+            values = await asyncio.gather(*(self.cache.aget("key") for _ in range(4)))
+            return values, time.monotonic() - started, threading.get_ident()
+
+        with mock.patch.object(LocMemCache, "get", slow_get):
+            values, seconds, loop_thread = asyncio.run(main())
+        self.assertEqual(values, ["value"] * 4)
+        self.assertLess(seconds, 0.6)
+        self.assertNotIn(loop_thread, threads)
+
+
+class AsyncClientTests(SimpleTestCase):
+    def test_client_is_shared_within_a_loop_and_closed_with_it(self):
+        async def main():
+            return asyncio.get_running_loop(), http_services.get_async_client(), http_services.get_async_client()
+
+        # asyncio.run, and async_to_sync as Django runs an async view under WSGI
+        for run in (lambda main: asyncio.run(main()), lambda main: async_to_sync(main)()):
+            loop, client, again = run(main)
+            self.assertIs(client, again)
+            self.assertTrue(client.is_closed)
+            self.assertNotIn(loop, http_services._async_clients)
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    """Answers with the (status, headers) pairs of `script` in turn, then 200; logs (method, path)."""
+
+    script, log = [], []
+
+    def respond(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.log.append((self.command, self.path))
+        status, headers = self.script.pop(0) if self.script else (200, {})
+        self.send_response(status)
+        for name, value in {**headers, "Content-Length": "2"}.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    do_GET = do_POST = respond
+
+    def log_message(self, *args):
+        pass
+
+
+class OutboundRetryTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), ScriptedHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        override = override_settings(OUTBOUND_HTTP={**settings.OUTBOUND_HTTP, "RETRIES": 2, "BACKOFF_FACTOR": 1,
+                                                    "BACKOFF_JITTER": 0, "BACKOFF_MAX": 3})
+        override.enable()
+        self.addCleanup(override.disable)
+        # a session built with the settings above
+        patcher = mock.patch.object(http_services, "_session", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ScriptedHandler.log.clear()
+
+    def serve(self, *responses):
+        ScriptedHandler.script[:] = responses
+
+    def test_backoff_grows_up_to_the_cap_and_honours_retry_after(self):
+        self.assertEqual([http_services.retry_delay(attempt) for attempt in range(4)], [1, 2, 3, 3])
+        self.assertEqual(http_services.retry_delay(0, "2"), 2)
+        self.assertEqual(http_services.retry_delay(0, "60"), 3)
+        self.assertEqual(http_services.retry_delay(1, "Wed, 21 Oct 2015 07:28:00 GMT"), 2)
+
+    def test_session_retries_a_get_after_retry_after(self):
+        self.serve((503, {"Retry-After": "2"}), (502, {}))
+        with mock.patch("urllib3.util.retry.time.sleep") as sleep:
+            response = http_services.http_request("GET", f"{self.url}/forecast")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(ScriptedHandler.log), 3)
+        self.assertEqual(sleep.call_args_list[0], mock.call(2))
+
+    def test_session_gives_up_after_the_retries(self):
+        self.serve(*[(503, {})] * 5)
+        with mock.patch("urllib3.util.retry.time.sleep"):
+            response = http_services.http_request("GET", f"{self.url}/forecast")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(ScriptedHandler.log), 3)
+
+    def test_amadeus_token_post_is_retried_and_other_posts_are_not(self):
+        for path, requests_made in ((http_services.AMADEUS_TOKEN_PATH, 2), ("/v1/booking/flight-orders", 1)):
+            with self.subTest(path=path):
+                ScriptedHandler.log.clear()
+                self.serve((429, {"Retry-After": "1"}))
+                request = Request(f"{self.url}{path}", data=b"grant_type=client_credentials", method="POST")
+                with mock.patch("api.services.http_services.time.sleep") as sleep:
+                    response = http_services.amadeus_http(request)
+                self.assertEqual(len(ScriptedHandler.log), requests_made)
+                self.assertEqual(response.status, 200 if requests_made == 2 else 429)
+                if requests_made == 2:
+                    sleep.assert_called_once_with(1)
+
+    def test_async_requests_retry_after_retry_after(self):
+        self.serve((429, {"Retry-After": "2"}))
+        with mock.patch("api.services.http_services.asyncio.sleep", mock.AsyncMock()) as sleep:
+            response = asyncio.run(http_services.ahttp_request("GET", f"{self.url}/forecast"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(ScriptedHandler.log), 2)
+        sleep.assert_awaited_once_with(2)
+
+    def gemini_error(self, error_class, status, **headers):
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response._content = json.dumps({"error": {"code": status, "status": "UNAVAILABLE"}}).encode()
+        return error_class(status, response)
+
+    def test_gemini_calls_retry_server_errors_only(self):
+        call = mock.Mock(side_effect=[self.gemini_error(genai_errors.ServerError, 503, **{"Retry-After": "1"}),
+                                      "guide"])
+        with mock.patch("api.services.http_services.time.sleep") as sleep:
+            self.assertEqual(http_services.call_with_retries(call), "guide")
+        sleep.assert_called_once_with(1)
+
+        call = mock.Mock(side_effect=self.gemini_error(genai_errors.ClientError, 400))
+        with self.assertRaises(genai_errors.ClientError):
+            http_services.call_with_retries(call)
+        self.assertEqual(call.call_count, 1)
+
+    def test_async_gemini_calls_retry_rate_limits(self):
+        call = mock.AsyncMock(side_effect=[self.gemini_error(genai_errors.ClientError, 429)] * 3)
+        with mock.patch("api.services.http_services.asyncio.sleep", mock.AsyncMock()) as sleep:
+            with self.assertRaises(genai_errors.ClientError):
+                asyncio.run(http_services.acall_with_retries(call))
+        self.assertEqual(call.await_count, 3)
+        self.assertEqual([args[0][0] for args in sleep.await_args_list], [1, 2])
+
+
+class UpstreamError(Exception):
+    """Stands in for an HTTP error carrying the provider's response."""
+
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.response = mock.Mock(status_code=status_code)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("api.services.breaker_services.time.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+
+    def fail(self, status_code=503):
+        def raise_error():
+            raise UpstreamError(status_code)
+        with self.assertRaises(UpstreamError):
+            self.breaker.call(raise_error)
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail()
+        self.fail()
+        self.breaker.call(lambda: "ok")
+        self.fail()
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpen) as raised:
+            self.breaker.call(lambda: "not called")
+        self.assertEqual(raised.exception.retry_after, 30)
+
+    def test_client_errors_do_not_count(self):
+        for _ in range(5):
+            self.fail(404)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.fail(429)
+        self.fail(429)
+        self.fail(429)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_half_open_lets_one_probe_through(self):
+        for _ in range(3):
+            self.fail()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        for _ in range(3):
+            self.fail()
+        self.now += 30
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.stats()["times_opened"], 2)
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+
+    def test_successful_probe_closes_and_runs_queued_refreshes(self):
+        refreshed = threading.Event()
+        self.breaker.refresh_on_recovery("ignored while closed", lambda: None)
+        for _ in range(3):
+            self.fail()
+        self.breaker.refresh_on_recovery("weather:key", refreshed.set)
+        self.breaker.refresh_on_recovery("weather:key", refreshed.set)
+        self.assertEqual(self.breaker.stats()["pending_refreshes"], 1)
+        self.now += 30
+        self.assertEqual(self.breaker.call(lambda: "ok"), "ok")
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(refreshed.wait(5))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class StaleFallbackTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = TwoTierCache(f"test-{self.id()}")
+        self.breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+        with mock.patch("api.services.cache_services.time.time", return_value=time.time() - 120):
+            self.cache.set("key", "last forecast", 60)
+        self.cache._local.clear()
+
+    def fetch(self, fetch):
+        keys = []
+        token = stale_keys.set(keys)
+        try:
+            return self.cache.get_or_fetch("key", fetch, 60, breaker=self.breaker), keys
+        finally:
+            stale_keys.reset(token)
+
+    def test_failing_provider_is_answered_from_the_stale_copy(self):
+        def fail():
+            raise UpstreamError(503)
+        self.assertEqual(self.fetch(fail), ("last forecast", ["key"]))
+        # the breaker opened, so the next call does not reach the provider at all
+        fetch = mock.Mock()
+        self.assertEqual(self.fetch(fetch), ("last forecast", ["key"]))
+        fetch.assert_not_called()
+        self.assertEqual(self.breaker.stats()["pending_refreshes"], 1)
+
+    def test_client_errors_are_not_hidden_by_the_stale_copy(self):
+        def bad_request():
+            raise UpstreamError(400)
+        with self.assertRaises(UpstreamError):
+            self.fetch(bad_request)
+
+    def test_no_stale_copy_raises(self):
+        self.breaker.record_failure(UpstreamError(503))
+        with self.assertRaises(CircuitOpen):
+            self.cache.get_or_fetch("unknown", mock.Mock(), 60, breaker=self.breaker)
+
+
+def recorded_flight_offers(copies=3):
+    """Raw Amadeus offers recorded for the benchmarks, repeated `copies` times under distinct ids."""
+    with open(os.path.join(os.path.dirname(__file__), "..", "benchmarks", "fixtures",
+                           "amadeus_flight_offers.json")) as f:
+        recorded = json.load(f)["data"]
+    return [{**offer, "id": str(i)} for i, offer in enumerate(recorded * copies)]
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FlightSearchCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.raw = recorded_flight_offers()
+        caches["default"].clear()
+        flight_services.flight_offers_cache._local.clear()
+        self.addCleanup(flight_services.flight_offers_cache._local.clear)
+        patcher = mock.patch.object(flight_services, "get_client")
+        self.search_api = patcher.start().return_value.shopping.flight_offers_search.get
+        self.search_api.side_effect = lambda **params: mock.Mock(data=self.raw[:params["max"]])
+        self.addCleanup(patcher.stop)
+
+    def search(self, max_results):
+        return get_flight_offers("LHR", "CDG", "2030-05-01", 1, "EUR", max_results, "BUSINESS")
+
+    def test_cached_search_covers_smaller_maxes(self):
+        cached = {"max": 10, "data": list(range(10))}
+        self.assertIsNone(cached_flight_offers(MISSING, 5))
+        self.assertEqual(cached_flight_offers(cached, 5), [0, 1, 2, 3, 4])
+        self.assertIsNone(cached_flight_offers(cached, 20))
+        # Amadeus had only two offers to give, so a larger max would get the same two
+        self.assertEqual(cached_flight_offers({"max": 10, "data": [0, 1]}, 50), [0, 1])
+
+    def test_smaller_search_is_sliced_from_the_cached_one(self):
+        larger = self.search(10)
+        smaller = self.search(5)
+        self.assertEqual([offer.id for offer in smaller], [offer.id for offer in larger[:5]])
+        self.assertEqual(self.search_api.call_count, 1)
+
+    def test_larger_search_asks_amadeus_again(self):
+        self.search(5)
+        self.assertEqual(len(self.search(10)), 10)
+        self.assertEqual(self.search_api.call_count, 2)
+
+    def test_smaller_search_finishing_last_keeps_the_larger_entry(self):
+        smaller_sent, release_smaller = threading.Event(), threading.Event()
+
+        def search_api(**params):
+            if params["max"] == 5:
+                smaller_sent.set()
+                release_smaller.wait(5)
+            return mock.Mock(data=self.raw[:params["max"]])
+        self.search_api.side_effect = search_api
+
+        smaller = threading.Thread(target=self.search, args=(5,))
+        smaller.start()
+        self.assertTrue(smaller_sent.wait(5))
+        self.search(10)
+        release_smaller.set()
+        smaller.join(5)
+
+        self.assertEqual(len(self.search(10)), 10)
+        self.assertEqual(self.search_api.call_count, 2)
+
+    def test_entry_is_replaced_only_by_one_that_covers_as_much(self):
+        larger, smaller = {"max": 10, "data": list(range(10))}, {"max": 5, "data": list(range(5))}
+        self.assertTrue(should_store_flight_offers(MISSING, smaller))
+        self.assertTrue(should_store_flight_offers(smaller, larger))
+        self.assertFalse(should_store_flight_offers(larger, smaller))
+        self.assertTrue(should_store_flight_offers(larger, {"max": 5, "data": [0, 1]}))
+
+    def test_search_that_came_back_short_answers_any_max(self):
+        self.assertEqual(len(self.search(20)), len(self.raw))
+        self.assertEqual(len(self.search(50)), len(self.raw))
+        self.assertEqual(self.search_api.call_count, 1)
+
+
+class FlexibleDateTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.raw = recorded_flight_offers(1)[0]
+
+    def offers(self, *totals):
+        return compact_offers([{**self.raw, "price": {**self.raw["price"], "total": total}} for total in totals])
+
+    def test_cheapest_date_and_its_offers_are_picked(self):
+        cheapest = self.offers("310.00", "95.50")
+        grid = summarize_date_grid({
+            "2030-05-01": self.offers("120.00", "180.00"),
+            "2030-05-02": cheapest,
+            "2030-05-03": [],
+            "2030-05-04": TimeoutError(),
+        })
+        self.assertEqual(grid["cheapest_date"], "2030-05-02")
+        self.assertIs(grid["offers"], cheapest)
+        self.assertEqual(grid["prices"], {
+            "2030-05-01": {"price": "120.00", "currency": "EUR"},
+            "2030-05-02": {"price": "95.50", "currency": "EUR"},
+            "2030-05-03": None,
+            "2030-05-04": None,
+        })
+
+    def test_prices_compare_as_numbers(self):
+        grid = summarize_date_grid({"2030-05-01": self.offers("99.00"), "2030-05-02": self.offers("100.00")})
+        self.assertEqual(grid["cheapest_date"], "2030-05-01")
+
+    def test_no_offers_on_any_date_is_an_empty_grid(self):
+        grid = summarize_date_grid({"2030-05-01": [], "2030-05-02": None})
+        self.assertEqual(grid, {"prices": {"2030-05-01": None, "2030-05-02": None}, "cheapest_date": None,
+                                "offers": []})
+
+    def test_every_search_failing_raises_the_first_error(self):
+        first = UpstreamError(503)
+        with self.assertRaises(UpstreamError) as raised:
+            summarize_date_grid({"2030-05-01": first, "2030-05-02": UpstreamError(500)})
+        self.assertIs(raised.exception, first)
+
+    def test_departure_dates_skip_the_past(self):
+        today = date.today()
+        self.assertEqual(flexible_departure_dates(today.isoformat(), 1),
+                         [today.isoformat(), (today + timedelta(days=1)).isoformat()])
+
+
+class FlightOfferPagingTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.offers = compact_offers(recorded_flight_offers())
+
+    def test_pages_cover_every_offer_once(self):
+        seen, offset = [], 0
+        while True:
+            page, cursor = page_flight_offers(self.offers, offset, 5)
+            seen.extend(offer.id for offer in page)
+            if cursor is None:
+                break
+            offset = decode_cursor(cursor)
+        self.assertEqual(seen, [offer.id for offer in self.offers])
+
+    def test_last_page_has_no_cursor(self):
+        self.assertIsNone(page_flight_offers(self.offers, 0, len(self.offers))[1])
+        self.assertEqual(page_flight_offers(self.offers, len(self.offers) + 5, 5), ([], None))
+
+    def test_cursor_round_trip_and_rejection(self):
+        self.assertEqual(decode_cursor(encode_cursor(40)), 40)
+        for cursor in ("", "bm90LWFuLW9mZnNldA", "b2Zmc2V0Oi0x", "!!"):
+            with self.subTest(cursor=cursor), self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+    def test_sort_and_filter(self):
+        by_price = select_flight_offers(self.offers, sort="price")
+        self.assertEqual([o.price for o in by_price], sorted(o.price for o in self.offers))
+        direct = select_flight_offers(self.offers, max_stops=0, airlines=frozenset({"IB", "TP"}))
+        self.assertEqual({(offer.stops, offer.airlines) for offer in direct}, {(0, ("IB",))})
+        morning = select_flight_offers(self.offers, departure_after="07:00", departure_before="10:00")
+        self.assertEqual({offer.departure_at[11:16] for offer in morning}, {"07:15", "09:55"})
+
+
+class ClimateStoreTests(SimpleTestCase):
+    GRID = 0.25
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "climate.bin")
+        days = climate_services.DAYS
+        # Paris: 20.0°C highs and 10.0°C lows all year except a missing February 29
+        tmax = array("h", [200] * days)
+        tmin = array("h", [100] * days)
+        tmax[59] = tmin[59] = climate_services.NO_TEMPERATURE
+        codes = bytes([3] * 200 + [61] * (days - 200))
+        key = climate_services.cell_key(48.85, 2.35, self.GRID)
+        climate_services.write_climate_store(self.path, {key: (tmax, tmin, codes)}, 2015, 2024, self.GRID)
+
+    def test_daily_and_summary(self):
+        store = climate_services.ClimateStore(self.path)
+        self.assertEqual((len(store), store.first_year, store.last_year), (1, 2015, 2024))
+        days = store.daily(48.86, 2.34, date(2028, 2, 28), date(2028, 3, 1))
+        self.assertEqual([(high, low) for _, high, low, _ in days], [(20.0, 10.0), (None, None), (20.0, 10.0)])
+        summary = store.summary(48.86, 2.34, date(2027, 12, 31), date(2028, 1, 4))
+        self.assertEqual((summary["temp_mean"], summary["weather_code"]), (15.0, 3))
+        self.assertIsNone(store.daily(-33.9, 151.2, date(2028, 1, 1), date(2028, 1, 2)))
+
+    def test_found_right_after_boot(self):
+        # a fresh copy of the module, as a worker that just started has it
+        spec = importlib.util.spec_from_file_location(climate_services.__name__, climate_services.__file__)
+        fresh = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(fresh)
+        # time.monotonic() counts from boot, so it is small on a host that just started
+        with override_settings(CLIMATE_NORMALS_PATH=self.path), \
+                mock.patch("api.services.climate_services.time.monotonic", return_value=12.0):
+            self.assertIsNotNone(fresh.get_climate_store())
+
+
+class ClientRegistryTests(SimpleTestCase):
+    def test_built_once_on_first_use(self):
+        factory = mock.Mock(side_effect=object)
+        register_client("test-once", factory)
+        factory.assert_not_called()
+        self.assertIs(get_client("test-once"), get_client("test-once"))
+        factory.assert_called_once_with()
+
+    @skipUnless(hasattr(os, "fork"), "needs fork")
+    def test_forked_worker_builds_its_own_client(self):
+        register_client("test-fork", object)
+        parent_client = get_client("test-fork")
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            os.write(write, b"own" if get_client("test-fork") is not parent_client else b"shared")
+            os._exit(0)
+        os.close(write)
+        with os.fdopen(read, "rb") as f:
+            result = f.read()
+        os.waitpid(pid, 0)
+        self.assertEqual(result, b"own")
+        self.assertIs(get_client("test-fork"), parent_client)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TrafficPruningTests(TestCase):
+    def setUp(self):
+        today = date.today()
+        for age in (1, 45):
+            TripTraffic.objects.create(day=today - timedelta(days=age), origin="LHR", destination="XXX",
+                                       departure_date=today - timedelta(days=age - 1), trip_days=3, requests=1)
+
+    def test_warm_caches_leaves_traffic_alone(self):
+        report = warm_caches(routes=0)
+        self.assertEqual(report["unknown_destinations"], ["XXX"])
+        self.assertEqual(TripTraffic.objects.count(), 2)
+
+    def test_prune_traffic_keeps_the_retention_window(self):
+        self.assertEqual(prune_traffic(), 1)
+        self.assertEqual(prune_traffic(30), 0)
+        self.assertEqual(TripTraffic.objects.get().day, date.today() - timedelta(days=1))
+
+
+class ProfilingTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        override = override_settings(PROFILING={**settings.PROFILING, "ENABLED": True, "SAMPLE_RATE": 1.0,
+                                                "OUTPUT_DIR": self.directory})
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def plan(self, request):
+        results, unavailable, _ = run_sections({"weather": lambda: sum(range(1000))})
+        return HttpResponse(json.dumps({"weather": results["weather"], "unavailable": unavailable}))
+
+    def test_profiled_request_writes_a_report(self):
+        response = ProfilingMiddleware(self.plan)(RequestFactory().get("/api/travel-planner/"))
+        self.assertEqual(json.loads(response.content), {"weather": 499500, "unavailable": []})
+        name = response["X-Profile-Id"]
+        self.assertTrue(os.path.exists(os.path.join(self.directory, f"{name}.prof")))
+        with open(os.path.join(self.directory, f"{name}.txt")) as f:
+            self.assertIn("profiled by sampling", f.read())
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_request_runs_unprofiled_when_another_profiler_is_active(self):
+        # what Python 3.12+ raises while another request (or anything else) is being profiled
+        busy = ValueError("Another profiling tool is already active")
+        with mock.patch.object(cProfile.Profile, "enable", side_effect=busy):
+            response = ProfilingMiddleware(self.plan)(RequestFactory().get("/api/travel-planner/"))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("X-Profile-Id"))
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertIsNone(profiling_services.request_profiles.get())
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_section_runs_unprofiled_when_the_profiler_is_taken(self):
+        profiles = []
+        token = profiling_services.request_profiles.set(profiles)
+        self.addCleanup(profiling_services.request_profiles.reset, token)
+        with mock.patch.object(cProfile.Profile, "enable", side_effect=ValueError("in use")):
+            self.assertEqual(profiling_services.run_profiled(lambda: "landmarks"), "landmarks")
+        self.assertEqual(profiles, [])
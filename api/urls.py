@@ -1,6 +1,13 @@
 from django.urls import path
-from .views import travel_planner
+from .views import (airport_autocomplete, metrics, nearest_airports, travel_planner, travel_planner_async,
+                    travel_planner_batch, travel_planner_stream)
 
 urlpatterns = [
     path('travel-planner/', travel_planner),
+    path('travel-planner/async/', travel_planner_async),
+    path('travel-planner/batch/', travel_planner_batch),
+    path('travel-planner/stream/', travel_planner_stream),
+    path('airports/autocomplete/', airport_autocomplete),
+    path('airports/nearest/', nearest_airports),
+    path('metrics/', metrics),
 ]
@@ -1,74 +1,560 @@
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
 from rest_framework.permissions import IsAuthenticated
 
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import etag
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.settings import api_settings
 from amadeus import ResponseError
+import hmac
+import httpx
 
+from .renderers import EventStreamRenderer, NDJSONRenderer
+from .services.airport_services import (get_airport_prefix_index, get_airport_spatial_index, get_airport_store,
+                                       normalize_search_text, rank_destinations)
 from .services.hotel_services import create_booking_url
-from .services.travel_services import generate_travel_tips, get_landmarks, get_weather_forecast
-from .services.flight_services import get_airport_info, get_flight_offers, process_flight_offers
+from .services.travel_services import (agenerate_travel_tips, aget_landmarks, aget_weather_forecast, city_guide_key,
+                                      generate_travel_tips, get_landmarks, get_weather_forecast, weather_cell_key)
+from .services.flight_services import (SORT_KEYS, aget_flight_offers, asearch_flexible_dates, decode_cursor,
+                                      get_airport_info, get_flight_offers, page_flight_offers, process_flight_offers,
+                                      search_flexible_dates, select_flight_offers)
+from .services.metrics_services import read_snapshots, render_prometheus, timed
+from .services.traffic_services import record_trip
+from .services.planner_services import (REJECTIONS, UNAVAILABLE, acapture_rejections, arun_sections, batch_executor,
+                                        capture_errors, capture_rejections, iter_sections, run_sections,
+                                        set_aside_rejections)
 from datetime import datetime
+import hashlib
+import re
+
+
+# the destination is given separately, see resolve_destination
+REQUIRED_FIELDS = ["originLocationCode", "departureDate", "checkInDate", "checkOutDate"]
+
+# what `fields=` can ask for; sections left out are not fetched at all
+PLAN_SECTIONS = ("flights", "hotels", "weather", "landmarks", "travel_tips")
+
+
+def has_destination(params):
+    return ("destinationLocationCode" in params or "destinationCity" in params or
+            ("destinationLat" in params and "destinationLon" in params))
+
+
+def resolve_destination(params):
+    """IATA code of the destination, given as a code, as coordinates or as a city name."""
+    if "destinationLocationCode" in params:
+        return params["destinationLocationCode"]
+    if "destinationLat" in params and "destinationLon" in params:
+        try:
+            lat, lon = float(params["destinationLat"]), float(params["destinationLon"])
+        except ValueError:
+            return None
+        airports = rank_destinations(get_airport_spatial_index().nearest(
+            lat, lon, settings.TRAVEL_PLANNER.get('DESTINATION_RADIUS_KM', 150), limit=10))
+    else:
+        airports = get_airport_prefix_index().search(params["destinationCity"], 1)
+    return airports[0]["iata"] if airports else None
+
+
+class InvalidTrip(Exception):
+    """A trip that cannot be planned from the parameters given; reported as a 400."""
+
+
+def requested_sections(params):
+    """Sections named by `fields`, a comma-separated string (or a list in a batch); all by default."""
+    fields = params.get("fields")
+    if not fields:
+        return set(PLAN_SECTIONS)
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    # empty names, as in "weather," or ",", are ignored
+    sections = {str(field).strip() for field in fields if str(field).strip()}
+    unknown = sections - set(PLAN_SECTIONS)
+    if unknown:
+        raise InvalidTrip(f"Unknown fields: {', '.join(sorted(unknown))}")
+    if not sections:
+        raise InvalidTrip(f"fields must name at least one of: {', '.join(PLAN_SECTIONS)}")
+    return sections
+
+
+DEPARTURE_TIME = re.compile(r"([01]\d|2[0-3]):[0-5]\d")
+
+
+def parse_flight_query(params):
+    """Sorting, filtering and paging options for the flights section; None when none is given."""
+    options = ("sort", "maxStops", "airlines", "departureAfter", "departureBefore", "pageSize", "cursor")
+    if not any(option in params for option in options):
+        return None
+
+    sort = params.get("sort") or None
+    if sort is not None and sort not in SORT_KEYS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+    for option in ("departureAfter", "departureBefore"):
+        if option in params and not DEPARTURE_TIME.fullmatch(str(params[option])):
+            raise ValueError(f"{option} must be a time as HH:MM")
+    airlines = params.get("airlines")
+    if isinstance(airlines, str):
+        airlines = airlines.split(",")
+    page_size = int(params["pageSize"]) if "pageSize" in params else None
+    max_page_size = settings.TRAVEL_PLANNER.get('FLIGHT_OFFERS_POOL', 50)
+    return {
+        "sort": sort,
+        "max_stops": int(params["maxStops"]) if "maxStops" in params else None,
+        "airlines": frozenset(str(code).strip().upper() for code in airlines if str(code).strip())
+        if airlines else None,
+        "departure_after": params.get("departureAfter"),
+        "departure_before": params.get("departureBefore"),
+        "page_size": max(1, min(page_size, max_page_size)) if page_size is not None else None,
+        "offset": decode_cursor(str(params["cursor"])) if params.get("cursor") else 0,
+    }
+
+
+def parse_trip(params):
+    if any(f not in params for f in REQUIRED_FIELDS) or not has_destination(params):
+        raise InvalidTrip("Missing required parameters")
+
+    checkin_date = params["checkInDate"]
+    checkout_date = params["checkOutDate"]
+    trip_days = (datetime.strptime(checkout_date, "%Y-%m-%d") -
+                 datetime.strptime(checkin_date, "%Y-%m-%d")).days + 1
+
+    destination = resolve_destination(params)
+    dest_airport = get_airport_info(destination) if destination else None
+    if not dest_airport:
+        raise InvalidTrip("Invalid destination airport")
+
+    try:
+        flight_query = parse_flight_query(params)
+    except ValueError as e:
+        raise InvalidTrip(str(e))
+
+    try:
+        flexible_days = int(params.get("flexibleDays", 0))
+    except ValueError:
+        raise InvalidTrip("flexibleDays must be a whole number of days")
+    max_flexible_days = settings.TRAVEL_PLANNER.get('FLEXIBLE_MAX_DAYS', 3)
+    flexible_days = max(0, min(flexible_days, max_flexible_days))
+
+    return {
+        "params": params,
+        "sections": requested_sections(params),
+        "flexible_days": flexible_days,
+        "flight_query": flight_query,
+        "origin": params["originLocationCode"],
+        "destination": destination,
+        "dest_airport": dest_airport,
+        "checkin_date": checkin_date,
+        "checkout_date": checkout_date,
+        "trip_days": trip_days,
+    }
+
+
+def record_planned_trip(trip):
+    """Count a trip toward the destinations and routes warm_caches prefetches, once it has passed validation."""
+    record_trip(trip["origin"], trip["destination"], trip["params"]["departureDate"], trip["trip_days"])
+
+
+def flight_search_args(trip):
+    params = trip["params"]
+    max_results = int(params.get("max", 5))
+    if trip["flight_query"] is not None:
+        # sorting, filtering and paging work on one larger search, cached and shared by every page
+        max_results = max(max_results, settings.TRAVEL_PLANNER.get('FLIGHT_OFFERS_POOL', 50))
+    return (
+        trip["origin"], trip["destination"],
+        params["departureDate"],
+        int(params.get("adults", 1)),
+        params.get("currencyCode", "EUR"),
+        max_results,
+        params.get("travelClass", "BUSINESS")
+    )
+
+
+def present_flights(trip, offers):
+    """The flights section of a plan; sorted, filtered and paged when the trip asks for it."""
+    query = trip["flight_query"]
+    if query is None:
+        return {"flights": process_flight_offers(offers)}
+
+    selected = select_flight_offers(
+        offers, query["sort"], query["max_stops"], query["airlines"],
+        query["departure_after"], query["departure_before"])
+    page_size = query["page_size"] or int(trip["params"].get("max", 5))
+    page, next_cursor = page_flight_offers(selected, query["offset"], page_size)
+    return {
+        "flights": process_flight_offers(page),
+        "flights_page": {"total": len(selected), "next_cursor": next_cursor},
+    }
+
+
+def flexible_flights(trip, date_grid):
+    # sorting and filtering apply to the offers of the cheapest date
+    return {
+        **present_flights(trip, date_grid["offers"]),
+        "flexible_dates": {"cheapest_date": date_grid["cheapest_date"], "prices": date_grid["prices"]},
+    }
+
+
+def planner_tasks(trip):
+    dest_airport = trip["dest_airport"]
+    if trip["flexible_days"]:
+        def flights():
+            return flexible_flights(trip, search_flexible_dates(*flight_search_args(trip), trip["flexible_days"]))
+    else:
+        def flights():
+            return present_flights(trip, get_flight_offers(*flight_search_args(trip)))
+    tasks = {
+        "flights": flights,
+        "weather": lambda: get_weather_forecast(
+            dest_airport['lat'], dest_airport['lon'],
+            checkin_date=trip["checkin_date"], checkout_date=trip["checkout_date"]),
+        # landmarks and travel tips come from the same model call, made once for both sections
+        "landmarks": lambda: get_landmarks(dest_airport['city'], dest_airport["country"], trip["trip_days"]),
+        "travel_tips": lambda: generate_travel_tips(
+            dest_airport['city'],
+            dest_airport['country'],
+            trip["trip_days"]
+        ),
+    }
+    return {section: task for section, task in tasks.items() if section in trip["sections"]}
+
+
+def async_planner_tasks(trip):
+    """Async counterpart of planner_tasks; maps each requested section to a coroutine."""
+    dest_airport = trip["dest_airport"]
+
+    async def flights():
+        if trip["flexible_days"]:
+            return flexible_flights(
+                trip, await asearch_flexible_dates(*flight_search_args(trip), trip["flexible_days"]))
+        return present_flights(trip, await aget_flight_offers(*flight_search_args(trip)))
+
+    tasks = {
+        "flights": flights,
+        "weather": lambda: aget_weather_forecast(
+            dest_airport['lat'], dest_airport['lon'],
+            checkin_date=trip["checkin_date"], checkout_date=trip["checkout_date"]),
+        "landmarks": lambda: aget_landmarks(dest_airport['city'], dest_airport["country"], trip["trip_days"]),
+        "travel_tips": lambda: agenerate_travel_tips(
+            dest_airport['city'],
+            dest_airport['country'],
+            trip["trip_days"]
+        ),
+    }
+    # coroutines are only created for requested sections, so none is left un-awaited
+    return {section: task() for section, task in tasks.items() if section in trip["sections"]}
+
+
+def hotels_url(trip):
+    params = trip["params"]
+    return create_booking_url(
+        trip["destination"],
+        trip["checkin_date"],
+        trip["checkout_date"],
+        int(params.get("adults", 1)),
+        int(params.get("children", 0))
+    )
+
+
+def build_plan(trip, results, unavailable, stale=()):
+    sections = trip["sections"]
+    dest_airport = trip["dest_airport"]
+    plan = {}
+    if "flights" in sections:
+        plan["flights"] = None
+        if trip["flexible_days"]:
+            plan["flexible_dates"] = None
+        # flights, plus flights_page and flexible_dates when asked for
+        plan.update(results.get("flights") or {})
+    if "hotels" in sections:
+        plan["hotels"] = hotels_url(trip)
+
+    destination_info = {"city": dest_airport['city'], "country": dest_airport['country']}
+    for section in ("weather", "landmarks", "travel_tips"):
+        if section in sections:
+            destination_info[section] = results.get(section)
+    plan["destination_info"] = destination_info
+    plan["trip_duration"] = f"{trip['trip_days']} days"
+    # sections that did not answer before their deadline, or that their provider's quota or breaker turned away
+    plan["unavailable_sections"] = unavailable
+    # sections served from the last known good copy while their provider is down
+    plan["stale_sections"] = list(stale)
+    return plan
+
+
+def plan_response(request, data):
+    """Compact JSON unless `pretty=1`; clients revalidate it through its ETag (ConditionalGetMiddleware)."""
+    if request.GET.get("pretty") in ("1", "true"):
+        dumps_params = {'indent': 2}
+    else:
+        dumps_params = {'separators': (',', ':')}
+    with timed("serialize"):
+        response = JsonResponse(data, safe=False, json_dumps_params=dumps_params)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def retry_later_response(error):
+    """503 for QuotaExceeded and CircuitOpen, telling the client when to try again."""
+    response = JsonResponse({"error": str(error)}, status=503)
+    response["Retry-After"] = str(error.retry_after)
+    return response
+
+
+def planned_response(request, trip, results, unavailable, stale):
+    """The plan of the sections served, or a 503 when every one was turned away by its provider's quota or breaker."""
+    rejections = set_aside_rejections(results, unavailable)
+    if rejections and not results:
+        return retry_later_response(max(rejections, key=lambda error: error.retry_after))
+    return plan_response(request, build_plan(trip, results, unavailable, stale))
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def travel_planner(request):
     try:
-        params = request.query_params
-        required_fields = ["originLocationCode", "destinationLocationCode",
-                           "departureDate", "checkInDate", "checkOutDate"]
-        if any(f not in params for f in required_fields):
-            return JsonResponse({"error": "Missing required parameters"}, status=400)
-
-        origin = params["originLocationCode"]
-        destination = params["destinationLocationCode"]
-        checkin_date = params["checkInDate"]
-        checkout_date = params["checkOutDate"]
-        trip_days = (datetime.strptime(checkout_date, "%Y-%m-%d") -
-                     datetime.strptime(checkin_date, "%Y-%m-%d")).days + 1
-
-        dest_airport = get_airport_info(destination)
-        if not dest_airport:
-            return JsonResponse({"error": "Invalid destination airport"}, status=400)
-
-        flight_data = get_flight_offers(
-            origin, destination,
-            params["departureDate"],
-            int(params.get("adults", 1)),
-            params.get("currencyCode", "EUR"),
-            int(params.get("max", 5)),
-            params.get("travelClass", "BUSINESS")
-        )
-
-        response_data = {
-            "flights": process_flight_offers(flight_data),
-            "hotels": create_booking_url(
-                destination,
-                checkin_date,
-                checkout_date,
-                int(params.get("adults", 1)),
-                int(params.get("children", 0))
-            ),
-            "destination_info": {
-                "city": dest_airport['city'],
-                "country": dest_airport['country'],
-                "weather": get_weather_forecast(dest_airport['lat'], dest_airport['lon'], checkin_date=checkin_date, checkout_date=checkout_date),
-                "landmarks": get_landmarks(dest_airport['city'], dest_airport["country"]),
-                "travel_tips": generate_travel_tips(
-                    dest_airport['city'],
-                    dest_airport['country'],
-                    trip_days
-                ),
-            },
-            "trip_duration": f"{trip_days} days"
-        }
-
-        return JsonResponse(response_data, safe=False, json_dumps_params={'indent': 2})
-
-    except ResponseError as e:
+        trip = parse_trip(request.query_params)
+        record_planned_trip(trip)
+        tasks = {section: capture_rejections(task) for section, task in planner_tasks(trip).items()}
+        results, unavailable, stale = run_sections(tasks)
+        return planned_response(request, trip, results, unavailable, stale)
+
+    except (InvalidTrip, ResponseError) as e:
         return JsonResponse({"error": str(e)}, status=400)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
+
+
+def plan_events(trip, renderer):
+    """Encoded planner events: the trip and hotels first, then each section as it completes."""
+    dest_airport = trip["dest_airport"]
+    yield renderer.event("trip", {
+        "city": dest_airport['city'],
+        "country": dest_airport['country'],
+        "trip_duration": f"{trip['trip_days']} days",
+    })
+    if "hotels" in trip["sections"]:
+        yield renderer.event("hotels", hotels_url(trip))
+
+    tasks = {section: capture_errors(task) for section, task in planner_tasks(trip).items()}
+    unavailable, stale = [], []
+    for section, result, is_stale in iter_sections(tasks):
+        if result is UNAVAILABLE or isinstance(result, REJECTIONS):
+            unavailable.append(section)
+            continue
+        if isinstance(result, Exception):
+            yield renderer.event("error", {"section": section, "error": str(result)})
+            continue
+        if is_stale:
+            stale.append(section)
+        if section == "flights":
+            for name, value in result.items():
+                yield renderer.event(name, value)
+        else:
+            yield renderer.event(section, result)
+    yield renderer.event("done", {"unavailable_sections": unavailable, "stale_sections": stale})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@renderer_classes([EventStreamRenderer, NDJSONRenderer])
+def travel_planner_stream(request):
+    """travel_planner as a stream of events, as server-sent events or NDJSON depending on Accept."""
+    try:
+        trip = parse_trip(request.query_params)
+        record_planned_trip(trip)
+    except InvalidTrip as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+    renderer = request.accepted_renderer
+    response = StreamingHttpResponse(plan_events(trip, renderer), content_type=renderer.media_type)
+    response["Cache-Control"] = "no-cache"
+    # stop nginx from buffering the events
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def batch_task_keys(trip):
+    """Identity of each upstream call of a trip; trips sharing a key share the call."""
+    dest_airport = trip["dest_airport"]
+    city, country = dest_airport['city'], dest_airport['country']
+    keys = {
+        "flights": lambda: ("flights", *flight_search_args(trip), trip["flexible_days"],
+                            tuple(sorted((trip["flight_query"] or {}).items()))),
+        "weather": lambda: ("weather", weather_cell_key(
+            dest_airport['lat'], dest_airport['lon'], trip["checkin_date"], trip["checkout_date"])),
+        "landmarks": lambda: ("landmarks", city_guide_key(city, country, trip["trip_days"])),
+        "travel_tips": lambda: ("travel_tips", city_guide_key(city, country, trip["trip_days"])),
+    }
+    return {section: key() for section, key in keys.items() if section in trip["sections"]}
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def travel_planner_batch(request):
+    trip_specs = request.data.get("trips") if isinstance(request.data, dict) else None
+    if not isinstance(trip_specs, list) or not trip_specs:
+        return JsonResponse({"error": "Missing required parameters"}, status=400)
+    max_trips = settings.TRAVEL_PLANNER.get('BATCH_MAX_TRIPS', 20)
+    if len(trip_specs) > max_trips:
+        return JsonResponse({"error": f"A batch can plan at most {max_trips} trips"}, status=400)
+
+    try:
+        trips, trip_keys, unique_tasks = [], [], {}
+        for spec in trip_specs:
+            try:
+                if not isinstance(spec, dict):
+                    raise InvalidTrip("Invalid trip")
+                trip = parse_trip(spec)
+                keys = batch_task_keys(trip)
+            except Exception as e:
+                trips.append({"error": str(e)})
+                trip_keys.append(None)
+                continue
+            record_planned_trip(trip)
+            for section, task in planner_tasks(trip).items():
+                unique_tasks.setdefault(keys[section], capture_errors(task))
+            trips.append(trip)
+            trip_keys.append(keys)
+
+        batch_timeout = settings.TRAVEL_PLANNER.get('BATCH_TIMEOUT', 30)
+        results, unavailable, stale = run_sections(
+            unique_tasks, executor=batch_executor, timeout_for=lambda key: batch_timeout)
+
+        plans = []
+        for trip, keys in zip(trips, trip_keys):
+            if keys is None:
+                plans.append(trip)
+                continue
+            trip_results = {section: results[key] for section, key in keys.items() if key in results}
+            trip_unavailable = [section for section, key in keys.items() if key in unavailable]
+            rejections = set_aside_rejections(trip_results, trip_unavailable)
+            error = next((value for value in trip_results.values() if isinstance(value, Exception)), None)
+            if error is None and rejections and not trip_results:
+                error = max(rejections, key=lambda rejection: rejection.retry_after)
+            if error is not None:
+                plans.append({"error": str(error)})
+                continue
+            trip_stale = [section for section, key in keys.items() if key in stale]
+            plans.append(build_plan(trip, trip_results, trip_unavailable, trip_stale))
+
+        return plan_response(request, {"plans": plans})
+
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+def authenticate_request(request):
+    """Run the configured DRF authenticators against a plain Django request."""
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        result = authentication_class().authenticate(request)
+        if result is not None:
+            return result[0]
+    return None
+
+
+async def travel_planner_async(request):
+    """Native async variant of travel_planner, meant to be served through ASGI."""
+    try:
+        user = await sync_to_async(authenticate_request)(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({"detail": str(e.detail)}, status=401)
+    if user is None or not user.is_authenticated:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+
+    try:
+        trip = parse_trip(request.GET)
+        record_planned_trip(trip)
+        tasks = {section: acapture_rejections(task) for section, task in async_planner_tasks(trip).items()}
+        results, unavailable, stale = await arun_sections(tasks)
+        return planned_response(request, trip, results, unavailable, stale)
+
+    except (InvalidTrip, httpx.HTTPStatusError) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+AUTOCOMPLETE_DEFAULT_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+
+
+def autocomplete_limit(params):
+    try:
+        limit = int(params.get("limit", AUTOCOMPLETE_DEFAULT_LIMIT))
+    except ValueError:
+        limit = AUTOCOMPLETE_DEFAULT_LIMIT
+    return max(1, min(limit, AUTOCOMPLETE_MAX_LIMIT))
+
+
+def autocomplete_etag(request):
+    # results only change with the query, the limit and the airport data release
+    query = normalize_search_text(request.GET.get("q", ""))
+    key = f"{get_airport_store().version}:{query}:{autocomplete_limit(request.GET)}"
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@etag(autocomplete_etag)
+def airport_autocomplete(request):
+    query = request.query_params.get("q", "")
+    if not query.strip():
+        return JsonResponse({"error": "Missing required parameters"}, status=400)
+
+    airports = get_airport_prefix_index().search(query, autocomplete_limit(request.query_params))
+    response = JsonResponse({"query": query, "results": airports})
+    patch_cache_control(response, private=True, max_age=60 * 60 * 24)
+    return response
+
+
+NEAREST_DEFAULT_LIMIT = 5
+NEAREST_MAX_LIMIT = 50
+NEAREST_MAX_RADIUS_KM = 2000
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def nearest_airports(request):
+    params = request.query_params
+    if "lat" not in params or "lon" not in params:
+        return JsonResponse({"error": "Missing required parameters"}, status=400)
+
+    try:
+        lat, lon = float(params["lat"]), float(params["lon"])
+        radius_km = min(float(params.get("radius", 100)), NEAREST_MAX_RADIUS_KM)
+        limit = max(1, min(int(params.get("limit", NEAREST_DEFAULT_LIMIT)), NEAREST_MAX_LIMIT))
+    except ValueError:
+        return JsonResponse({"error": "Invalid parameters"}, status=400)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return JsonResponse({"error": "Invalid coordinates"}, status=400)
+    if not radius_km > 0:
+        return JsonResponse({"error": "radius must be a positive number of kilometres"}, status=400)
+
+    airports = get_airport_spatial_index().nearest(lat, lon, radius_km, limit)
+    return JsonResponse({"results": airports})
+
+
+def metrics_authorized(request):
+    token = settings.METRICS.get('TOKEN')
+    if not token:
+        return False
+    allowed = settings.METRICS.get('ALLOWED_IPS')
+    if allowed is not None and request.META.get("REMOTE_ADDR") not in allowed:
+        return False
+    return hmac.compare_digest(request.META.get("HTTP_AUTHORIZATION", "").encode(), f"Bearer {token}".encode())
+
+
+def metrics(request):
+    """Prometheus scrape endpoint, merging the snapshots of every worker process."""
+    if not metrics_authorized(request):
+        return HttpResponse(status=403)
+    return HttpResponse(render_prometheus(read_snapshots()), content_type="text/plain; version=0.0.4; charset=utf-8")
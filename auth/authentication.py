@@ -1,8 +1,73 @@
+import threading
+from cachetools import TTLCache
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
 from django.conf import settings
 
+# the fields permission checks read of users loaded from the database, by user id; per process,
+# so a deactivated user can keep authenticating on a worker until the entry expires
+CACHED_USER_FIELDS = ("is_active", "is_staff")
+_user_cache = TTLCache(maxsize=settings.SIMPLE_JWT.get('USER_CACHE_SIZE', 1024),
+                       ttl=settings.SIMPLE_JWT.get('USER_CACHE_TTL', 60))
+_user_cache_lock = threading.Lock()
 
-class JWTCookieAuthentication(JWTAuthentication):
+
+class TokenClaimsUser(TokenUser):
+    """request.user built from the claims embedded in the token at login, without a database query."""
+
+    @cached_property
+    def id(self):
+        # tokens carry the id as a string; give it back the type of the model field
+        field = get_user_model()._meta.get_field(api_settings.USER_ID_FIELD)
+        return field.to_python(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def email(self):
+        return self.token.get("email", "")
+
+
+def cached_user(user_id, load):
+    """A new user instance on every call; other fields than CACHED_USER_FIELDS are read from the database on access."""
+    with _user_cache_lock:
+        cached = _user_cache.get(user_id)
+    if cached is None:
+        user = load()
+        # from_db takes the values in model field order
+        field_names = tuple(field.attname for field in user._meta.concrete_fields
+                            if field.primary_key or field.attname in CACHED_USER_FIELDS)
+        with _user_cache_lock:
+            _user_cache[user_id] = (user._state.db, field_names, tuple(getattr(user, name) for name in field_names))
+        return user
+    return get_user_model().from_db(*cached)
+
+
+def full_user(request):
+    """The User model behind request.user, for endpoints that need more than the token claims."""
+    user = request.user
+    if not isinstance(user, TokenUser):
+        return user
+    return cached_user(user.id, lambda: get_user_model().objects.get(**{api_settings.USER_ID_FIELD: user.id}))
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that skips the per-request user query.
+
+    With SIMPLE_JWT["TOKEN_CLAIMS_USER"] on, tokens carrying the claims added at
+    login authenticate as a TokenClaimsUser; other tokens load the user through
+    the per-process cache.
+    """
+
+    def get_user(self, validated_token):
+        if settings.SIMPLE_JWT.get('TOKEN_CLAIMS_USER', False) and "username" in validated_token:
+            return TokenClaimsUser(validated_token)
+        return cached_user(validated_token.get(api_settings.USER_ID_CLAIM),
+                           lambda: super(ClaimsJWTAuthentication, self).get_user(validated_token))
+
+
+class JWTCookieAuthentication(ClaimsJWTAuthentication):
     def authenticate(self, request):
         # Define paths that should bypass authentication
         auth_exempt_paths = [
@@ -13,11 +78,11 @@ class JWTCookieAuthentication(JWTAuthentication):
 
         if any(request.path.endswith(path) for path in auth_exempt_paths):
             return None
-            
+
         raw_token = request.COOKIES.get(
             settings.SIMPLE_JWT.get('AUTH_COOKIE_ACCESS', 'access_token')) or None
         if raw_token is None:
             return None
-            
+
         validated_token = self.get_validated_token(raw_token)
         return self.get_user(validated_token), validated_token
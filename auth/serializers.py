@@ -1,5 +1,8 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+
+from .tokens import FilteredRefreshToken
 
 User = get_user_model()
 
@@ -13,3 +16,19 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         return User.objects.create_user(**validated_data)
+
+
+def add_user_claims(token, user):
+    """Embed what request.user needs in the token, see auth.authentication.TokenClaimsUser."""
+    token["username"] = user.get_username()
+    token["email"] = user.email
+    token["is_staff"] = user.is_staff
+    return token
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = FilteredRefreshToken
+
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super().get_token(user), user)
@@ -1,3 +1,148 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from . import authentication, tokens
+from .authentication import ClaimsJWTAuthentication, TokenClaimsUser
+from .serializers import ClaimsTokenObtainPairSerializer
+from .tokens import BloomFilter, FilteredRefreshToken, RevocationFilter
+
+
+class BloomFilterTests(SimpleTestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.001)
+        for i in range(1000):
+            bloom.add(f"jti-{i}")
+        self.assertTrue(all(f"jti-{i}" in bloom for i in range(1000)))
+        self.assertEqual(bloom.count, 1000)
+
+    def test_false_positive_rate_stays_near_error_rate(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f"jti-{i}")
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives / 10000, 0.03)
+
+    def test_empty_filter_contains_nothing(self):
+        self.assertNotIn("jti", BloomFilter(10, 0.001))
+
+
+class RevocationFilterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("traveller", password="secret")
+
+    def revoke(self, **fields):
+        """Blacklist a new refresh token the way another worker would, without telling this filter."""
+        token = FilteredRefreshToken.for_user(self.user)
+        outstanding = OutstandingToken.objects.get(jti=token["jti"])
+        return token, BlacklistedToken.objects.create(token=outstanding, **fields)
+
+    def test_sees_tokens_revoked_elsewhere_on_refresh(self):
+        revocations = RevocationFilter(refresh_interval=0, rebuild_interval=3600, error_rate=0.001)
+        self.assertFalse(revocations.might_be_revoked("unknown"))
+        token, _ = self.revoke()
+        self.assertTrue(revocations.might_be_revoked(token["jti"]))
+
+    def test_sees_a_row_that_committed_after_later_rows(self):
+        revocations = RevocationFilter(refresh_interval=0, rebuild_interval=3600, error_rate=0.001, margin=60)
+        self.revoke(id=1000)
+        revocations.might_be_revoked("unknown")
+        # a lower id stamped before the last read but only visible now, like a slow transaction elsewhere
+        token, row = self.revoke(id=10)
+        BlacklistedToken.objects.filter(id=row.id).update(blacklisted_at=aware_utcnow() - timedelta(seconds=30))
+        self.assertTrue(revocations.might_be_revoked(token["jti"]))
+
+    def test_refresh_reads_only_above_the_settled_rows(self):
+        revocations = RevocationFilter(refresh_interval=0, rebuild_interval=3600, error_rate=0.001, margin=60)
+        _, row = self.revoke(id=50)
+        BlacklistedToken.objects.filter(id=row.id).update(blacklisted_at=aware_utcnow() - timedelta(hours=2))
+        revocations.might_be_revoked("unknown")
+        # older than the margin and below the highest settled id: left to the next rebuild
+        token, row = self.revoke(id=10)
+        BlacklistedToken.objects.filter(id=row.id).update(blacklisted_at=aware_utcnow() - timedelta(hours=2))
+        self.assertFalse(revocations.might_be_revoked(token["jti"]))
+        token, _ = self.revoke(id=60)
+        self.assertTrue(revocations.might_be_revoked(token["jti"]))
+
+    def test_refresh_waits_for_the_interval(self):
+        revocations = RevocationFilter(refresh_interval=3600, rebuild_interval=3600, error_rate=0.001)
+        revocations.might_be_revoked("unknown")
+        token, _ = self.revoke()
+        self.assertFalse(revocations.might_be_revoked(token["jti"]))
+
+    def test_overlapping_reads_do_not_inflate_the_count(self):
+        revocations = RevocationFilter(refresh_interval=0, rebuild_interval=3600, error_rate=0.001)
+        self.revoke()
+        for _ in range(3):
+            revocations.might_be_revoked("unknown")
+        self.assertEqual(revocations.stats()["tokens"], 1)
+
+
+class FilteredRefreshTokenTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("traveller", password="secret")
+        self.revocations = RevocationFilter(refresh_interval=0, rebuild_interval=3600, error_rate=0.001)
+        patcher = mock.patch.object(tokens, "get_revocation_filter", return_value=self.revocations)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_blacklisted_token_is_rejected(self):
+        token = FilteredRefreshToken.for_user(self.user)
+        token.blacklist()
+        with self.assertRaises(TokenError):
+            FilteredRefreshToken(str(token))
+
+    def test_valid_token_skips_the_blacklist_table(self):
+        token = FilteredRefreshToken.for_user(self.user)
+        FilteredRefreshToken(str(token))
+        self.assertEqual(self.revocations.stats()["table_lookups"], 0)
+
+    def test_flushexpiredtokens_removes_expired_blacklist_entries(self):
+        token = FilteredRefreshToken.for_user(self.user)
+        token.blacklist()
+        FilteredRefreshToken.for_user(self.user)
+        OutstandingToken.objects.filter(jti=token["jti"]).update(expires_at=aware_utcnow() - timedelta(days=1))
+        call_command("flushexpiredtokens")
+        self.assertFalse(BlacklistedToken.objects.exists())
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+
+
+class ClaimsJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("traveller", email="t@example.com", password="secret")
+        self.token = ClaimsTokenObtainPairSerializer.get_token(self.user).access_token
+        authentication._user_cache.clear()
+        self.addCleanup(authentication._user_cache.clear)
+
+    def test_loads_the_database_user_by_default(self):
+        user = ClaimsJWTAuthentication().get_user(self.token)
+        self.assertIsInstance(user, User)
+        self.user.is_active = False
+        self.user.save()
+        authentication._user_cache.clear()
+        with self.assertRaises(AuthenticationFailed):
+            ClaimsJWTAuthentication().get_user(self.token)
+
+    def test_cached_users_are_not_shared_between_requests(self):
+        first = ClaimsJWTAuthentication().get_user(self.token)
+        first.first_name = "changed by another request"
+        with self.assertNumQueries(0):
+            second = ClaimsJWTAuthentication().get_user(self.token)
+            self.assertEqual((second.pk, second.is_active, second.is_staff), (self.user.pk, True, False))
+        self.assertIsNot(second, first)
+        self.assertEqual((second.username, second.first_name), ("traveller", ""))
+
+    def test_claims_user_when_enabled(self):
+        with override_settings(SIMPLE_JWT={**settings.SIMPLE_JWT, "TOKEN_CLAIMS_USER": True}):
+            with self.assertNumQueries(0):
+                user = ClaimsJWTAuthentication().get_user(self.token)
+        self.assertIsInstance(user, TokenClaimsUser)
+        self.assertEqual((user.id, user.username, user.email), (self.user.id, "traveller", "t@example.com"))
@@ -0,0 +1,153 @@
+import hashlib
+import threading
+import time
+from datetime import timedelta
+from math import ceil, log
+from django.conf import settings
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+_revocation_filter = None
+_revocation_filter_lock = threading.Lock()
+
+
+class BloomFilter:
+    """Set membership with no false negatives and about `error_rate` false positives up to `capacity` items."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(64, ceil(-capacity * log(error_rate) / log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationFilter:
+    """Bloom filter of blacklisted token ids, so that most refreshes skip the blacklist table.
+
+    New blacklist rows are read incrementally at most every `refresh_interval`
+    seconds, so a token revoked by another worker is seen there within that
+    time. Each refresh reads the rows above an id floor, the highest id read
+    that was blacklisted more than `margin` seconds before the previous read:
+    ids are assigned before commit, so a row can become visible after rows
+    with higher ids, and reading the last `margin` seconds again catches it
+    as long as its transaction took less than that to commit. Filtering on the
+    primary key keeps each refresh an index range scan however long the
+    blacklist grows. The filter is rebuilt every `rebuild_interval` seconds,
+    which drops pruned tokens and resizes it.
+    """
+
+    def __init__(self, refresh_interval, rebuild_interval, error_rate, margin=60):
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.error_rate = error_rate
+        self.margin = timedelta(seconds=margin)
+
+        self._lock = threading.Lock()
+        self._filter = None
+        self._floor = 0
+        self._built_at = 0
+        self._refreshed_at = 0
+        self.checks = 0
+        self.table_lookups = 0
+
+    def _load(self, rows, started):
+        """Add the tokens of blacklist `rows` read at `started`, and raise the floor past those settled by then."""
+        settled = started - self.margin
+        for row_id, jti, blacklisted_at in rows:
+            # rows above the floor are read again; re-adding them would only inflate the count
+            if jti not in self._filter:
+                self._filter.add(jti)
+            if blacklisted_at < settled:
+                self._floor = max(self._floor, row_id)
+
+    @staticmethod
+    def _rows(queryset):
+        return queryset.values_list("id", "token__jti", "blacklisted_at")
+
+    def _rebuild(self, now):
+        started = aware_utcnow()
+        count = BlacklistedToken.objects.count()
+        self._filter = BloomFilter(max(1024, count * 2), self.error_rate)
+        self._floor = 0
+        self._load(self._rows(BlacklistedToken.objects.all()).iterator(), started)
+        self._built_at = self._refreshed_at = now
+
+    def _refresh(self, now):
+        started = aware_utcnow()
+        self._load(self._rows(BlacklistedToken.objects.filter(id__gt=self._floor)), started)
+        self._refreshed_at = now
+
+    def _current(self):
+        now = time.monotonic()
+        with self._lock:
+            if (self._filter is None or now - self._built_at >= self.rebuild_interval
+                    or self._filter.count > self._filter.capacity):
+                self._rebuild(now)
+            elif now - self._refreshed_at >= self.refresh_interval:
+                self._refresh(now)
+            return self._filter
+
+    def might_be_revoked(self, jti):
+        revoked = jti in self._current()
+        with self._lock:
+            self.checks += 1
+            self.table_lookups += revoked
+        return revoked
+
+    def add(self, jti):
+        """Record a token blacklisted by this process right away."""
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "checks": self.checks,
+                "table_lookups": self.table_lookups,
+                "size_bytes": len(self._filter.bits) if self._filter is not None else 0,
+                "tokens": self._filter.count if self._filter is not None else 0,
+            }
+
+
+def get_revocation_filter():
+    global _revocation_filter
+    if _revocation_filter is None:
+        with _revocation_filter_lock:
+            if _revocation_filter is None:
+                _revocation_filter = RevocationFilter(
+                    refresh_interval=settings.SIMPLE_JWT.get('REVOCATION_REFRESH_INTERVAL', 5),
+                    rebuild_interval=settings.SIMPLE_JWT.get('REVOCATION_REBUILD_INTERVAL', 60 * 60),
+                    error_rate=settings.SIMPLE_JWT.get('REVOCATION_ERROR_RATE', 0.001),
+                    margin=settings.SIMPLE_JWT.get('REVOCATION_REFRESH_MARGIN', 60),
+                )
+    return _revocation_filter
+
+
+class FilteredRefreshToken(RefreshToken):
+    """RefreshToken that only queries the blacklist table when the revocation filter says it might be there."""
+
+    def check_blacklist(self):
+        if get_revocation_filter().might_be_revoked(self.payload[api_settings.JTI_CLAIM]):
+            super().check_blacklist()
+
+    def blacklist(self):
+        blacklisted = super().blacklist()
+        get_revocation_filter().add(self.payload[api_settings.JTI_CLAIM])
+        return blacklisted
@@ -1,14 +1,15 @@
-from tokenize import TokenError
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import AllowAny
 from rest_framework_simplejwt.views import TokenObtainPairView
-from .serializers import UserRegistrationSerializer
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .serializers import ClaimsTokenObtainPairSerializer, UserRegistrationSerializer, add_user_claims
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError
+from .tokens import FilteredRefreshToken
+from rest_framework_simplejwt.settings import api_settings
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 
 
@@ -39,7 +40,7 @@ def register_user(request):
 def custom_login(request):
     try:
         response = Response()
-        serializer = TokenObtainPairSerializer(data=request.data)
+        serializer = ClaimsTokenObtainPairSerializer(data=request.data)
 
         if serializer.is_valid():
             # Get user data to return in response
@@ -95,7 +96,7 @@ def custom_logout(request):
             settings.SIMPLE_JWT.get('AUTH_COOKIE_REFRESH', 'refresh_token'))
         if refresh_token:
             # Blacklist the token
-            token = RefreshToken(refresh_token)
+            token = FilteredRefreshToken(refresh_token)
             token.blacklist()
 
         # Create response and delete cookies
@@ -118,8 +119,15 @@ def refresh_token(request):
         return Response({'detail': 'Refresh token not found'}, status=status.HTTP_401_UNAUTHORIZED)
 
     try:
-        refresh = RefreshToken(refresh_token)
-        access_token = str(refresh.access_token)
+        refresh = FilteredRefreshToken(refresh_token)
+        access = refresh.access_token
+        if settings.SIMPLE_JWT.get('TOKEN_CLAIMS_USER', False) and "username" not in access:
+            # refresh token issued before the claims were embedded at login
+            user = get_user_model().objects.filter(
+                **{api_settings.USER_ID_FIELD: refresh[api_settings.USER_ID_CLAIM]}).first()
+            if user is not None:
+                add_user_claims(access, user)
+        access_token = str(access)
 
         response = Response({'detail': 'Token refreshed successfully'})
         response.set_cookie(
@@ -0,0 +1,70 @@
+"""Compare two benchmark result files, e.g. the base branch against a change.
+
+Prints the change of throughput and latency percentiles per scenario and
+concurrency level, and exits with status 1 when any of them got worse by
+more than --threshold percent.
+
+    python -m benchmarks.compare benchmarks/results/base.json benchmarks/results/change.json
+"""
+import argparse
+import json
+import sys
+
+# (metric, whether a higher value is better)
+METRICS = (("throughput_rps", True), ("p50", False), ("p95", False), ("p99", False), ("rss_peak_mb", False))
+
+
+def metrics(result):
+    latency = result.get("latency_ms") or {}
+    return {
+        "throughput_rps": result.get("throughput_rps"),
+        "p50": latency.get("p50"),
+        "p95": latency.get("p95"),
+        "p99": latency.get("p99"),
+        "rss_peak_mb": (result.get("rss_mb") or {}).get("peak"),
+    }
+
+
+def compare(base, change, threshold):
+    """Rows of (scenario, concurrency, metric, base, change, percent, regressed)."""
+    base_results = {(r["scenario"], r["concurrency"]): metrics(r) for r in base["results"]}
+    rows = []
+    for result in change["results"]:
+        key = (result["scenario"], result["concurrency"])
+        if key not in base_results:
+            continue
+        before, after = base_results[key], metrics(result)
+        for metric, higher_is_better in METRICS:
+            if not before[metric] or after[metric] is None:
+                continue
+            percent = (after[metric] - before[metric]) / before[metric] * 100
+            worse = -percent if higher_is_better else percent
+            rows.append((*key, metric, before[metric], after[metric], round(percent, 1), worse > threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base")
+    parser.add_argument("change")
+    parser.add_argument("--threshold", type=float, default=10, help="Percent change reported as a regression")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.change) as f:
+        change = json.load(f)
+    if base.get("options") != change.get("options"):
+        print(f"Warning: runs used different options: {base.get('options')} vs {change.get('options')}")
+
+    rows = compare(base, change, args.threshold)
+    print(f"{(base.get('commit') or '?')[:8]} -> {(change.get('commit') or '?')[:8]}")
+    for scenario, concurrency, metric, before, after, percent, regressed in rows:
+        print(f"{scenario:<14} c={concurrency:<4} {metric:<15} {before:>10} -> {after:>10}  {percent:+7.1f}%"
+              f"{'  REGRESSION' if regressed else ''}")
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""Load benchmark of the planner and auth endpoints against local upstream stand-ins.
+
+Starts the stand-ins of benchmarks/stubs.py, a server with benchmarks.settings
+(a fresh database and cache in a temporary directory) and drives each scenario
+at every concurrency level. Latency percentiles, throughput, the server's RSS
+and the Server-Timing breakdown are written as JSON to benchmarks/results/,
+for benchmarks/compare.py to diff against another commit.
+
+The default server is `manage.py runserver`, which is enough to compare two
+commits; its single-process keep-alive handling adds tens of milliseconds per
+response, so use --server-cmd with a production server for absolute numbers.
+
+    python -m benchmarks.run --concurrency 1,8,32 --requests 400 --latency 0.08
+    python -m benchmarks.run --scenarios planner --distinct 1       # every request a cache hit
+    python -m benchmarks.run --server-cmd "gunicorn -w 4 -b {bind} travel_manager_api.wsgi"
+"""
+import argparse
+import json
+import os
+import platform
+import shlex
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+
+import requests
+
+from .stubs import FIXTURES_DIR, start_stubs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+USERNAME = "benchmark"
+PASSWORD = "benchmark-Password-1"
+
+# origin/destination pairs the planner scenarios cycle through
+ROUTES = [("MAD", "CDG"), ("LHR", "JFK"), ("FRA", "FCO"), ("AMS", "BCN"), ("CDG", "LIS"),
+          ("MUC", "ATH"), ("ZRH", "VIE"), ("DUB", "EDI"), ("CPH", "OSL"), ("BRU", "PRG")]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def trip_params(i, distinct):
+    """Query of the i-th planner request; `distinct` different trips, half of them beyond the forecast range."""
+    n = i % distinct
+    origin, destination = ROUTES[n % len(ROUTES)]
+    cycle = n // len(ROUTES)
+    departure = date.today() + timedelta(days=3 + (60 if cycle % 2 else 0) + cycle // 2 * 7)
+    return {
+        "originLocationCode": origin,
+        "destinationLocationCode": destination,
+        "departureDate": departure.isoformat(),
+        "checkInDate": departure.isoformat(),
+        "checkOutDate": (departure + timedelta(days=4)).isoformat(),
+    }
+
+
+def scenario_request(name, session, base_url, i, distinct):
+    if name == "planner":
+        return session.get(f"{base_url}/api/travel-planner/", params=trip_params(i, distinct))
+    if name == "planner_async":
+        return session.get(f"{base_url}/api/travel-planner/async/", params=trip_params(i, distinct))
+    if name == "auth_login":
+        return requests.post(f"{base_url}/auth/login/", data={"username": USERNAME, "password": PASSWORD})
+    if name == "auth_refresh":
+        return session.post(f"{base_url}/auth/refresh/")
+    if name == "auth_user":
+        return session.get(f"{base_url}/auth/user/")
+    raise ValueError(f"unknown scenario {name}")
+
+
+SCENARIOS = ("planner", "planner_async", "auth_login", "auth_refresh", "auth_user")
+
+
+def process_rss(pid):
+    """Resident memory of a process and its descendants in bytes, from /proc; None where that is missing."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+    except (OSError, StopIteration):
+        return None
+    try:
+        children = set()
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.update(int(child) for child in f.read().split())
+    except OSError:
+        children = ()
+    return rss + sum(process_rss(child) or 0 for child in children)
+
+
+class RSSSampler:
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = process_rss(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        if not self.samples:
+            return None
+        mb = [round(sample / 2 ** 20, 1) for sample in self.samples]
+        return {"start": mb[0], "peak": max(mb), "end": mb[-1]}
+
+
+def percentiles(latencies):
+    if not latencies:
+        return None
+    if len(latencies) == 1:
+        cuts = latencies * 99
+    else:
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "mean": round(statistics.fmean(latencies), 2),
+        "p50": round(cuts[49], 2),
+        "p95": round(cuts[94], 2),
+        "p99": round(cuts[98], 2),
+        "max": round(max(latencies), 2),
+    }
+
+
+def server_timing(header):
+    """{name: milliseconds} from a Server-Timing header."""
+    timings = {}
+    for entry in filter(None, (part.strip() for part in (header or "").split(","))):
+        name, *params = entry.split(";")
+        for param in params:
+            if param.startswith("dur="):
+                timings[name] = timings.get(name, 0) + float(param[4:])
+    return timings
+
+
+def run_level(name, base_url, cookies, concurrency, total, warmup, distinct, offset):
+    """Run `total` requests of a scenario with `concurrency` clients; returns its measurements."""
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            local.session.cookies.update(cookies)
+        return local.session
+
+    def one(i):
+        started = time.perf_counter()
+        try:
+            response = scenario_request(name, session(), base_url, offset + i, distinct)
+        except requests.RequestException as e:
+            return (time.perf_counter() - started) * 1000, type(e).__name__, {}
+        return (time.perf_counter() - started) * 1000, response.status_code, \
+            server_timing(response.headers.get("Server-Timing"))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(-warmup, 0)))
+        started = time.perf_counter()
+        outcomes = list(pool.map(one, range(total)))
+        elapsed = time.perf_counter() - started
+
+    statuses = Counter(str(status) for _, status, _ in outcomes)
+    timings = Counter()
+    for _, _, entries in outcomes:
+        timings.update(entries)
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": sum(count for status, count in statuses.items() if not status.startswith("2")),
+        "status_codes": dict(statuses),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2),
+        "latency_ms": percentiles([latency for latency, _, _ in outcomes]),
+        # mean per request of what the server timed, by Server-Timing entry
+        "server_timing_ms": {entry: round(value / total, 2) for entry, value in sorted(timings.items())},
+    }
+
+
+def wait_for_server(base_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}")
+        try:
+            requests.get(f"{base_url}/api/metrics/", timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"server did not answer within {timeout}s")
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated, from: " +
+                        ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario and level")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests before each level")
+    parser.add_argument("--distinct", type=int, default=20,
+                        help="Different trips the planner scenarios cycle through (1: all cache hits)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the stand-ins take to answer")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of upstream calls failing with 503")
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="Directory of recorded upstream payloads")
+    parser.add_argument("--server-cmd", help="Command serving the app, with {bind} for host:port "
+                        "(default: manage.py runserver)")
+    parser.add_argument("--label", default="", help="Free text stored with the results")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary database, cache and logs")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    levels = [int(level) for level in args.concurrency.split(",")]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix="travel-manager-benchmarks-")
+    stubs = start_stubs(fixtures_dir=args.fixtures, latency=args.latency, jitter=args.jitter,
+                        error_rate=args.error_rate)
+    bind = f"127.0.0.1:{free_port()}"
+    base_url = f"http://{bind}"
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": "benchmarks.settings", "BENCHMARK_WORKDIR": workdir,
+           "BENCHMARK_UPSTREAM": stubs.url, "PYTHONUNBUFFERED": "1"}
+    for name in ("AMADEUS_CLIENT_ID", "AMADEUS_CLIENT_SECRET", "GEMINI_API_KEY"):
+        env.setdefault(name, "benchmark")
+
+    manage = [sys.executable, os.path.join(ROOT, "manage.py")]
+    subprocess.run(manage + ["migrate", "--noinput", "-v", "0"], cwd=ROOT, env=env, check=True)
+    subprocess.run(manage + ["shell", "-c", "from django.contrib.auth import get_user_model; "
+                             f"get_user_model().objects.create_user({USERNAME!r}, 'benchmark@example.com', "
+                             f"{PASSWORD!r})"], cwd=ROOT, env=env, check=True)
+
+    command = shlex.split(args.server_cmd.format(bind=bind)) if args.server_cmd else \
+        manage + ["runserver", bind, "--noreload"]
+    log = open(os.path.join(workdir, "server.log"), "w")
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    results = []
+    try:
+        wait_for_server(base_url, server)
+        login = requests.post(f"{base_url}/auth/login/", data={"username": USERNAME, "password": PASSWORD})
+        login.raise_for_status()
+        cookies = login.cookies.get_dict()
+
+        offset = 0
+        for name in scenarios:
+            for concurrency in levels:
+                with RSSSampler(server.pid) as rss:
+                    result = run_level(name, base_url, cookies, concurrency, args.requests, args.warmup,
+                                       max(1, args.distinct), offset)
+                result["rss_mb"] = rss.summary()
+                results.append(result)
+                # with --distinct above the request count, a level does not reuse the trips of the previous one
+                offset += args.requests + args.warmup
+                latency = result["latency_ms"]
+                print(f"{name:<14} c={concurrency:<4} {result['throughput_rps']:>8} req/s  "
+                      f"p50 {latency['p50']:>8} ms  p95 {latency['p95']:>8} ms  p99 {latency['p99']:>8} ms  "
+                      f"errors {result['errors']}")
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        log.close()
+        stubs.shutdown()
+
+    commit, dirty = git_commit()
+    report = {
+        "label": args.label,
+        "commit": commit,
+        "dirty": dirty,
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "server": " ".join(command),
+        "options": {"requests": args.requests, "warmup": args.warmup, "distinct": args.distinct,
+                    "latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate},
+        "upstream": stubs.stats(),
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{(commit or 'unknown')[:8]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.keep:
+        print(f"Database, cache and server log kept in {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
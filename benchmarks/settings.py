@@ -0,0 +1,41 @@
+"""Settings for benchmark runs: upstream calls go to the local stand-ins of benchmarks/stubs.py,
+and the database, cache and metrics live in a throwaway directory.
+
+benchmarks/run.py sets BENCHMARK_WORKDIR and BENCHMARK_UPSTREAM for the server it starts.
+"""
+import os
+from pathlib import Path
+
+from travel_manager_api.settings import *  # noqa: F401,F403
+from travel_manager_api.settings import CACHES, METRICS
+
+WORKDIR = Path(os.environ.get("BENCHMARK_WORKDIR", "/tmp/travel-manager-benchmarks"))
+UPSTREAM = os.environ.get("BENCHMARK_UPSTREAM", "http://127.0.0.1:8901")
+
+DEBUG = False
+ALLOWED_HOSTS = ["127.0.0.1", "localhost"]
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': WORKDIR / 'db.sqlite3',
+    }
+}
+
+CACHES = {
+    'default': {**CACHES['default'], 'LOCATION': WORKDIR / 'cache'},
+    'history': {**CACHES['history'], 'LOCATION': WORKDIR / 'cache' / 'history'},
+}
+
+UPSTREAMS = {
+    "AMADEUS_URL": UPSTREAM,
+    "OPEN_METEO_FORECAST_URL": f"{UPSTREAM}/v1/forecast",
+    "OPEN_METEO_HISTORICAL_URL": f"{UPSTREAM}/v1/forecast",
+    "OPEN_METEO_ARCHIVE_URL": f"{UPSTREAM}/v1/archive",
+    "GEMINI_URL": f"{UPSTREAM}/",
+}
+
+# no climate store, so trips beyond the forecast range exercise the historical weather stand-in
+CLIMATE_NORMALS_PATH = WORKDIR / 'climate.bin'
+
+METRICS = {**METRICS, "SNAPSHOT_DIR": WORKDIR / 'metrics'}
@@ -0,0 +1,172 @@
+"""Local stand-ins for Amadeus, Open-Meteo and Gemini that replay the payloads in benchmarks/fixtures.
+
+Every response is delayed by `latency` ± `jitter` seconds, and a share of
+them (`error_rate`) fails with a 503, to see how the planner behaves when a
+provider is slow or flaky. Fixtures can be swapped for real recordings of the
+same endpoints with `--fixtures`.
+
+    python -m benchmarks.stubs --port 8901 --latency 0.08 --error-rate 0.02
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def load_fixtures(directory=FIXTURES_DIR):
+    fixtures = {}
+    for name in ("amadeus_token", "amadeus_flight_offers", "open_meteo_daily", "gemini_city_guide"):
+        with open(os.path.join(directory, f"{name}.json"), encoding="utf-8") as f:
+            fixtures[name] = json.load(f)
+    return fixtures
+
+
+def flight_offers(fixture, max_results):
+    """The recorded offers, repeated with fresh ids up to `max_results` like a larger search would return."""
+    recorded = fixture["data"]
+    data = []
+    for i in range(max_results):
+        offer = copy.deepcopy(recorded[i % len(recorded)])
+        offer["id"] = str(i + 1)
+        data.append(offer)
+    return {**fixture, "meta": {**fixture["meta"], "count": len(data)}, "data": data}
+
+
+def daily_weather(fixture, query):
+    """The recorded daily values, cycled over the requested dates (or forecast_days from today)."""
+    if "start_date" in query:
+        start, end = date.fromisoformat(query["start_date"]), date.fromisoformat(query["end_date"])
+    else:
+        start = date.today()
+        end = start + timedelta(days=int(query.get("forecast_days", 7)) - 1)
+    recorded = fixture["daily"]
+    days = (end - start).days + 1
+    daily = {"time": [(start + timedelta(days=i)).isoformat() for i in range(days)]}
+    for field in ("weather_code", "temperature_2m_max", "temperature_2m_min"):
+        daily[field] = [recorded[field][i % len(recorded[field])] for i in range(days)]
+    return {**fixture, "latitude": float(query.get("latitude", fixture["latitude"])),
+            "longitude": float(query.get("longitude", fixture["longitude"])), "daily": daily}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fixtures, latency=0.0, jitter=0.0, error_rate=0.0):
+        super().__init__(address, StubHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.counts = Counter()
+        self.injected_errors = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stats(self):
+        with self._lock:
+            return {"requests": dict(self.counts), "injected_errors": dict(self.injected_errors)}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def route(self, method, path):
+        if method == "POST" and path == "/v1/security/oauth2/token":
+            return "amadeus_token"
+        if method == "GET" and path == "/v2/shopping/flight-offers":
+            return "amadeus_flight_offers"
+        if method == "GET" and path in ("/v1/forecast", "/v1/archive"):
+            return "open_meteo"
+        if method == "POST" and path.endswith(":generateContent"):
+            return "gemini"
+        return None
+
+    def respond(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        parts = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        server = self.server
+        name = self.route(method, parts.path)
+
+        delay = server.latency + random.uniform(-server.jitter, server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        with server._lock:
+            server.counts[name or "unknown"] += 1
+            fail = name is not None and random.random() < server.error_rate
+            if fail:
+                server.injected_errors[name] += 1
+
+        if name is None:
+            status, body = 404, {"error": f"no stand-in for {method} {parts.path}"}
+        elif fail:
+            status, body = 503, {"error": "injected failure"}
+        elif name == "amadeus_token":
+            status, body = 200, server.fixtures["amadeus_token"]
+        elif name == "amadeus_flight_offers":
+            status, body = 200, flight_offers(server.fixtures["amadeus_flight_offers"], int(query.get("max", 5)))
+        elif name == "open_meteo":
+            status, body = 200, daily_weather(server.fixtures["open_meteo_daily"], query)
+        else:
+            status, body = 200, server.fixtures["gemini_city_guide"]
+
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.respond("GET")
+
+    def do_POST(self):
+        self.respond("POST")
+
+
+def start_stubs(host="127.0.0.1", port=0, fixtures_dir=FIXTURES_DIR, latency=0.0, jitter=0.0, error_rate=0.0):
+    """Serve the stand-ins from a background thread; port 0 picks a free port (see StubServer.url)."""
+    server = StubServer((host, port), load_fixtures(fixtures_dir), latency, jitter, error_rate)
+    threading.Thread(target=server.serve_forever, name="benchmark-stubs", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="Directory of recorded payloads")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Latency varies by up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of responses that fail with a 503")
+    args = parser.parse_args()
+
+    server = start_stubs(args.host, args.port, args.fixtures, args.latency, args.jitter, args.error_rate)
+    print(f"Upstream stand-ins listening on {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -45,7 +46,16 @@ INSTALLED_APPS = [
     'corsheaders',
 ]
 MIDDLEWARE = [
+    # outermost, so a profile covers every other middleware; removes itself unless PROFILING["ENABLED"]
+    'api.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # times the whole response, compression included
+    'api.middleware.ServerTimingMiddleware',
+    # compresses what the middleware below produces, so ETags are computed on the uncompressed body;
+    # leaves the planner event streams alone so their sections are not held back
+    'api.middleware.GZipMiddleware',
+    # adds ETags to GET responses and answers a matching If-None-Match with a 304
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -97,6 +107,32 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+# shared tier behind the in-process caches in api/services, visible to every worker; the default alias
+# counts its entries every CULL_INTERVAL seconds and then drops expired and least recently written ones,
+# while historical weather, which never changes, goes to the history alias and is never culled
+CACHES = {
+    'default': {
+        'BACKEND': 'api.cache_backends.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'CULL_INTERVAL': 60,
+        },
+    },
+    'history': {
+        'BACKEND': 'api.cache_backends.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'history',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': None,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -141,7 +177,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'auth.authentication.JWTCookieAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'auth.authentication.ClaimsJWTAuthentication',
     ),
 }
 
@@ -160,4 +196,177 @@ SIMPLE_JWT = {
     "AUTH_COOKIE_PATH": "/",  # URL path where cookie will be sent
     # specifies whether the cookie should be sent in cross site requests
     "AUTH_COOKIE_SAMESITE": "Lax",
+    # opt-in: build request.user from the username/email claims embedded at login instead of querying the
+    # database; changes to the user (including deactivation) are then only seen once the access token is reissued
+    "TOKEN_CLAIMS_USER": False,
+    # seconds a worker keeps the id, is_active and is_staff of users it loaded from the database, and how many;
+    # every request still gets its own user instance
+    "USER_CACHE_TTL": 60,
+    "USER_CACHE_SIZE": 1024,
+    # refresh tokens are checked against an in-memory filter of the blacklist first; each worker reads
+    # new blacklist entries every REVOCATION_REFRESH_INTERVAL seconds and rebuilds the filter every
+    # REVOCATION_REBUILD_INTERVAL seconds. Expired tokens are removed by simplejwt's
+    # `manage.py flushexpiredtokens`, e.g. from cron: 15 3 * * * manage.py flushexpiredtokens
+    "REVOCATION_REFRESH_INTERVAL": 5,
+    # each read also reads again the rows blacklisted this many seconds before the previous one, for rows
+    # that committed after rows written later (longer than the slowest blacklisting transaction)
+    "REVOCATION_REFRESH_MARGIN": 60,
+    "REVOCATION_REBUILD_INTERVAL": 60 * 60,
+    "REVOCATION_ERROR_RATE": 0.001,
+}
+
+TRAVEL_PLANNER = {
+    # upper bound on concurrent upstream calls made by planner requests
+    "MAX_WORKERS": 16,
+    # seconds each planner section may take before it is reported as unavailable
+    "SECTION_TIMEOUTS": {
+        "flights": 15,
+        "weather": 5,
+        "landmarks": 10,
+        "travel_tips": 10,
+    },
+    # how far from destinationLat/destinationLon the planner looks for an airport (km)
+    "DESTINATION_RADIUS_KM": 150,
+    # flexibleDays: widest departure window searched (+/- days) and concurrent searches per plan
+    "FLEXIBLE_MAX_DAYS": 3,
+    "FLEXIBLE_MAX_WORKERS": 4,
+    # batch planner: trips per request, concurrent upstream calls across all batches, seconds per batch
+    "BATCH_MAX_TRIPS": 20,
+    "BATCH_MAX_WORKERS": 8,
+    "BATCH_TIMEOUT": 30,
+    # offers searched once when a plan sorts, filters or pages flights; also the largest page
+    "FLIGHT_OFFERS_POOL": 50,
+}
+
+# where outbound calls go; None keeps the SDK's own endpoint. benchmarks/settings.py points them at local stand-ins
+UPSTREAMS = {
+    # e.g. "http://127.0.0.1:8901"; the Amadeus SDK otherwise uses its test environment
+    "AMADEUS_URL": None,
+    "OPEN_METEO_FORECAST_URL": "https://api.open-meteo.com/v1/forecast",
+    "OPEN_METEO_HISTORICAL_URL": "https://historical-forecast-api.open-meteo.com/v1/forecast",
+    "OPEN_METEO_ARCHIVE_URL": "https://archive-api.open-meteo.com/v1/archive",
+    "GEMINI_URL": None,
+    # seconds a Gemini call may take before it is abandoned
+    "GEMINI_TIMEOUT": 30,
+}
+
+# pooled outbound HTTP clients used by api/services
+OUTBOUND_HTTP = {
+    # async client (httpx), shared by every host
+    "MAX_CONNECTIONS": 200,
+    "MAX_KEEPALIVE_CONNECTIONS": 50,
+    # sync session (requests): number of host pools and connections kept per host
+    "POOL_HOSTS": 10,
+    "POOL_MAXSIZE": 20,
+    "CONNECT_TIMEOUT": 5,
+    "READ_TIMEOUT": 20,
+    # retries on 429/5xx and connection errors, with exponential backoff plus jitter (seconds); Gemini calls,
+    # made by genai's own client, get the same policy
+    "RETRIES": 2,
+    "BACKOFF_FACTOR": 0.3,
+    "BACKOFF_JITTER": 0.3,
+    "BACKOFF_MAX": 5,
+}
+
+TRAVEL_CACHE = {
+    # entries kept in each process before the least recently used is evicted
+    "LOCAL_MAXSIZE": 2048,
+    # coordinates are snapped to this grid so nearby destinations share a forecast
+    "WEATHER_GRID_DEGREES": 0.1,
+    # seconds a forecast is reused; historical weather is kept forever
+    "WEATHER_FORECAST_TTL": 60 * 60,
+    # seconds generated landmarks and travel tips are reused
+    "CITY_CONTENT_TTL": 60 * 60 * 24 * 30,
+    # minutes an Amadeus flight search is reused for the same search tuple
+    "FLIGHT_OFFERS_TTL_MINUTES": 10,
+    # seconds a last known good value is kept to answer while its provider is down
+    "STALE_TTL": 60 * 60 * 24 * 7,
+    # seconds a caller waits on an identical call already in flight before giving up on it
+    "COALESCE_WAIT": 30,
+}
+
+# compact airport table, built from airportsdata on first use or with `manage.py build_airport_index`
+AIRPORT_INDEX_PATH = BASE_DIR / 'data' / 'airports.bin'
+
+# daily climate normals answering the weather of trips beyond the forecast range,
+# built and refreshed with `manage.py build_climate_normals`; without it the historical API is used
+CLIMATE_NORMALS_PATH = BASE_DIR / 'data' / 'climate.bin'
+CLIMATE_NORMALS = {
+    # cell size of the store; a destination uses the normals of the cell it falls in
+    "GRID_DEGREES": 0.25,
+    # past full years averaged into the normals
+    "YEARS": 10,
+}
+
+# each worker writes its metrics to SNAPSHOT_DIR (local to the host) every SNAPSHOT_INTERVAL seconds while
+# busy; /api/metrics/ exports those of live workers, one series per pid, and deletes the snapshots of workers
+# that exited or wrote none for SNAPSHOT_RETENTION seconds
+METRICS = {
+    "SNAPSHOT_DIR": BASE_DIR / 'data' / 'metrics',
+    "SNAPSHOT_INTERVAL": 10,
+    "SNAPSHOT_RETENTION": 60 * 60,
+    # scrapers send "Authorization: Bearer <TOKEN>"; without a token the endpoint is closed. A reverse proxy
+    # makes every request come from its own address, so the address alone does not keep it private
+    "TOKEN": os.getenv("METRICS_TOKEN"),
+    # additionally, addresses allowed to scrape /api/metrics/, None to allow any
+    "ALLOWED_IPS": None,
+}
+
+# WARM_UP loads the airport and climate data and PRELOAD_MODULES when the app starts, for pre-fork servers
+# that load it once in the master (gunicorn --preload) so workers share it copy-on-write; FREEZE_GC moves
+# everything loaded so far out of the collector's reach, so collections do not copy those pages per worker
+STARTUP = {
+    "WARM_UP": False,
+    "PRELOAD_MODULES": ("google.genai",),
+    "FREEZE_GC": True,
+}
+
+# request profiling (api.middleware.ProfilingMiddleware): a SAMPLE_RATE share of requests, plus requests of
+# staff users sending HEADER, are profiled into OUTPUT_DIR, which keeps the newest MAX_PROFILES
+PROFILING = {
+    "ENABLED": False,
+    "SAMPLE_RATE": 0.0,
+    "HEADER": "X-Profile",
+    "OUTPUT_DIR": BASE_DIR / 'data' / 'profiles',
+    "MAX_PROFILES": 200,
+    "TOP_FUNCTIONS": 30,
+    # also report the allocation sites that grew during the request (tracemalloc, slows the request down)
+    "TRACE_ALLOCATIONS": True,
+    "TRACEMALLOC_FRAMES": 1,
+}
+
+# `manage.py warm_caches` (or warm_services.warm_caches from a scheduler) prefetches what recent
+# planner traffic asks for most: TOP_DESTINATIONS city guides and forecasts and TOP_ROUTES flight
+# searches over the last TRAFFIC_DAYS days, through MAX_WORKERS threads at background priority
+CACHE_WARMING = {
+    "TRAFFIC_DAYS": 7,
+    "TOP_DESTINATIONS": 20,
+    "TOP_ROUTES": 20,
+    "MAX_WORKERS": 4,
+    # trip lengths warmed for destinations given explicitly on the command line
+    "TRIP_DAYS": (3, 7),
+    # times a warm-up waits out a provider quota rejection before giving up
+    "QUOTA_RETRIES": 3,
+    # seconds planner traffic is buffered in each worker before it is written
+    "TRAFFIC_FLUSH_INTERVAL": 60,
+    # days of planner traffic kept by `manage.py prune_traffic`
+    "TRAFFIC_RETENTION_DAYS": 30,
+}
+
+# outbound quotas per provider: RATE requests/s refilling a bucket of BURST, at most MAX_CONCURRENCY
+# in flight, MAX_QUEUE callers waiting and MAX_WAIT seconds of waiting before giving up
+RATE_LIMITS = {
+    # Amadeus self-service test environment allows 10 transactions per second
+    "amadeus": {"RATE": 10, "BURST": 10, "MAX_CONCURRENCY": 10, "MAX_QUEUE": 100, "MAX_WAIT": 5},
+    "open_meteo": {"RATE": 10, "BURST": 20, "MAX_CONCURRENCY": 20, "MAX_QUEUE": 200, "MAX_WAIT": 3},
+    # gemini-2.0-flash free tier allows 15 requests per minute
+    "gemini": {"RATE": 0.25, "BURST": 5, "MAX_CONCURRENCY": 5, "MAX_QUEUE": 50, "MAX_WAIT": 8},
+}
+
+# a provider's breaker opens after FAILURE_THRESHOLD consecutive failures and lets a probe
+# through after RESET_TIMEOUT seconds; while it is open, cached sections are served stale
+CIRCUIT_BREAKERS = {
+    "amadeus": {"FAILURE_THRESHOLD": 5, "RESET_TIMEOUT": 30},
+    "open_meteo": {"FAILURE_THRESHOLD": 5, "RESET_TIMEOUT": 30},
+    "gemini": {"FAILURE_THRESHOLD": 3, "RESET_TIMEOUT": 60},
 }